@@ -36,9 +36,6 @@ from pathlib import Path
 import argparse
 import logging
 from datetime import datetime
-from time import sleep
-import numpy as np
-import subprocess
 
 import ktl
 
@@ -65,6 +62,9 @@ p.add_argument("--cds", dest="cds",
     default=False, action="store_true",
     help=("Take data using CDS readout mode? If neither --cds or --mcds are "
           "set, will use current setting."))
+p.add_argument("--profile", dest="profile",
+    default=False, action="store_true",
+    help="Record the timing of each exposure to the nightly exposure profile log?")
 ## add options
 p.add_argument("-f", "--filter", dest="filter", type=str, default='',
     choices=['Y', 'J', 'H', 'K', 'Ks', 'J2', 'J3', 'nb1061', ''],
@@ -105,99 +105,20 @@ mosfireGS = ktl.cache(service='mosfire')
 ##-------------------------------------------------------------------------
 ## acq_long2pos
 ##-------------------------------------------------------------------------
-def acq_long2pos(wide=False, waittime=10, wait_on_slitmov=False):
+def acq_long2pos(wide=False, guidecycles=2):
     '''Execute the offset pattern and trigger images for the long2pos sequence.
-    '''
-    pixel_scale = mosfireGS['pscale'].read(binary=True)
-    offsetx = 245.8 * pixel_scale
-    offsety = -88.0 * pixel_scale
-
-    log.info('Starting long2pos acquisition')
-    log.debug('Setting SCRIPTRUN=1')
-    mosfire.start_scriptrun()
-    log.info('Marking base')
-    mosfire.markbase()
-    log.debug('Setting PATTERN=long2pos')
-    mosfireGS['PATTERN'].write('long2pos')
-
-    log.info('Offsetting to upper left position')
-#     mosfire.mxy(250.25*pixel_scale, -89.0*pixel_scale)
-    mosfire.mxy(offsetx, offsety)
-    log.info(f'Waiting {waittime} seconds for guider')
-    sleep(waittime)
-    log.debug('Setting XOFFSET=-45 YOFFSET=0')
-    mosfireGS['XOFFSET'].write(-45.0)
-    mosfireGS['YOFFSET'].write(0.0)
-
-    if wide is True:
-        log.debug('Setting FRAMEID=A')
-        mosfireGS['FRAMEID'].write('A')
-        log.info('Taking wide slit data')
-        mosfire.take_exposure()
-
-    log.info('acquiring slit nod data in upper left position')
-    mosfire.sltmov(-7)
-    if wait_on_slitmov == True:
-        log.info(f'Waiting {waittime} seconds for guider')
-        sleep(waittime)
-    log.debug('Setting YOFFSET=-7 FRAMEID=B')
-    mosfireGS['YOFFSET'].write(-7.0)
-    mosfireGS['FRAMEID'].write('B')
-    mosfire.take_exposure()
-    mosfire.sltmov(14)
-    if wait_on_slitmov == True:
-        log.info(f'Waiting {waittime} seconds for guider')
-        sleep(waittime)
-    log.debug('Setting YOFFSET=+7 FRAMEID=A')
-    mosfireGS['YOFFSET'].write(7.0)
-    mosfireGS['FRAMEID'].write('A')
-    mosfire.take_exposure()
 
-    log.info(f'Returning to base before offsetting to lower right position')
-    mosfire.gotobase()
-    log.info(f'Waiting {waittime} seconds for guider')
-    sleep(waittime)
-
-    log.info('Offsetting to lower right position')
-#     mosfire.mxy(-250.25*pixel_scale, 89.0*pixel_scale)
-    mosfire.mxy(-offsetx, -offsety)
-    log.info(f'Waiting {waittime} seconds for guider')
-    sleep(waittime)
-    log.debug('Setting XOFFSET=+45 YOFFSET=0')
-    mosfireGS['XOFFSET'].write(+45.0)
-    mosfireGS['YOFFSET'].write(0.0)
-
-    if wide is True:
-        log.debug('Setting FRAMEID=A')
-        mosfireGS['FRAMEID'].write('A')
-        log.info('Taking wide slit data')
-        mosfire.take_exposure()
-
-    log.info('acquiring slit nod data in lower right position')
-    mosfire.sltmov(-7)
-    if wait_on_slitmov == True:
-        log.info(f'Waiting {waittime} seconds for guider')
-        sleep(waittime)
-    log.debug('Setting YOFFSET=-7 FRAMEID=B')
-    mosfireGS['YOFFSET'].write(-7.0)
-    mosfireGS['FRAMEID'].write('B')
-    mosfire.take_exposure()
-    mosfire.sltmov(14)
-    if wait_on_slitmov == True:
-        log.info(f'Waiting {waittime} seconds for guider')
-        sleep(waittime)
-    log.debug('Setting YOFFSET=+7 FRAMEID=A')
-    mosfireGS['YOFFSET'].write(7.0)
-    mosfireGS['FRAMEID'].write('A')
-    mosfire.take_exposure()
-
-    log.info(f'Returning to base')
-    mosfire.gotobase()
-    log.debug('Setting XOFFSET=0 YOFFSET=0')
-    mosfireGS['XOFFSET'].write(0.0)
-    mosfireGS['YOFFSET'].write(0.0)
-    log.debug('Setting SCRIPTRUN=0')
-    mosfire.stop_scriptrun()
+    The offsets and frame keywords are declared in mosfire.dither_patterns
+    ("long2pos" and "long2pos_specphot").  After the large offsets to each
+    slit position we wait guidecycles more guide cycles than after a nod.
+    '''
+    pattern = 'long2pos_specphot' if wide is True else 'long2pos'
+    log.info(f'Starting {pattern} acquisition')
+    for row in mosfire.plan_pattern(pattern):
+        log.debug(f"  FRAMEID={row['frameid']} XOFFSET={row['xoffset']} "
+                  f"YOFFSET={row['yoffset']} offset=({row['dx']:.2f}, "
+                  f"{row['dy']:.2f}){' via base' if row['via_base'] else ''}")
+    mosfire.run_pattern(pattern, nod_cycles=2, settle_cycles=2+guidecycles)
 
 
 def acq_long2pos_specphot():
@@ -240,8 +161,8 @@ def run_acq_long_2pos():
 
     # Set the specified exposure time
     if args.exptime > 0:
-        log.info(f'Setting exposure time to {exptime}')
-        mosfire.set_exptime(exptime)
+        log.info(f'Setting exposure time to {args.exptime}')
+        mosfire.set_exptime(args.exptime)
     # Set the specified sampling mode
     if args.mcds is True:
         log.info(f'Setting sampling mode to MCDS16')
@@ -256,8 +177,11 @@ def run_acq_long_2pos():
         log.info(f'Setting OBSMODE = {obsmode}')
         mosfire.set_obsmode(obsmode)
 
+    if args.profile is True:
+        mosfire.start_exposure_profiling()
+
     specphot = (maskname=='long2pos_specphot')
-    acq_long2pos(wide=specphot, waittime=args.guidecycles*camparms['exptime'])
+    acq_long2pos(wide=specphot, guidecycles=int(args.guidecycles))
 
 
 if __name__ == '__main__':
@@ -7,7 +7,13 @@ from datetime import timedelta
 from time import sleep
 from pathlib import Path
 import argparse
+from concurrent.futures import ProcessPoolExecutor
+import hashlib
+import heapq
+import json
 import logging
+import mmap
+import os
 import re
 import numpy as np
 from astropy.table import Table, Row
@@ -24,7 +30,14 @@ p = argparse.ArgumentParser(description=description)
 p.add_argument("-v", "--verbose", dest="verbose",
     default=False, action="store_true",
     help="Be verbose! (default = False)")
-args = p.parse_args()
+p.add_argument("--history", dest="history",
+    default=False, action="store_true",
+    help="Process all years since 2012 instead of only this year.")
+p.add_argument("--rebuild", dest="rebuild",
+    default=False, action="store_true",
+    help="Parse all log files again instead of only new data.")
+p.add_argument("-j", "--processes", dest="processes", type=int, default=1,
+    help="Number of processes to parse log files with (for --history).")
 
 
 ##-------------------------------------------------------------------------
@@ -32,12 +45,9 @@ args = p.parse_args()
 ##-------------------------------------------------------------------------
 log = logging.getLogger('FindReadTimeouts')
 log.setLevel(logging.DEBUG)
-## Set up console output
+## Set up console output (made verbose by -v after the arguments are parsed)
 LogConsoleHandler = logging.StreamHandler()
-if args.verbose:
-    LogConsoleHandler.setLevel(logging.DEBUG)
-else:
-    LogConsoleHandler.setLevel(logging.WARNING)
+LogConsoleHandler.setLevel(logging.WARNING)
 LogFormat = logging.Formatter('%(asctime)s %(levelname)8s: %(message)s',
                               datefmt='%Y-%m-%d %H:%M:%S')
 LogConsoleHandler.setFormatter(LogFormat)
@@ -50,11 +60,128 @@ log.addHandler(LogConsoleHandler)
 # log.addHandler(LogFileHandler)
 
 
+##-------------------------------------------------------------------------
+## MDS log scanner
+##-------------------------------------------------------------------------
+find_filename = re.compile(r'lastFilename = (Z:.+\\)([\w\d_]+\.fits)')
+find_abort = re.compile(r'Exposure Aborted.*: Fits writing complete')
+timeout_string = 'Exposure Aborted (Read Timeout): Fits writing complete'
+
+
+class MDSLogScanner(object):
+    '''Single pass scanner for MDS logs.  Lines are fed in order.  Each line
+    is checked with a substring test before any regular expression is run.
+
+    An aborted exposure is reported on one line and its file name on the
+    next, so an abort is held as pending until the next line is fed.  This
+    works across chunk and file boundaries.  An abort which is not followed
+    by a file name is recorded with an empty file name.
+    '''
+    def __init__(self):
+        self.all_files = []
+        self.aborted_files = {'Read Timeout': [], 'Abort': []}
+        self.pending = None
+
+    def _resolve(self, line):
+        type_str = self.pending
+        self.pending = None
+        match_filename = find_filename.search(line) if line is not None else None
+        if match_filename is not None:
+            filename = match_filename.group(2)
+            log.info(f'  Found {type_str} on file {filename}')
+        else:
+            filename = ''
+            log.debug(f'  Line after abort: {line}')
+            log.warning(f'  Found {type_str} with no file')
+        self.aborted_files[type_str].append(filename)
+
+    def feed(self, line):
+        if self.pending is not None:
+            self._resolve(line)
+        if 'lastFilename = ' in line:
+            match_filename = find_filename.search(line)
+            if match_filename is not None:
+                self.all_files.append(match_filename.group(2))
+        if 'Exposure Aborted' in line:
+            if find_abort.search(line) is not None:
+                self.pending = {True: 'Read Timeout',
+                                False: 'Abort'}[timeout_string in line]
+
+    def finish(self):
+        if self.pending is not None:
+            self._resolve(None)
+        return self.all_files, self.aborted_files
+
+
+def _find_all(buffer, token, start, stop):
+    position = buffer.find(token, start, stop)
+    while position >= 0:
+        yield position
+        position = buffer.find(token, position + len(token), stop)
+
+
+def _candidate_lines(buffer, start=0, stop=None):
+    '''Yield the lines of buffer[start:stop] (bytes) which can matter to
+    `MDSLogScanner`: lines with a file name or an abort, and the line after
+    each abort.  The buffer is searched for the keywords directly so other
+    lines are never decoded.  start must be the start of a line.
+    '''
+    if stop is None:
+        stop = len(buffer)
+    done_to = start
+    for position in heapq.merge(_find_all(buffer, b'lastFilename = ', start, stop),
+                                _find_all(buffer, b'Exposure Aborted', start, stop)):
+        if position < done_to:
+            continue
+        start = max(buffer.rfind(b'\n', done_to, position) + 1, done_to)
+        while start < stop:
+            end = buffer.find(b'\n', start, stop)
+            end = stop if end < 0 else end + 1
+            line = buffer[start:end]
+            yield line.decode('utf-8', errors='replace')
+            done_to = end
+            if b'Exposure Aborted' not in line:
+                break
+            # Also yield the line after an abort
+            start = end
+
+
+def scan_mds_log(logfile, offset=0, scanner=None, partial=False):
+    '''Memory map logfile and feed the lines after byte offset (which must be
+    the start of a line) to scanner (a new `MDSLogScanner` if None).  A last
+    line with no newline is only fed if partial is True, otherwise the
+    returned offset is the start of that line, so it can be scanned again
+    once it is complete (see `update_scan_entry`).
+
+    Returns the scanner and the byte offset at which the next scan should
+    start.
+    '''
+    if scanner is None:
+        scanner = MDSLogScanner()
+    with open(logfile, 'rb') as fileobj:
+        size = os.fstat(fileobj.fileno()).st_size
+        if size <= offset:
+            return scanner, offset
+        with mmap.mmap(fileobj.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            stop = size if partial is True else buffer.rfind(b'\n', offset) + 1
+            if stop <= offset:
+                return scanner, offset
+            for line in _candidate_lines(buffer, offset, stop):
+                scanner.feed(line)
+    return scanner, stop
+
+
 ##-------------------------------------------------------------------------
 ## find_read_timeouts
 ##-------------------------------------------------------------------------
-def find_read_timeouts(logfile='/s/sdata1300/syslogs/MDS.log',
+def find_read_timeouts(logfile='/s/sdata1300/syslogs/MDS.log', use_mmap=False,
                        skipprecond=False, skippostcond=True):
+    '''Scan an MDS log and return the list of all files written and a dict
+    of the files with a Read Timeout or an Abort.
+
+    If use_mmap is True, the file is memory mapped and only the lines which
+    could match are decoded.
+    '''
     this_script_name = inspect.currentframe().f_code.co_name
     log.debug(f"Executing: {this_script_name}")
 
@@ -71,33 +198,15 @@ def find_read_timeouts(logfile='/s/sdata1300/syslogs/MDS.log',
     ##-------------------------------------------------------------------------
     ## Script Contents
 
-    aborted_files = {'Read Timeout': [], 'Abort': []}
-    all_files = []
+    scanner = MDSLogScanner()
     log.info(f'Reading: {logfile}')
-    with open(logfile, 'r') as fileobj:
-        while True:
-            lines = fileobj.readlines(100000)
-            if not lines:
-                break
-            for i,line in enumerate(lines):
-                match_filename = re.search('lastFilename = (Z:.+\\\\)([\w\d_]+\.fits)', line)
-                if match_filename is not None:
-                    filename = match_filename.group(2)
-                    all_files.append(filename)
-
-                find_abort = re.search('Exposure Aborted.*: Fits writing complete', line)
-                if find_abort is not None:
-                    find_timeout = re.search('Exposure Aborted \(Read Timeout\): Fits writing complete', line)
-                    type_str = {True: 'Read Timeout', False: 'Abort'}[(find_timeout is not None)]
-                    match_filename = re.search('lastFilename = (Z:.+\\\\)([\w\d_]+\.fits)', lines[i+1])
-                    if match_filename is not None:
-                        filename = match_filename.group(2)
-                        log.info(f'  Found {type_str} on file {filename}')
-                    else:
-                        filename = ''
-                        print(lines[i:i+5])
-                        log.warning(f'  Found {type_str} with no file')
-                    aborted_files[type_str].append(filename)
+    if use_mmap is True:
+        scan_mds_log(logfile, scanner=scanner, partial=True)
+    else:
+        with open(logfile, 'r') as fileobj:
+            for line in fileobj:
+                scanner.feed(line)
+    all_files, aborted_files = scanner.finish()
 
     ##-------------------------------------------------------------------------
     ## Post-Condition Checks
@@ -109,10 +218,153 @@ def find_read_timeouts(logfile='/s/sdata1300/syslogs/MDS.log',
     return all_files, aborted_files
 
 
+##-------------------------------------------------------------------------
+## Incremental scan index
+##-------------------------------------------------------------------------
+mds_log_directory = Path('/s/sdata1300/logs/server/mds/')
+head_length = 256
+
+
+def _head(logfile, length):
+    with open(logfile, 'rb') as fileobj:
+        return hashlib.md5(fileobj.read(length)).hexdigest()
+
+
+def update_scan_entry(logfile, entry=None):
+    '''Bring the index entry for one log file up to date, parsing only the
+    bytes appended since it was made.  The file is parsed from the start if
+    there is no entry or the file was truncated or replaced.
+
+    An entry is a dict of the file size, mtime, the byte offset scanned to, a
+    hash of the start of the file, the files, read timeouts, and aborts found,
+    and any abort still waiting for its file name line.  A last line with no
+    newline is scanned separately into the entry's tail (with the same keys),
+    which is not kept when more data is appended, so a file which ends
+    without a newline is still counted in full.
+
+    Returns the entry and the number of bytes parsed.
+    '''
+    stat = os.stat(logfile)
+    if entry is not None and entry['size'] == stat.st_size\
+                         and entry['mtime'] == stat.st_mtime\
+                         and 'tail' in entry:
+        return entry, 0
+    if entry is None or stat.st_size < entry['offset']\
+                     or _head(logfile, entry['headlength']) != entry['head']:
+        entry = {'offset': 0, 'all_files': [], 'Read Timeout': [], 'Abort': [],
+                 'pending': None}
+    scanner = MDSLogScanner()
+    scanner.all_files = list(entry['all_files'])
+    scanner.aborted_files = {'Read Timeout': list(entry['Read Timeout']),
+                             'Abort': list(entry['Abort'])}
+    scanner.pending = entry['pending']
+    start = entry['offset']
+    scanner, offset = scan_mds_log(logfile, offset=start, scanner=scanner)
+    tail = MDSLogScanner()
+    tail.pending = scanner.pending
+    tail, end = scan_mds_log(logfile, offset=offset, scanner=tail, partial=True)
+    headlength = min(stat.st_size, head_length)
+    entry = {'size': stat.st_size,
+             'mtime': stat.st_mtime,
+             'offset': offset,
+             'headlength': headlength,
+             'head': _head(logfile, headlength),
+             'all_files': scanner.all_files,
+             'Read Timeout': scanner.aborted_files['Read Timeout'],
+             'Abort': scanner.aborted_files['Abort'],
+             'pending': scanner.pending,
+             'tail': {'all_files': tail.all_files,
+                      'Read Timeout': tail.aborted_files['Read Timeout'],
+                      'Abort': tail.aborted_files['Abort'],
+                      'pending': tail.pending}}
+    return entry, end - start
+
+
+class ScanIndex(object):
+    '''Persistent index (a JSON file) of the scan of each MDS log file in a
+    year (see `update_scan_entry`), so each run only parses appended bytes
+    and new files.
+    '''
+    def __init__(self, indexfile):
+        self.indexfile = Path(indexfile)
+        self.entries = {}
+        if self.indexfile.exists() is True:
+            try:
+                with open(self.indexfile, 'r') as fileobj:
+                    self.entries = json.load(fileobj)
+            except ValueError:
+                log.warning(f'Could not read {self.indexfile}, rebuilding it')
+
+    def update(self, logfiles, executor=None):
+        '''Update the entries for the given log files and drop entries for
+        files which no longer exist.  If an executor (e.g. a process pool) is
+        given, the files are parsed in parallel on it.
+
+        Returns the number of files parsed and the number of bytes parsed.
+        '''
+        names = [logfile.name for logfile in logfiles]
+        self.entries = {name: entry for name, entry in self.entries.items()
+                        if name in names}
+        if executor is None:
+            results = [update_scan_entry(logfile, self.entries.get(logfile.name))
+                       for logfile in logfiles]
+        else:
+            futures = [executor.submit(update_scan_entry, logfile,
+                                       self.entries.get(logfile.name))
+                       for logfile in logfiles]
+            results = [future.result() for future in futures]
+        nparsed = 0
+        nbytes = 0
+        for logfile, (entry, parsed) in zip(logfiles, results):
+            self.entries[logfile.name] = entry
+            nparsed += int(parsed > 0)
+            nbytes += parsed
+        return nparsed, nbytes
+
+    def clear(self):
+        '''Forget all entries so every file is parsed again.
+        '''
+        self.entries = {}
+
+    def results(self, logfiles):
+        '''Return the files and aborted files of the given log files in order,
+        as `find_read_timeouts` would.  The tail of each entry (a last line
+        with no newline) is included, and an abort still waiting for its file
+        name line is counted with an empty file name.
+        '''
+        all_files = []
+        aborted_files = {'Read Timeout': [], 'Abort': []}
+        for logfile in logfiles:
+            entry = self.entries[logfile.name]
+            for scanned in [entry, entry['tail']]:
+                all_files.extend(scanned['all_files'])
+                aborted_files['Read Timeout'].extend(scanned['Read Timeout'])
+                aborted_files['Abort'].extend(scanned['Abort'])
+            if entry['tail']['pending'] is not None:
+                aborted_files[entry['tail']['pending']].append('')
+        return all_files, aborted_files
+
+    def save(self):
+        tmpfile = self.indexfile.with_name(f'{self.indexfile.name}.tmp')
+        with open(tmpfile, 'w') as fileobj:
+            json.dump(self.entries, fileobj)
+        tmpfile.replace(self.indexfile)
+
+
 ##-------------------------------------------------------------------------
 ## find_read_timeouts_by_year
 ##-------------------------------------------------------------------------
-def find_read_timeouts_by_year(year, skipprecond=False, skippostcond=True):
+def find_read_timeouts_by_year(year, use_index=True, rebuild=False,
+                               executor=None, skipprecond=False,
+                               skippostcond=True):
+    '''Count the read timeouts and aborts in the MDS logs for a year and write
+    them to aborts_20YY.log.  If use_index is True, the scan results are kept
+    in aborts_20YY_index.json and only new log data is parsed (all of it if
+    rebuild is True).  If an executor is given, the log files are parsed in
+    parallel on it.
+
+    Returns the number of bytes parsed.
+    '''
     this_script_name = inspect.currentframe().f_code.co_name
     log.debug(f"Executing: {this_script_name}")
 
@@ -127,7 +379,7 @@ def find_read_timeouts_by_year(year, skipprecond=False, skippostcond=True):
     ##-------------------------------------------------------------------------
     ## Script Contents
     
-    abort_file = Path(f'/s/sdata1300/logs/server/mds/aborts_20{year}.log')
+    abort_file = mds_log_directory / f'aborts_20{year}.log'
     if abort_file.exists() is True:
         with open(abort_file, 'r') as abort_file_obj:
             lines = abort_file_obj.readlines()
@@ -143,31 +395,40 @@ def find_read_timeouts_by_year(year, skipprecond=False, skippostcond=True):
                 nall0 = 0
                 naborted0 = 0
                 ntimeout0 = 0
-        abort_file.unlink()
     else:
         nall0 = 0
         naborted0 = 0
         ntimeout0 = 0
-    aborted_files = {'Read Timeout': [], 'Abort': []}
-    all_files = []
 
-    logfiles = [lf for lf in Path('/s/sdata1300/logs/server/mds/').glob(f'{year}*_mds.log')]
+    logfiles = [lf for lf in mds_log_directory.glob(f'{year}*_mds.log')]
     logfiles.sort()
 
     log.info(f'## Building abort count for {len(logfiles)} log files in 20{year} ##')
 
-    for logfile in logfiles:
-        new_all_files, new_aborted_files = find_read_timeouts(logfile=logfile)
-        all_files.extend(new_all_files)
-        aborted_files['Read Timeout'].extend(new_aborted_files['Read Timeout'])
-        aborted_files['Abort'].extend(new_aborted_files['Abort'])
+    if use_index is True:
+        index = ScanIndex(abort_file.with_name(f'aborts_20{year}_index.json'))
+        if rebuild is True:
+            index.clear()
+        nparsed, nbytes = index.update(logfiles, executor=executor)
+        log.info(f'Parsed {nbytes/1e6:.1f} MB in {nparsed} of {len(logfiles)} log files')
+        all_files, aborted_files = index.results(logfiles)
+        index.save()
+    else:
+        aborted_files = {'Read Timeout': [], 'Abort': []}
+        all_files = []
+        nbytes = sum([logfile.stat().st_size for logfile in logfiles])
+        for logfile in logfiles:
+            new_all_files, new_aborted_files = find_read_timeouts(logfile=logfile)
+            all_files.extend(new_all_files)
+            aborted_files['Read Timeout'].extend(new_aborted_files['Read Timeout'])
+            aborted_files['Abort'].extend(new_aborted_files['Abort'])
 
     nall = len(all_files)
     naborted = len(aborted_files['Abort'])
     ntimeout = len(aborted_files['Read Timeout'])
     with open(abort_file, 'w') as abortfileobj:
         abortfileobj.write(f'Count of Read Timeout/Aborted/Total = {ntimeout}/{naborted}/{nall}\n')
-        abortfileobj.write(f'Percent of Read Timeout/Aborted = {ntimeout/nall:.2%}/{naborted/nall:.2%}\n')
+        abortfileobj.write(f'Percent of Read Timeout/Aborted = {ntimeout/max(nall, 1):.2%}/{naborted/max(nall, 1):.2%}\n')
 
         abortfileobj.write(f'\nRead Timeout:\n')
         for filename in aborted_files['Read Timeout']:
@@ -185,10 +446,10 @@ def find_read_timeouts_by_year(year, skipprecond=False, skippostcond=True):
         print(f'{new_aborted} new Aborts')
         print(f'out of {new_all} new frames taken\n')
         print('    New Read Timeouts:\n')
-        for file in aborted_files['Read Timeout'][-new_timeout:]:
+        for file in aborted_files['Read Timeout'][ntimeout-max(new_timeout, 0):]:
             print(file)
         print('    New Aborts:\n')
-        for file in aborted_files['Abort'][-new_timeout:]:
+        for file in aborted_files['Abort'][naborted-max(new_aborted, 0):]:
             print(file)
 
     ##-------------------------------------------------------------------------
@@ -198,13 +459,21 @@ def find_read_timeouts_by_year(year, skipprecond=False, skippostcond=True):
     else:
         pass
 
+    return nbytes
+
 
 ##-------------------------------------------------------------------------
 ## generate_read_timeout_history
 ##-------------------------------------------------------------------------
-def generate_read_timeout_history(skipprecond=False, skippostcond=True):
+def generate_read_timeout_history(nprocesses=1, rebuild=False,
+                                  skipprecond=False, skippostcond=True):
     '''Loop through years since 2012, process all mds log files, and write
     aborted files.
+
+    If nprocesses is more than 1, the log files of each year are parsed in
+    parallel by a pool of processes.  The results are merged in file order,
+    so the output is the same as in serial.  If rebuild is True, every file
+    is parsed again (e.g. after a parser fix).
     '''
     this_script_name = inspect.currentframe().f_code.co_name
     log.debug(f"Executing: {this_script_name}")
@@ -222,9 +491,20 @@ def generate_read_timeout_history(skipprecond=False, skippostcond=True):
     now_year = int(datetime.now().strftime('%y'))
     year = 12
 
-    while year <= now_year:
-        find_read_timeouts_by_year(year)
-        year += 1
+    executor = ProcessPoolExecutor(max_workers=nprocesses) if nprocesses > 1 else None
+    start = datetime.now()
+    nbytes = 0
+    try:
+        while year <= now_year:
+            nbytes += find_read_timeouts_by_year(year, rebuild=rebuild,
+                                                 executor=executor)
+            year += 1
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    elapsed = (datetime.now() - start).total_seconds()
+    print(f'Parsed {nbytes/1e6:.1f} MB in {elapsed:.1f} s '
+          f'({nbytes/1e6/max(elapsed, 1e-6):.1f} MB/s) using {nprocesses} processes')
 
     ##-------------------------------------------------------------------------
     ## Post-Condition Checks
@@ -328,6 +608,16 @@ def find_read_timeouts_in_syslog(skipprecond=False, skippostcond=True):
 
 
 if __name__ == '__main__':
-    now_year = int(datetime.now().strftime('%y'))
-    find_read_timeouts_by_year(now_year)
+    # Parse the arguments only when run as a script, so that the processes of
+    # the pool (which import this module under the spawn start method) do
+    # not parse their own command lines
+    args = p.parse_args()
+    if args.verbose:
+        LogConsoleHandler.setLevel(logging.DEBUG)
+    if args.history is True:
+        generate_read_timeout_history(nprocesses=args.processes,
+                                      rebuild=args.rebuild)
+    else:
+        now_year = int(datetime.now().strftime('%y'))
+        find_read_timeouts_by_year(now_year, rebuild=args.rebuild)
 #     find_read_timeouts_in_syslog()
\ No newline at end of file
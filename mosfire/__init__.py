@@ -9,9 +9,15 @@ from .detector import *
 from .rotator import *
 from .hatch import *
 from .power import *
+from .journal import *
+from .planner import *
 from .calibration import *
 from .checkout import *
 from .analysis import *
+from .quicklook import *
 from .shutdown import *
 from .utilities import *
 from .tel import *
+from .sequencer import *
+from .patterns import *
+from .state import *
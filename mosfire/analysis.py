@@ -7,12 +7,12 @@ plt.ioff()
 
 import numpy as np
 from scipy import ndimage
-from astropy.io import fits
 from astropy import visualization as viz
 from astropy.modeling import models, fitting
 
 from .core import *
 from .csu import slit_to_bars, physical_to_pixel, pixel_to_physical, bar_to_slit
+from .quicklook import quicklook_frame
 
 
 ## ------------------------------------------------------------------
@@ -75,14 +75,7 @@ def find_bar_positions_from_image(imagefile, filtersize=5, plot=False,
     '''
     ## Get image from file
     imagefile = Path(imagefile).absolute()
-    try:
-        hdul = fits.open(imagefile)
-        data = hdul[0].data
-    except Error as e:
-        log.error(e)
-        raise
-    # median X pixels only (preserve Y structure)
-    medimage = ndimage.median_filter(data, size=(1, filtersize))
+    frame = quicklook_frame(imagefile)
     
     bars = {}
     bars_mm = {}
@@ -94,7 +87,10 @@ def find_bar_positions_from_image(imagefile, filtersize=5, plot=False,
         y2 = int(np.floor((physical_to_pixel(np.array([(270.4, slit-0.5)])))[0][0][1])) - pixel_shim
         ypos[b1] = [y1, y2]
         ypos[b2] = [y1, y2]
-        gradx = np.gradient(medimage[y1:y2,:], axis=1)
+        # median X pixels only (preserve Y structure), so only the rows of
+        # this slit need to be read
+        medimage = ndimage.median_filter(frame.rows(y1, y2), size=(1, filtersize))
+        gradx = np.gradient(medimage, axis=1)
         horizontal_profile = np.sum(gradx, axis=0)
         try:
             bars[b1], bars[b2] = find_bar_edges(horizontal_profile)
@@ -109,6 +105,7 @@ def find_bar_positions_from_image(imagefile, filtersize=5, plot=False,
         plotfile = imagefile.with_name(f"{imagefile.stem}.png")
         log.info(f'Creating PNG image {plotfile}')
         if plotfile.exists(): plotfile.unlink()
+        data = frame.rows(0, frame.shape[0])
         plt.figure(figsize=(16,16), dpi=300)
         norm = viz.ImageNormalize(data, interval=viz.PercentileInterval(99.9),
                                   stretch=viz.LinearStretch())
@@ -180,4 +177,91 @@ def find_individual_slits(imagefile, filtersize=3, plot=True):
         leftbar, rightbar = slit_to_bars(slit)
         xpix = np.mean( [foundbars[leftbar], foundbars[rightbar]] )
     
-    
\ No newline at end of file
+    
+
+## ------------------------------------------------------------------
+##  Statistics in Slit Regions
+## ------------------------------------------------------------------
+def slit_regions(mask, imaging=False, pixel_shim=5, npix=2048):
+    '''Using the affine transformation determined by `fit_transforms`, return
+    a list of (y1, y2, x1, x2) pixel boxes, one for each slit in the mask.
+
+    The Y range covers the slit (less pixel_shim pixels at each end).  For
+    imaging, the X range is the gap between the two bars, at least one pixel
+    wide.  It is not shimmed because a narrow slit is only a few pixels wide.
+    For spectroscopy, the slit is dispersed across the detector, so the X
+    range is the central half of the detector.
+    '''
+    regions = []
+    for row in mask.slitpos:
+        slit = int(row['slitNumber'])
+        left_mm = float(row['leftBarPositionMM'])
+        right_mm = float(row['rightBarPositionMM'])
+        mid_mm = (left_mm + right_mm)/2
+        ypix = physical_to_pixel(np.array([(mid_mm, slit-0.5),
+                                           (mid_mm, slit+0.5)]))
+        ymin, ymax = sorted([ypix[0][0][1], ypix[1][0][1]])
+        y1 = max(int(np.ceil(ymin)) + pixel_shim, 0)
+        y2 = min(int(np.floor(ymax)) - pixel_shim, npix)
+        if imaging is True:
+            if left_mm <= right_mm:
+                # Closed slit
+                continue
+            xpix = physical_to_pixel(np.array([(left_mm, slit),
+                                               (right_mm, slit)]))
+            xmin, xmax = sorted([xpix[0][0][0], xpix[1][0][0]])
+            x1 = min(max(int(np.round(xmin)), 0), npix-1)
+            x2 = min(max(int(np.round(xmax)), x1+1), npix)
+        else:
+            x1, x2 = int(npix/4), int(3*npix/4)
+        if y2 > y1 and x2 > x1:
+            regions.append( (y1, y2, x1, x2) )
+    return regions
+
+
+def slit_region_median(imagefile, mask, imaging=False, pixel_shim=5):
+    '''Return the median counts inside the slit regions (see `slit_regions`)
+    of an image.  Only the slit regions are read (see `QuickLookFrame`).
+    '''
+    frame = quicklook_frame(imagefile)
+    return frame.region_median(slit_regions(mask, imaging=imaging,
+                                            pixel_shim=pixel_shim,
+                                            npix=frame.shape[0]))
+
+
+## ------------------------------------------------------------------
+##  Quick Look Metrics for Calibration Frames
+## ------------------------------------------------------------------
+def calibration_frame_metrics(imagefile, mask=None, imaging=False,
+                              saturation=30000, pixel_shim=5):
+    '''Compute quick look metrics for a calibration frame:
+    - saturated_fraction: the fraction of pixels above the saturation level
+      (counts per coadd), estimated from every 8th row
+    - slit_median: the median counts in the slit regions (see `slit_regions`)
+      or in the central part of the array if no mask is given
+    - line_snr: the peak of a 1D collapse of the slit rows along Y compared
+      to the scatter of that collapse, a cheap check that arc lines are
+      present
+
+    Only the rows needed are read (see `QuickLookFrame`).
+    '''
+    frame = quicklook_frame(imagefile)
+    npix = frame.shape[0]
+    saturated_fraction = frame.saturated_fraction(saturation)
+    if mask is not None:
+        regions = slit_regions(mask, imaging=imaging,
+                               pixel_shim=pixel_shim, npix=npix)
+    else:
+        regions = [(int(npix/4), int(3*npix/4), int(npix/4), int(3*npix/4))]
+    if len(regions) == 0:
+        return {'saturated_fraction': saturated_fraction,
+                'slit_median': np.nan, 'line_snr': np.nan}
+    slit_median = frame.region_median(regions)
+    collapsed = np.median(np.vstack([frame.rows(y1, y2)
+                                     for y1, y2, x1, x2 in regions]), axis=0)
+    background = np.median(collapsed)
+    scatter = 1.4826*np.median(np.abs(collapsed - background))
+    line_snr = float((np.max(collapsed) - background)/scatter) if scatter > 0 else np.nan
+    return {'saturated_fraction': saturated_fraction,
+            'slit_median': slit_median,
+            'line_snr': line_snr}
@@ -1,28 +1,171 @@
 #!kpython3
+'''Calibration scripts: arcs and dome flats for a list of masks and filters
+(see `take_calibrations`).  The calibration journal and the index of frames
+already on disk are in journal.py, and the calibration planner and dry run
+time estimate are in planner.py.
+
+The functions which take calibrations share these optional arguments:
+
+journal: a `CalibrationJournal`.  Frames it lists as taken are skipped and
+    new frames are recorded in it.
+state: an `InstrumentState`.  Mechanism commands are issued through it so
+    that commands which are not needed are skipped.  If None, every command
+    is issued.
+qa: a `CalibrationQA`.  Each frame is passed to it to be checked.
+runner: a stand in for `run_steps` (e.g. a `StepTimeEstimate`).  The steps
+    of each set of calibrations are passed to it instead of being run.
+'''
 
 ## Import General Tools
 import inspect
-from datetime import datetime, timedelta
-from time import sleep
 from pathlib import Path
 import configparser
+from concurrent.futures import ThreadPoolExecutor
+import re
 import numpy as np
+from astropy.table import Table
 
 from .core import *
 from .mask import Mask
-from .filter import go_dark
-from .obsmode import set_obsmode
-from .csu import setup_mask, execute_mask
-from .hatch import open_hatch, close_hatch
-from .detector import take_exposure
-from .domelamps import dome_flat_lamps
-from .power import Ne_lamp, Ar_lamp
+from .csu import read_csu_bar_state
+from .detector import (take_exposure, saturation_level, exposure_frame,
+                       ExposureSequence)
+from .metadata import outdir, lastfile
+from .sequencer import step, run_steps
+from .state import InstrumentState
+from .analysis import slit_region_median, calibration_frame_metrics
+from .journal import (CalibrationJournal, index_calibration_frames,
+                      count_existing_frames, _remaining, _record,
+                      _recorded_exptime, _record_exptime)
+from .planner import (calibration_blocks, plan_calibrations, DryRunState,
+                      StepTimeEstimate)
 
 
 ##-------------------------------------------------------------------------
 ## Sub-function: Read Configuration
 ##-------------------------------------------------------------------------
+class CalibrationSettings(object):
+    '''The calibration settings for one configuration section: a filter for
+    spectroscopy (e.g. "K") or a filter for imaging (e.g. "K-imaging").
+
+    Each option in the options dict below becomes an attribute with the
+    given type.  Options are converted and validated once when the
+    configuration is read, so a malformed configuration fails before any
+    mechanism moves.
+    '''
+    # option name: (type, default)
+    options = {'flat_count': (int, 0),
+               'flat_power': (float, 0),
+               'flat_exptime': (float, 11),
+               'flat_coadds': (int, 1),
+               'flat_sampmode': (str, 'CDS'),
+               'flatoff_count': (int, 0),
+               'ne_arc_count': (int, 0),
+               'ne_arc_exptime': (float, 2),
+               'ne_arc_coadds': (int, 1),
+               'ne_arc_sampmode': (str, 'CDS'),
+               'ar_arc_count': (int, 0),
+               'ar_arc_exptime': (float, 2),
+               'ar_arc_coadds': (int, 1),
+               'ar_arc_sampmode': (str, 'CDS'),
+               # Adaptive flats (see tune_flat_exptime)
+               'flat_probe_exptime': (float, None),
+               'flat_target_counts': (float, 15000),
+               'flat_min_exptime': (float, 2),
+               'flat_max_exptime': (float, 120),
+               # Quality checks (see CalibrationQA)
+               'qa_max_saturated_fraction': (float, 0.01),
+               'qa_min_flat_counts': (float, 1000),
+               'qa_min_line_snr': (float, 10),
+               }
+
+    def __init__(self, section, values=None):
+        self.section = section
+        self.imaging = section.endswith('-imaging')
+        self.filter = section.replace('-imaging', '')
+        if self.filter not in filters:
+            raise FailedCondition(f'[{section}] Unknown filter "{self.filter}"')
+        values = dict() if values is None else dict(values)
+        unknown = set(values.keys()) - set(self.options.keys())
+        if len(unknown) > 0:
+            raise FailedCondition(f'[{section}] Unknown options: {", ".join(sorted(unknown))}')
+        for name, (option_type, default) in self.options.items():
+            value = values.get(name, default)
+            if value is not None:
+                try:
+                    value = option_type(value)
+                except ValueError:
+                    raise FailedCondition(f'[{section}] Unable to interpret '
+                                          f'{name} = "{value}" as {option_type.__name__}')
+            setattr(self, name, value)
+        self.validate()
+
+    def validate(self):
+        for name, (option_type, default) in self.options.items():
+            value = getattr(self, name)
+            if name.endswith('_sampmode'):
+                if re.fullmatch(r'CDS|MCDS\d+', value) is None:
+                    raise FailedCondition(f'[{self.section}] Unknown sampling '
+                                          f'mode {name} = "{value}"')
+            elif value is not None and option_type in [int, float] and value < 0:
+                raise FailedCondition(f'[{self.section}] {name} = {value} is negative')
+        for prefix in ['flat', 'ne_arc', 'ar_arc']:
+            if getattr(self, f'{prefix}_coadds') < 1:
+                raise FailedCondition(f'[{self.section}] {prefix}_coadds must be at least 1')
+        if self.flat_count > 0 and self.flat_power > 20:
+            raise FailedCondition(f'[{self.section}] flat_power = {self.flat_power} '
+                                  f'must be between 20 (low) and 0 (high)')
+        if self.imaging is True and self.ne_arc_count + self.ar_arc_count > 0:
+            raise FailedCondition(f'[{self.section}] Arcs can not be taken in imaging mode')
+
+    def to_dict(self):
+        '''Return the options as a dict of plain values (options which are
+        not set are left out).
+        '''
+        return {name: getattr(self, name) for name in self.options.keys()
+                if getattr(self, name) is not None}
+
+    def __repr__(self):
+        return f"CalibrationSettings({self.section!r}, {self.to_dict()!r})"
+
+    # Compatibility with the configparser section which read_calibration_config
+    # used to return, so callers using cfg[section].getint(...) still work
+    def __getitem__(self, name):
+        if getattr(self, name, None) is None:
+            raise KeyError(name)
+        return str(getattr(self, name))
+
+    def __contains__(self, name):
+        return getattr(self, name, None) is not None
+
+    def get(self, name, fallback=None):
+        return getattr(self, name) if name in self else fallback
+
+    def getint(self, name, fallback=None):
+        return int(self.get(name)) if name in self else fallback
+
+    def getfloat(self, name, fallback=None):
+        return float(self.get(name)) if name in self else fallback
+
+
+class CalibrationConfig(dict):
+    '''The calibration configuration: a dict of `CalibrationSettings` keyed
+    by section name.  sections() is kept for callers of the configparser
+    object which read_calibration_config used to return.
+    '''
+    def sections(self):
+        return list(self.keys())
+
+
 def read_calibration_config(input):
+    '''Read the calibration configuration and return a `CalibrationConfig`
+    (a dict of `CalibrationSettings` keyed by section name).  The input may be
+    None (use default_calibrations.cfg), a path to a config file, a dict of
+    sections (each a dict of options), or an already read configuration.
+    '''
+    if isinstance(input, dict) and len(input) > 0 and\
+       all([isinstance(value, CalibrationSettings) for value in input.values()]):
+        return input if isinstance(input, CalibrationConfig) else CalibrationConfig(input)
     cfg = configparser.ConfigParser()
     if input is None:
         log.debug('Using default config file')
@@ -36,114 +179,550 @@ def read_calibration_config(input):
         cfg.read_dict(input)
     else:
         raise FailedCondition(f"Unable to interpret {input} as configuration")
-    return cfg
+    return CalibrationConfig({section: CalibrationSettings(section, cfg[section])
+                              for section in cfg.sections()})
+
+
+def write_calibration_config(cfg, outfile):
+    '''Write a configuration from `read_calibration_config` to a config file
+    which can be read back in.
+    '''
+    parser = configparser.ConfigParser()
+    parser.read_dict({section: {name: str(value) for name, value
+                                in settings.to_dict().items()}
+                      for section, settings in cfg.items()})
+    with open(Path(outfile).expanduser(), 'w') as FO:
+        parser.write(FO)
+
+
+##-------------------------------------------------------------------------
+## Existing Calibration Frames
+##-------------------------------------------------------------------------
+def mark_existing_frames(journal, index, calibration_inputs, cfg,
+                         imaging=False):
+    '''Mark frames which already exist on disk as taken in the journal so
+    that they are skipped.  calibration_inputs is a list of (Mask, filters)
+    tuples.  Flats are matched at the exposure time tuned for them (see
+    `tune_flat_exptime`) if the journal has one.  Returns the number of
+    frames which will be skipped.
+    '''
+    nskipped = 0
+    for mask, filters in calibration_inputs:
+        for block in calibration_blocks(mask, filters, cfg, imaging=imaging):
+            sets = {}
+            for section, frametype, frameno, exposure in\
+                    block_frames(block, cfg, imaging=imaging):
+                exptime = exposure['exptime']
+                if frametype.startswith('Dome Flat'):
+                    # Lamps off flats are taken at the lamps on exposure time
+                    tuned = journal.exptime(section, 'Dome Flat',
+                                            mask=mask.name)
+                    if tuned is not None:
+                        exptime = tuned
+                key = (section, frametype, exptime, exposure['coadds'],
+                       exposure['sampmode'])
+                sets[key] = sets.get(key, 0) + 1
+            for key, count in sets.items():
+                section, description, exptime, coadds, sampmode = key
+                nexisting = count_existing_frames(index, mask.name, section,
+                                                  description, exptime,
+                                                  coadds=coadds,
+                                                  sampmode=sampmode)
+                for i in range(1, min(count, nexisting)+1):
+                    journal.mark_done(mask.name, section, description, i)
+                if nexisting > 0:
+                    log.info(f'Found {min(count, nexisting)}/{count} '
+                             f'{description} frames for {mask.name} {section}')
+                nskipped += min(count, nexisting)
+    log.info(f'Skipping {nskipped} frames which already exist')
+    return nskipped
+
+
+##-------------------------------------------------------------------------
+## Quality Checks
+##-------------------------------------------------------------------------
+class CalibrationQA(object):
+    '''Check calibration frames as they are written.  Each frame is passed to
+    `check` as soon as it is on disk and the quick look metrics from
+    `calibration_frame_metrics` are computed on a worker thread while the
+    next exposure runs.
+
+    A frame fails if more than qa_max_saturated_fraction (default 0.01) of
+    its pixels are saturated, if the median in the slits of a lamp on flat is
+    below qa_min_flat_counts (default 1000), or if the arc line contrast is
+    below qa_min_line_snr (default 10).  The thresholds are read from the
+    calibration configuration section.  A metric which can not be measured
+    (e.g. no slit region on the detector) is logged as a warning and not
+    checked.  Failed frames are logged as errors
+    and listed in the failures attribute as (mask, section, frametype,
+    index, problems) tuples.  Call `close` once all frames are taken to wait
+    for the queued checks and stop the worker thread.
+    '''
+
+    def __init__(self, cfg, imaging=False):
+        self.cfg = cfg
+        self.imaging = imaging
+        self.mask = None
+        self.results = list()
+        self.failures = list()
+        self.futures = list()
+        self.executor = ThreadPoolExecutor(max_workers=1)
+
+    def check(self, imagefile, section, frametype, index):
+        '''Queue a frame to be checked.  The mask attribute should be set to
+        the Mask in the CSU.
+        '''
+        self.futures.append(self.executor.submit(self._check, imagefile,
+                                                 self.mask, section, frametype,
+                                                 index))
+
+    def _check(self, imagefile, mask, section, frametype, index):
+        config = self.cfg[section]
+        try:
+            metrics = calibration_frame_metrics(imagefile, mask=mask,
+                                                imaging=self.imaging,
+                                                saturation=saturation_level)
+        except Exception as e:
+            metrics = {'saturated_fraction': np.nan, 'slit_median': np.nan,
+                       'line_snr': np.nan}
+            problems = [f'unable to read frame ({e})']
+        else:
+            problems = []
+            max_saturated = config.qa_max_saturated_fraction
+            if metrics['saturated_fraction'] > max_saturated:
+                problems.append(f"{100*metrics['saturated_fraction']:.1f}% "
+                                f"of pixels saturated")
+            if frametype == 'Dome Flat':
+                min_counts = config.qa_min_flat_counts
+                if np.isnan(metrics['slit_median']):
+                    log.warning(f"No measurable slit region in "
+                                f"{Path(imagefile).name}, flat level not checked")
+                elif metrics['slit_median'] < min_counts:
+                    problems.append(f"median in slits is "
+                                    f"{metrics['slit_median']:.0f}")
+            elif frametype.endswith('arc'):
+                min_snr = config.qa_min_line_snr
+                if np.isnan(metrics['line_snr']):
+                    log.warning(f"No measurable slit region in "
+                                f"{Path(imagefile).name}, arc lines not checked")
+                elif metrics['line_snr'] < min_snr:
+                    problems.append(f"no arc lines found (line contrast "
+                                    f"{metrics['line_snr']:.1f})")
+        maskname = mask.name if mask is not None else ''
+        self.results.append( (str(imagefile), maskname, section, frametype,
+                              index, metrics['saturated_fraction'],
+                              metrics['slit_median'], metrics['line_snr'],
+                              len(problems) == 0) )
+        if len(problems) > 0:
+            log.error(f"QA failed for {frametype} {index} ({section}) "
+                      f"{Path(imagefile).name}: {', '.join(problems)}")
+            self.failures.append( (maskname, section, frametype, index,
+                                   problems) )
+        else:
+            log.debug(f"QA passed for {Path(imagefile).name}")
+
+    def wait(self):
+        '''Wait for all queued checks to finish and return a Table of the
+        results.
+        '''
+        # Frames may still be queued by the file check thread while waiting
+        while len(self.futures) > 0:
+            self.futures.pop(0).result()
+        names = ('file', 'mask', 'section', 'frametype', 'index',
+                 'saturated_fraction', 'slit_median', 'line_snr', 'ok')
+        dtypes = ('U256', 'U68', 'U20', 'U40', 'i4', 'f8', 'f8', 'f8', '?')
+        return Table([[result[i] for result in self.results]
+                      for i in range(len(names))], names=names, dtype=dtypes)
+
+    def close(self):
+        '''Wait for all queued checks to finish, stop the worker thread, and
+        return a Table of the results.
+        '''
+        results = self.wait()
+        self.executor.shutdown(wait=True)
+        return results
+
+
+def _check(qa, section, frametype, index, imagefile=None):
+    if qa is not None:
+        if imagefile is None:
+            imagefile = lastfile()
+        qa.check(imagefile, section, frametype, index)
+
+
+def _frame_done(journal, qa, section, frametype, index):
+    '''Return a callback for `exposure_frame` which records and checks the
+    frame once it is on disk.
+    '''
+    def done(imagefile):
+        _record(journal, section, frametype, index)
+        _check(qa, section, frametype, index, imagefile=imagefile)
+    return done
+
+
+def _take_frames(journal, qa, section, frametype, indices, **kwargs):
+    '''Take the frames with the given indices as one `ExposureSequence`.
+    '''
+    frames = [exposure_frame(object=frametype,
+                             done=_frame_done(journal, qa, section, frametype, i),
+                             **kwargs)
+              for i in indices]
+    ExposureSequence(frames).run()
 
 
 ##-------------------------------------------------------------------------
 ## Sub-function: Take Arcs
 ##-------------------------------------------------------------------------
-def take_arcs(filt, cfg):
+def take_arcs(filt, cfg, overlap=False, journal=None, state=None, qa=None,
+              runner=None):
+    '''Take arcs for the given filter.  If overlap is True, independent
+    mechanism actions are run at the same time (see `arc_steps`).  See the
+    module docstring for journal, state, qa, and runner.
+    '''
+    if state is None:
+        state = InstrumentState(track=False)
+    if overlap is True or runner is not None:
+        runner = run_steps if runner is None else runner
+        return runner(arc_steps(filt, cfg, journal=journal, state=state,
+                                qa=qa))
     # Take Ne arcs
-    nNeArcs = cfg[filt].getint("ne_arc_count", 0)
-    if nNeArcs > 0:
-        log.info(f'Taking {nNeArcs:d} Ne arcs')
+    config = cfg[filt]
+    nNeArcs = config.ne_arc_count
+    ne_todo = _remaining(journal, filt, 'Ne arc', nNeArcs)
+    if len(ne_todo) > 0:
+        log.info(f'Taking {len(ne_todo):d} Ne arcs')
         # Close hatch
-        go_dark()
-        close_hatch()
-        set_obsmode(f"{filt}-spectroscopy")
-        exptime = cfg[filt].getfloat("ne_arc_exptime", 2)
-        Ne_lamp('on')
-        ne_arc_count = cfg[filt].getint("ne_arc_count", 0)
-        for i in range(ne_arc_count):
-            log.info(f"Taking Ne Arc {i+1}/{ne_arc_count}")
-            take_exposure(exptime=exptime,
-                          coadds=cfg[filt].getint("ne_arc_coadds", 1),
-                          sampmode=cfg[filt].get("ne_arc_sampmode", 'CDS'),
-                          object='Ne arc',
-                          wait=True)
-        Ne_lamp('off')
+        state.go_dark(defer=True)
+        state.close_hatch()
+        state.set_obsmode(f"{filt}-spectroscopy")
+        exptime = config.ne_arc_exptime
+        state.Ne_lamp('on')
+        _take_frames(journal, qa, filt, 'Ne arc', ne_todo,
+                     exptime=exptime,
+                     coadds=config.ne_arc_coadds,
+                     sampmode=config.ne_arc_sampmode)
+        state.Ne_lamp('off')
     # Take Ar arcs
-    nArArcs = cfg[filt].getint("ar_arc_count", 0)
-    if nArArcs > 0:
-        log.info(f'Taking {nArArcs:d} Ar arcs')
+    nArArcs = config.ar_arc_count
+    ar_todo = _remaining(journal, filt, 'Ar arc', nArArcs)
+    if len(ar_todo) > 0:
+        log.info(f'Taking {len(ar_todo):d} Ar arcs')
         # Close hatch
         
-        go_dark()
-        close_hatch()
-        set_obsmode(f"{filt}-spectroscopy")
-        exptime = cfg[filt].getfloat("ar_arc_exptime", 2)
-        Ar_lamp('on')
-        ar_arc_count = cfg[filt].getint("ar_arc_count", 0)
-        for i in range(ar_arc_count):
-            log.info(f"Taking Ar Arc {i+1}/{ar_arc_count}")
-            take_exposure(exptime=exptime,
-                          coadds=cfg[filt].getint("ar_arc_coadds", 1),
-                          sampmode=cfg[filt].get("ar_arc_sampmode", 'CDS'),
-                          object='Ar arc',
-                          wait=True)
-        Ar_lamp('off')
+        state.go_dark(defer=True)
+        state.close_hatch()
+        state.set_obsmode(f"{filt}-spectroscopy")
+        exptime = config.ar_arc_exptime
+        state.Ar_lamp('on')
+        _take_frames(journal, qa, filt, 'Ar arc', ar_todo,
+                     exptime=exptime,
+                     coadds=config.ar_arc_coadds,
+                     sampmode=config.ar_arc_sampmode)
+        state.Ar_lamp('off')
     log.info('Going dark')
-    go_dark()
+    state.go_dark(defer=True)
 
 
 ##-------------------------------------------------------------------------
 ## Sub-function: Take Flats
 ##-------------------------------------------------------------------------
-def take_flats(filt, cfg, imaging=False):
+def take_flats(filt, cfg, imaging=False, overlap=False, journal=None,
+               state=None, adaptive=False, mask=None, qa=None, runner=None):
+    '''Take flats for the given filter.  If overlap is True, independent
+    mechanism actions are run at the same time (see `flat_steps`).  See the
+    module docstring for journal, state, qa, and runner.
 
-    def take_flat_set(cfg, lampsoff=False):
+    If adaptive is True, the exposure time is chosen by `tune_flat_exptime`
+    using the slits in mask (the mask in the CSU if None).
+    '''
+    if state is None:
+        state = InstrumentState(track=False)
+    if overlap is True or runner is not None:
+        runner = run_steps if runner is None else runner
+        return runner(flat_steps(filt, cfg, imaging=imaging, journal=journal,
+                                 state=state, qa=qa, adaptive=adaptive,
+                                 mask=mask))
+
+    def take_flat_set(cfg, lampsoff=False, exptime=None):
         '''Define internal function to take a set of flats.
         
-        Useful as this is repeated for lamps on and off.
+        Useful as this is repeated for lamps on and off.  Returns the
+        exposure time used.
         '''
         # Get number
         if lampsoff is False:
-            nflats = config.getint("flat_count", 0)
+            nflats = config.flat_count
             lamps_string = ''
         elif lampsoff is True:
-            nflats = config.getint("flatoff_count", 0)
+            nflats = config.flatoff_count
             lamps_string = ' (lamps off)'
-        exptime = config.getfloat("flat_exptime", 11)
-        if nflats > 0:
-            log.info(f'Taking {nflats} flats{lamps_string}')
+        frametype = f'Dome Flat{lamps_string}'
+        if exptime is None:
+            # Use the exposure time tuned before an interruption, if any
+            exptime = _recorded_exptime(journal, section, frametype)
+        todo = _remaining(journal, section, frametype, nflats)
+        if len(todo) > 0:
+            log.info(f'Taking {len(todo)} flats{lamps_string}')
             # Turn on dome flat lamps
             if lampsoff is False:
-                dome_flat_lamps(config.getfloat('flat_power'))
+                state.dome_flat_lamps(config.flat_power)
+                if adaptive is True and exptime is None:
+                    exptime = tune_flat_exptime(filt, cfg, mask=mask,
+                                                imaging=imaging)
+                    _record_exptime(journal, section, frametype, exptime)
             elif lampsoff is True:
-                dome_flat_lamps('off')
+                state.dome_flat_lamps('off')
+            if exptime is None:
+                exptime = config.flat_exptime
             # Take flats
-            for i in range(nflats):
-                log.info(f"Taking flat {i+1}/{nflats} (exptime = {exptime:.0f})")
-                take_exposure(exptime=exptime,
-                              coadds=config.getint("flat_coadds", 1),
-                              sampmode=config.get("flat_sampmode", 'CDS'),
-                              object=f'Dome Flat{lamps_string}',
-                              wait=True)
+            log.info(f"Taking flats {todo} of {nflats} (exptime = {exptime:.0f})")
+            _take_frames(journal, qa, section, frametype, todo,
+                         exptime=exptime,
+                         coadds=config.flat_coadds,
+                         sampmode=config.flat_sampmode)
+        if exptime is None:
+            exptime = config.flat_exptime
+        return exptime
 
-    # Open Hatch
-    open_hatch()
-    # Set mode
     if imaging != True:
-        set_obsmode(f"{filt}-spectroscopy")
+        section = filt
     else:
-        set_obsmode(f"{filt}-imaging")
-    # Run the above function twice, then go dark
+        section = f"{filt}-imaging"
+    config = cfg[section]
+    nflats = config.flat_count
+    nflatoffs = config.flatoff_count
+    if len(_remaining(journal, section, 'Dome Flat', nflats)) == 0 and\
+       len(_remaining(journal, section, 'Dome Flat (lamps off)', nflatoffs)) == 0:
+        log.info(f'All {section} flats already taken')
+        return
+
+    # Open Hatch
+    state.open_hatch()
+    # Set mode
     if imaging != True:
-        config = cfg[filt]
+        state.set_obsmode(f"{filt}-spectroscopy")
     else:
-        config = cfg[f"{filt}-imaging"]
-    take_flat_set(cfg, lampsoff=False)
-    take_flat_set(cfg, lampsoff=True)
+        state.set_obsmode(f"{filt}-imaging")
+    # Run the above function twice (lamps off with the same exposure time as
+    # lamps on), then go dark
+    exptime = take_flat_set(cfg, lampsoff=False)
+    take_flat_set(cfg, lampsoff=True, exptime=exptime)
     log.info('Going dark')
-    go_dark()
+    state.go_dark(defer=True)
+
+
+##-------------------------------------------------------------------------
+## Sub-function: Tune Flat Exposure Time
+##-------------------------------------------------------------------------
+def flat_probe_exptime(config):
+    '''Return the exposure time of the probe flat taken by
+    `tune_flat_exptime` for a configuration section.
+    '''
+    if config.flat_probe_exptime is not None:
+        return config.flat_probe_exptime
+    return max(2, config.flat_exptime/4)
+
+
+def tune_flat_exptime(filt, cfg, mask=None, imaging=False):
+    '''Take a short probe flat with the lamps already on, measure the median
+    counts in the slits, and return the exposure time which would give the
+    target counts.
+
+    The configuration options used are flat_probe_exptime (default 1/4 of
+    flat_exptime, but at least 2 s), flat_target_counts (default 15000), and
+    flat_min_exptime and flat_max_exptime (default 2 and 120 s) which limit
+    the result.  If the probe can not be measured, flat_exptime is returned.
+    '''
+    section = filt if imaging is False else f"{filt}-imaging"
+    config = cfg[section]
+    exptime = config.flat_exptime
+    probe_exptime = flat_probe_exptime(config)
+    target = config.flat_target_counts
+    min_exptime = config.flat_min_exptime
+    max_exptime = config.flat_max_exptime
+    if mask is None:
+        mask = read_csu_bar_state()
+
+    log.info(f'Taking {probe_exptime:.1f} s probe flat')
+    take_exposure(exptime=probe_exptime, coadds=1,
+                  sampmode=config.flat_sampmode,
+                  object='Dome Flat (probe)', wait=True)
+    try:
+        counts = slit_region_median(lastfile(), mask, imaging=imaging)
+    except Exception as e:
+        log.warning(f'Unable to measure probe flat: {e}')
+        counts = np.nan
+    if not counts > 0:
+        log.warning(f'Probe flat counts are {counts}, using exptime = {exptime:.1f}')
+        return exptime
+
+    tuned = probe_exptime * target/counts
+    tuned = float(np.clip(np.round(tuned, 1), min_exptime, max_exptime))
+    log.info(f'Probe flat median in slits = {counts:.0f}, '
+             f'exptime = {tuned:.1f} s (configured {exptime:.1f} s)')
+    return tuned
+
+
+##-------------------------------------------------------------------------
+## Sub-function: Steps for Overlapped Arcs and Flats
+##-------------------------------------------------------------------------
+def _take_and_record(journal, qa, section, frametype, index, exposure=None):
+    take_exposure(object=frametype, wait=True, **exposure)
+    _record(journal, section, frametype, index)
+    _check(qa, section, frametype, index)
+
+
+def _tune_flat_step(journal, section, filt, cfg, exposure=None, mask=None,
+                    imaging=False):
+    '''Set the exposure time of the flats from a probe flat (see
+    `tune_flat_exptime`) and record it in the journal.
+    '''
+    exposure['exptime'] = tune_flat_exptime(filt, cfg, mask=mask,
+                                            imaging=imaging)
+    _record_exptime(journal, section, 'Dome Flat', exposure['exptime'])
+
+
+def _exposure_steps(prefix, indices, after, journal, qa, section, frametype,
+                    exposure):
+    '''Build a chain of exposure steps, each one after the previous one.
+    exposure is a dict of the exptime, coadds, and sampmode, which is read
+    when each step runs.
+    '''
+    steps = []
+    for i in indices:
+        name = f"{prefix}_{i}"
+        steps.append(step(name, _take_and_record, journal, qa, section,
+                          frametype, i, exposure=exposure, after=after))
+        after = [name]
+    return steps
+
+
+def arc_steps(filt, cfg, journal=None, state=None, qa=None):
+    '''Build the steps for `run_steps` to take the arcs for one filter.
+    Returns an empty list if there are no arcs to take.
+
+    The safety rules of `take_arcs` are kept: the instrument is dark before
+    the hatch moves, the hatch is closed before the obsmode is set, only one
+    arc lamp is on while exposing, and the instrument goes dark at the end.
+    A lamp is turned on once the instrument is dark, so it warms up while the
+    hatch and obsmode move; no arc is taken until they are done.  Turning a
+    lamp off overlaps with the next lamp warming up and with the final
+    go_dark.
+    '''
+    if state is None:
+        state = InstrumentState(track=False)
+    config = cfg[filt]
+    lamps = []
+    for lamp, lamp_function in [('Ne', state.Ne_lamp), ('Ar', state.Ar_lamp)]:
+        prefix = f"{lamp.lower()}_arc"
+        todo = _remaining(journal, filt, f'{lamp} arc',
+                          getattr(config, f"{prefix}_count"))
+        if len(todo) > 0:
+            exposure = {'exptime': getattr(config, f"{prefix}_exptime"),
+                        'coadds': getattr(config, f"{prefix}_coadds"),
+                        'sampmode': getattr(config, f"{prefix}_sampmode")}
+            lamps.append( (lamp, lamp_function, todo, exposure) )
+    if len(lamps) == 0:
+        return []
+    steps = [step('go_dark', state.go_dark),
+             step('close_hatch', state.close_hatch, after=['go_dark']),
+             step('set_obsmode', state.set_obsmode, f"{filt}-spectroscopy",
+                  after=['close_hatch'])]
+    last_exposure = []
+    last_lamp_off = []
+    for lamp, lamp_function, todo, exposure in lamps:
+        steps.append(step(f'{lamp}_on', lamp_function, 'on',
+                          after=['go_dark'] + last_exposure))
+        exposures = _exposure_steps(f'{lamp}_arc', todo,
+                                    ['set_obsmode', f'{lamp}_on'] + last_lamp_off,
+                                    journal, qa, filt, f'{lamp} arc', exposure)
+        steps.extend(exposures)
+        last_exposure = [exposures[-1]['name']]
+        steps.append(step(f'{lamp}_off', lamp_function, 'off',
+                          after=last_exposure))
+        last_lamp_off = [f'{lamp}_off']
+    steps.append(step('go_dark_end', state.go_dark, after=last_exposure))
+    return steps
+
+
+def flat_steps(filt, cfg, imaging=False, journal=None, state=None, qa=None,
+               adaptive=False, mask=None):
+    '''Build the steps for `run_steps` to take the flats for one filter.
+    Returns an empty list if there are no flats to take.
+
+    The safety rules of `take_flats` are kept: the instrument is dark while
+    the hatch opens, the hatch is open before the obsmode is set, lamp on
+    flats are all taken before the lamps are turned off, and the instrument
+    goes dark at the end.  The dome lamps are turned on once the instrument
+    is dark, so their power change overlaps with the hatch and obsmode moves;
+    no flat is taken until those are done.
+
+    If adaptive is True, a probe flat is taken once the lamps are on and the
+    exposure time of all of the flats is set from it (see
+    `tune_flat_exptime`), unless the journal already has an exposure time
+    for this set.
+    '''
+    if imaging is False:
+        section = filt
+        mode = f"{filt}-spectroscopy"
+    else:
+        section = f"{filt}-imaging"
+        mode = f"{filt}-imaging"
+    config = cfg[section]
+    if state is None:
+        state = InstrumentState(track=False)
+    exposure = {'exptime': config.flat_exptime,
+                'coadds': config.flat_coadds,
+                'sampmode': config.flat_sampmode}
+    tuned = _recorded_exptime(journal, section, 'Dome Flat')
+    if tuned is not None:
+        exposure['exptime'] = tuned
+    on_todo = _remaining(journal, section, 'Dome Flat', config.flat_count)
+    off_todo = _remaining(journal, section, 'Dome Flat (lamps off)',
+                          config.flatoff_count)
+    if len(on_todo) == 0 and len(off_todo) == 0:
+        return []
+    steps = [step('go_dark', state.go_dark),
+             step('open_hatch', state.open_hatch, after=['go_dark']),
+             step('set_obsmode', state.set_obsmode, mode, after=['open_hatch'])]
+    last_exposure = []
+    if len(on_todo) > 0:
+        steps.append(step('lamps_on', state.dome_flat_lamps,
+                          config.flat_power, after=['go_dark']))
+        after = ['set_obsmode', 'lamps_on']
+        if adaptive is True and tuned is None:
+            steps.append(step('probe', _tune_flat_step, journal, section, filt,
+                              cfg, exposure=exposure, mask=mask,
+                              imaging=imaging, after=after))
+            after = ['probe']
+        exposures = _exposure_steps('flat', on_todo, after, journal, qa,
+                                    section, 'Dome Flat', exposure)
+        steps.extend(exposures)
+        last_exposure = [exposures[-1]['name']]
+    if len(off_todo) > 0:
+        steps.append(step('lamps_off', state.dome_flat_lamps, 'off',
+                          after=last_exposure))
+        exposures = _exposure_steps('flatoff', off_todo,
+                                    ['set_obsmode', 'lamps_off'] + last_exposure,
+                                    journal, qa, section, 'Dome Flat (lamps off)',
+                                    exposure)
+        steps.extend(exposures)
+        last_exposure = [exposures[-1]['name']]
+    steps.append(step('go_dark_end', state.go_dark, after=last_exposure))
+    return steps
 
 
 ##-------------------------------------------------------------------------
 ## Take Calibrations for a Single Mask for a List of Bands
 ##-------------------------------------------------------------------------
 def take_calibrations_for_a_mask(mask, filters, cfg, imaging=False,
+                                 journal=None, state=None, adaptive_flats=False,
+                                 qa=None,
                                  skipprecond=False, skippostcond=True):
-    '''Takes calibrations for a single mask in a list of filters.
+    '''Takes calibrations for a single mask in a list of filters.  If
+    adaptive_flats is True, the flat exposure time is tuned (see
+    `tune_flat_exptime`).  See the module docstring for journal, state, and
+    qa.
     '''
     this_script_name = inspect.currentframe().f_code.co_name
     log.debug(f"Executing: {this_script_name}")
@@ -170,24 +749,36 @@ def take_calibrations_for_a_mask(mask, filters, cfg, imaging=False,
     ##-------------------------------------------------------------------------
     ## Script Contents
     imstring = {False: '', True: ' imaging'}[imaging]
+    if journal is not None:
+        journal.mask = mask.name
+        blocks = calibration_blocks(mask, filters, cfg, imaging=imaging)
+        if all([block_is_done(block, cfg, journal, imaging=imaging)
+                for block in blocks]):
+            log.info(f'All{imstring} calibrations for {mask.name} already taken')
+            return None
     log.info(f'Taking{imstring} calibrations for {mask.name} in {", ".join(filters)}')
+    if state is None:
+        state = InstrumentState(track=False)
 
-    # Go Dark
-    go_dark()
-    # Configure CSU
-    setup_mask(mask)
-    execute_mask()
+    # Go dark and configure CSU
+    state.configure_csu(mask)
+    if qa is not None:
+        qa.mask = mask
 
     for filt in filters:
         hatch_posname = ktl.cache(service='mmdcs', keyword='POSNAME').read()
         if hatch_posname == 'Closed':
             # Start with Arcs
-            if imaging is False: take_arcs(filt, cfg)
-            take_flats(filt, cfg, imaging=imaging)
+            if imaging is False: take_arcs(filt, cfg, journal=journal,
+                                           state=state, qa=qa)
+            take_flats(filt, cfg, imaging=imaging, journal=journal, state=state,
+                       adaptive=adaptive_flats, mask=mask, qa=qa)
         elif hatch_posname == 'Open':
             # Start with Flats
-            take_flats(filt, cfg, imaging=imaging)
-            if imaging is False: take_arcs(filt, cfg)
+            take_flats(filt, cfg, imaging=imaging, journal=journal, state=state,
+                       adaptive=adaptive_flats, mask=mask, qa=qa)
+            if imaging is False: take_arcs(filt, cfg, journal=journal,
+                                           state=state, qa=qa)
         else:
             raise FailedCondition(f'Hatch in unknown state: "{hatch_posname}"')
 
@@ -204,16 +795,18 @@ def take_calibrations_for_a_mask(mask, filters, cfg, imaging=False,
 
 
 ##-------------------------------------------------------------------------
-## Take Calibrations for All Masks
+## Calibration Scheduling
 ##-------------------------------------------------------------------------
-def take_calibrations(filters, config=None, imaging=False,
-                      skipprecond=False, skippostcond=True):
-    '''Loops over masks and takes calibrations for each.
-    
-    All masks must have the same calibration configuration file.
-    
-    Takes an input dictionary containing keys which are Mask objects (or
-    resolve to mask objects), and values which are a list of filters.
+def execute_calibration_plan(plan, cfg, imaging=False, overlap=False,
+                             journal=None, state=None, adaptive_flats=False,
+                             qa=None, runner=None,
+                             skipprecond=False, skippostcond=True):
+    '''Take calibrations following a plan generated by `plan_calibrations`.
+    If overlap is True, mechanism actions within each block are overlapped
+    (see `run_steps`).  Blocks the journal lists as taken are skipped.  If
+    adaptive_flats is True, the flat exposure time is tuned (see
+    `tune_flat_exptime`).  See the module docstring for journal, state, qa,
+    and runner.
     '''
     this_function_name = inspect.currentframe().f_code.co_name
     log.debug(f"Executing: {this_function_name}")
@@ -223,15 +816,49 @@ def take_calibrations(filters, config=None, imaging=False,
     if skipprecond is True:
         log.debug('Skipping pre condition checks')
     else:
-        pass
+        mechanisms_ok()
 
     ##-------------------------------------------------------------------------
     ## Script Contents
-    cfg = read_calibration_config(config)
+    if state is None:
+        state = InstrumentState(track=False)
+    for i,(mask, filt, caltype) in enumerate(plan):
+        if journal is not None:
+            journal.mask = mask.name
+            if block_is_done((mask, filt, caltype), cfg, journal,
+                             imaging=imaging):
+                log.info(f"Block {i+1}/{len(plan)}: {filt} {caltype} for "
+                         f"{mask.name} already taken")
+                continue
+        state.configure_csu(mask)
+        if qa is not None:
+            qa.mask = mask
+        log.info(f"Block {i+1}/{len(plan)}: {filt} {caltype} for {mask.name}")
+        if caltype == 'arcs':
+            take_arcs(filt, cfg, overlap=overlap, journal=journal, state=state,
+                      qa=qa, runner=runner)
+        elif caltype == 'flats':
+            take_flats(filt, cfg, imaging=imaging, overlap=overlap,
+                       journal=journal, state=state,
+                       adaptive=adaptive_flats, mask=mask, qa=qa,
+                       runner=runner)
 
-    # Convert all inputs to mosfire.mask.Mask objects
+    ##-------------------------------------------------------------------------
+    ## Post-Condition Checks
+    if skippostcond is True:
+        log.debug('Skipping post condition checks')
+    else:
+        mechanisms_ok()
+
+    return None
+
+
+def _calibration_inputs(filters):
+    '''Convert the filters input of `take_calibrations` to a list of (Mask,
+    filters) tuples.
+    '''
     calibration_inputs = []
-    for i,maskinput in enumerate(filters.keys()):
+    for maskinput, mask_filters in filters.items():
         if isinstance(maskinput, Mask):
             mask = maskinput
         elif isinstance(maskinput, str):
@@ -241,28 +868,283 @@ def take_calibrations(filters, config=None, imaging=False,
         else:
             log.error(f'Could not parse input: {maskinput}')
             continue
-        calibration_inputs.append( (mask, filters[maskinput]) )
+        if type(mask_filters) is str:
+            mask_filters = [mask_filters]
+        calibration_inputs.append( (mask, mask_filters) )
+    return calibration_inputs
 
-    # If one of the masks we want to calibrate matches the name of the current
-    # mask in the CSU, start with that one
-    current_mask_name =  ktl.cache(service='mcsus', keyword='MASKNAME').read()
-    mask_names_to_calibrate = [inp[0].name for inp in calibration_inputs]
-    try:
-        current_mask_idx = mask_names_to_calibrate.index(current_mask_name)
-        calibration_inputs.insert(0, calibration_inputs.pop(current_mask_idx))
-    except:
+
+def _overlap_with_schedule(overlap, schedule):
+    '''Return overlap, warning and returning False if it is requested without
+    schedule (calibrations taken mask by mask are never overlapped).
+    '''
+    if overlap is True and schedule is not True:
+        log.warning('overlap requires schedule=True, taking calibrations '
+                    'without overlap')
+        return False
+    return overlap
+
+
+def _end_calibrations(state):
+    '''Leave the dome lamps off and the instrument dark.
+    '''
+    state.dome_flat_lamps('off')
+    state.flush()
+
+
+##-------------------------------------------------------------------------
+## Dry Run Time Estimate
+##-------------------------------------------------------------------------
+def block_frames(block, cfg, imaging=False, journal=None):
+    '''Return the frames taken by a calibration block which the journal does
+    not list as taken, as (section, frametype, index, exposure) tuples where
+    exposure is a dict of the exptime, coadds, and sampmode.  The frames come
+    from the same steps which take them (see `arc_steps` and `flat_steps`).
+    '''
+    mask, filt, caltype = block
+    if caltype == 'arcs':
+        steps = arc_steps(filt, cfg, journal=journal)
+    else:
+        steps = flat_steps(filt, cfg, imaging=imaging, journal=journal)
+    return [this_step['args'][2:5] + (this_step['kwargs']['exposure'],)
+            for this_step in steps if this_step['function'] is _take_and_record]
+
+
+def block_is_done(block, cfg, journal, imaging=False):
+    '''Return True if the journal lists every frame in the calibration block
+    as taken.
+    '''
+    return len(block_frames(block, cfg, imaging=imaging, journal=journal)) == 0
+
+
+def _step_exposure(this_step):
+    '''Return the section, frame type, and exposure dict of an exposure
+    step built by `arc_steps` or `flat_steps`, or None for other steps (see
+    `StepTimeEstimate`).
+    '''
+    if this_step['function'] is _take_and_record:
+        section, frametype = this_step['args'][2:4]
+        return section, frametype, this_step['kwargs']['exposure']
+    elif this_step['function'] is _tune_flat_step:
+        section = this_step['args'][1]
+        config = this_step['args'][3][section]
+        return section, 'Dome Flat (probe)', {'exptime': flat_probe_exptime(config),
+                                              'coadds': 1,
+                                              'sampmode': config.flat_sampmode}
+    return None
+
+
+def estimate_calibration_time(filters, config=None, imaging=False,
+                              schedule=False, overlap=False, resume=False,
+                              skip_existing=False, adaptive_flats=False,
+                              current_mask=None, hatch=None, obsmode=None):
+    '''Estimate how long `take_calibrations` will take without touching the
+    hardware.  Takes the same filters, config, imaging, schedule, overlap,
+    resume, skip_existing, and adaptive_flats inputs as `take_calibrations`.
+    The starting CSU state (current_mask), hatch position, and obsmode can be
+    given, otherwise they are treated as unknown.
+
+    The plan and the steps of each block are the ones `take_calibrations`
+    would run, but they are passed to a `StepTimeEstimate` on a
+    `DryRunState`, so frames already taken (resume and skip_existing),
+    skipped mechanism commands, lamps off flats, and adaptive flat probes are
+    all accounted for.
+
+    Returns a Table itemizing the time budget with one row for the mechanism
+    time of each block and one row for each set of frames.  The total is
+    logged.
+    '''
+    overlap = _overlap_with_schedule(overlap, schedule)
+    cfg = read_calibration_config(config)
+    calibration_inputs = _calibration_inputs(filters)
+    if resume is True:
+        journal = CalibrationJournal(outdir().joinpath('calibration_journal.txt'),
+                                     resume=True)
+    else:
+        journal = CalibrationJournal(None)
+    if skip_existing is True:
+        mark_existing_frames(journal, index_calibration_frames(),
+                             calibration_inputs, cfg, imaging=imaging)
+
+    if schedule is True:
+        plan, predicted_time = plan_calibrations(calibration_inputs, cfg,
+                                                 imaging=imaging,
+                                                 current_mask=current_mask,
+                                                 hatch=hatch, obsmode=obsmode)
+    else:
+        # Same order as take_calibrations_for_a_mask: for each filter, arcs
+        # first if the hatch is closed, flats first if it is open
+        plan = []
+        hatch_position = hatch
+        for mask, filts in calibration_inputs:
+            for filt in filts:
+                blocks = calibration_blocks(mask, [filt], cfg, imaging=imaging)
+                if hatch_position != 'Closed':
+                    blocks.reverse()
+                plan.extend(blocks)
+                if len(blocks) > 0:
+                    hatch_position = {'arcs': 'Closed', 'flats': 'Open'}[blocks[-1][2]]
+
+    state = DryRunState(current_mask=current_mask, hatch=hatch,
+                        obsmode=obsmode)
+    estimate = StepTimeEstimate(state, journal, _step_exposure,
+                                overlap=overlap)
+    execute_calibration_plan(plan, cfg, imaging=imaging, overlap=overlap,
+                             journal=journal, state=state,
+                             adaptive_flats=adaptive_flats, runner=estimate,
+                             skipprecond=True, skippostcond=True)
+    _end_calibrations(state)
+    budget = estimate.finish()
+
+    total = np.sum(budget['seconds'])
+    exposing = np.sum([row['seconds'] for row in budget
+                       if row['item'] != 'mechanisms'])
+    log.info(f'Estimated calibration time: {total/60:.1f} min '
+             f'({exposing/60:.1f} min exposing, '
+             f'{(total-exposing)/60:.1f} min mechanisms)')
+    return budget
+
+
+##-------------------------------------------------------------------------
+## Take Calibrations for All Masks
+##-------------------------------------------------------------------------
+def take_calibrations(filters, config=None, imaging=False, schedule=False,
+                      overlap=False, dryrun=False, resume=False,
+                      skip_existing=False, adaptive_flats=False,
+                      retake_failed=False,
+                      skipprecond=False, skippostcond=True):
+    '''Loops over masks and takes calibrations for each.
+    
+    All masks must have the same calibration configuration file.
+    
+    Takes an input dictionary containing keys which are Mask objects (or
+    resolve to mask objects), and values which are a list of filters.
+
+    If schedule is True, the order of masks, filters, and arcs/flats is
+    chosen by `plan_calibrations` to minimize mechanism motion.  Otherwise
+    (the default) masks are calibrated in input order, starting with the mask
+    in the CSU.
+    If overlap is True, independent mechanism actions within each block are
+    run at the same time.  Overlap requires schedule: without it a warning is
+    logged and the calibrations are taken without overlap.
+
+    If dryrun is True, nothing is moved and the itemized time estimate from
+    `estimate_calibration_time` is returned instead.
+
+    Mechanism commands are issued through an `InstrumentState` so that
+    commands which are not needed are skipped.  The number of commands
+    issued and skipped is logged at the end.
+
+    Each frame taken is recorded in calibration_journal.txt in the output
+    directory.  If resume is True, frames recorded there by the previous
+    (interrupted) run are not taken again, and masks with nothing left to
+    take are not configured.
+
+    If skip_existing is True, the headers of the frames already in the output
+    directory are indexed and matching frames are not taken again.
+
+    If adaptive_flats is True, a short probe flat is taken before each set of
+    flats and the exposure time is scaled to reach a target level (see
+    `tune_flat_exptime`).
+
+    Each frame is checked by a `CalibrationQA` while the next exposure runs.
+    Frames which fail are logged as errors.  If retake_failed is True, they
+    are taken once more at the end of the run.  All checks are finished
+    before returning.
+
+    Returns the list of frames which failed QA (after any retake) as (mask,
+    section, frametype, index, problems) tuples.
+    '''
+    this_function_name = inspect.currentframe().f_code.co_name
+    log.debug(f"Executing: {this_function_name}")
+
+    ##-------------------------------------------------------------------------
+    ## Pre-Condition Checks
+    if skipprecond is True:
+        log.debug('Skipping pre condition checks')
+    else:
         pass
 
-    # Iterate over masks and take cals
-    for i,mask_and_filters in enumerate(calibration_inputs):
-        mask, mask_filters = mask_and_filters
-        log.info(f"Taking cals for mask {i+1}/{len(calibration_inputs)}: "
-                 f"{mask.name}")
-        take_calibrations_for_a_mask(mask, mask_filters,
-                                     cfg, imaging=imaging,
+    ##-------------------------------------------------------------------------
+    ## Script Contents
+    overlap = _overlap_with_schedule(overlap, schedule)
+    if dryrun is True:
+        return estimate_calibration_time(filters, config=config,
+                                         imaging=imaging, schedule=schedule,
+                                         overlap=overlap, resume=resume,
+                                         skip_existing=skip_existing,
+                                         adaptive_flats=adaptive_flats)
+
+    cfg = read_calibration_config(config)
+    journal = CalibrationJournal(outdir().joinpath('calibration_journal.txt'),
+                                 resume=resume)
+    state = InstrumentState()
+    qa = CalibrationQA(cfg, imaging=imaging)
+
+    # Convert all inputs to mosfire.mask.Mask objects
+    calibration_inputs = _calibration_inputs(filters)
+
+    if skip_existing is True:
+        mark_existing_frames(journal, index_calibration_frames(),
+                             calibration_inputs, cfg, imaging=imaging)
+
+    if schedule is True:
+        hatch = ktl.cache(service='mmdcs', keyword='POSNAME').read()
+        current_mask = state.current_mask()
+        plan, predicted_time = plan_calibrations(calibration_inputs, cfg,
+                                                 imaging=imaging,
+                                                 current_mask=current_mask,
+                                                 hatch=hatch,
+                                                 obsmode=state.values.get('obsmode'))
+    else:
+        # If one of the masks we want to calibrate matches the name of the
+        # current mask in the CSU, start with that one
+        current_mask_name =  ktl.cache(service='mcsus', keyword='MASKNAME').read()
+        mask_names_to_calibrate = [inp[0].name for inp in calibration_inputs]
+        try:
+            current_mask_idx = mask_names_to_calibrate.index(current_mask_name)
+            calibration_inputs.insert(0, calibration_inputs.pop(current_mask_idx))
+        except:
+            pass
+
+    def take_all():
+        if schedule is True:
+            execute_calibration_plan(plan, cfg, imaging=imaging, overlap=overlap,
+                                     journal=journal, state=state,
+                                     adaptive_flats=adaptive_flats, qa=qa,
                                      skipprecond=skipprecond,
                                      skippostcond=skippostcond)
-    dome_flat_lamps('off')
+        else:
+            # Iterate over masks and take cals
+            for i,mask_and_filters in enumerate(calibration_inputs):
+                mask, mask_filters = mask_and_filters
+                log.info(f"Taking cals for mask {i+1}/{len(calibration_inputs)}: "
+                         f"{mask.name}")
+                take_calibrations_for_a_mask(mask, mask_filters,
+                                             cfg, imaging=imaging,
+                                             journal=journal, state=state,
+                                             adaptive_flats=adaptive_flats,
+                                             qa=qa,
+                                             skipprecond=skipprecond,
+                                             skippostcond=skippostcond)
+
+    try:
+        take_all()
+        qa.wait()
+        if retake_failed is True and len(qa.failures) > 0:
+            log.warning(f'Retaking {len(qa.failures)} frames which failed QA')
+            for maskname, section, frametype, index, problems in qa.failures:
+                journal.forget(maskname, section, frametype, index)
+            qa.failures = list()
+            take_all()
+    finally:
+        qa_results = qa.close()
+    log.info(f"QA: {np.sum(qa_results['ok'])}/{len(qa_results)} frames passed")
+    for maskname, section, frametype, index, problems in qa.failures:
+        log.error(f"  Failed: {maskname} {section} {frametype} {index}: "
+                  f"{', '.join(problems)}")
+    _end_calibrations(state)
+    state.report()
 
     ##-------------------------------------------------------------------------
     ## Post-Condition Checks
@@ -271,4 +1153,4 @@ def take_calibrations(filters, config=None, imaging=False,
     else:
         pass
 
-    return None
+    return qa.failures
@@ -1,7 +1,6 @@
 #!kpython3
 
 import numpy as np
-from astropy.io import fits
 from astropy import stats
 from time import sleep
 
@@ -15,6 +14,7 @@ from .csu import setup_mask, execute_mask, initialize_bars, physical_to_pixel
 from .rotator import safe_angle
 from .domelamps import dome_flat_lamps
 from .analysis import verify_mask_with_image
+from .quicklook import quicklook_frame
 from .hatch import unlock_hatch, open_hatch, close_hatch
 
 
@@ -57,11 +57,12 @@ def checkout(quick=False, safeangleoverride=False, tolerance=2):
 
     log.info('Taking dark images')
     take_exposure(exptime=2, coadds=1, sampmode='CDS', object='Test Dark')
-    hdul1 = fits.open(lastfile())
+    dark1 = quicklook_frame(lastfile())
     take_exposure(exptime=2, coadds=1, sampmode='CDS', object='Test Dark')
-    hdul2 = fits.open(lastfile())
+    dark2 = quicklook_frame(lastfile())
     # Difference dark images and verify statistics
-    mean, med, std = stats.sigma_clipped_stats(hdul1[0].data - hdul2[0].data,
+    ny, nx = dark1.shape
+    mean, med, std = stats.sigma_clipped_stats(dark1.rows(0, ny) - dark2.rows(0, ny),
                            sigma_lower=2, sigma_upper=2, iters=5)
 #                          sigma=2, maxiters=5) # this line works in astropy 4.X
     expected_mean = 0
@@ -95,7 +96,7 @@ def checkout(quick=False, safeangleoverride=False, tolerance=2):
         wideslit = Mask('46x2.7')
         setup_mask(wideslit)
         log.info('Execute mask')
-        execute_mask(override=True)
+        execute_mask(override=True, mask=wideslit)
         log.info('Taking 2.7" wide long slit image')
         set_obsmode('K-imaging')
         take_exposure(exptime=6, coadds=1, sampmode='CDS', object='2.7" Long Slit')
@@ -108,7 +109,7 @@ def checkout(quick=False, safeangleoverride=False, tolerance=2):
         longslit = Mask('46x0.7')
         setup_mask(longslit)
         log.info('Execute mask')
-        execute_mask(override=True)
+        execute_mask(override=True, mask=longslit)
         log.info('Taking long slit image')
         set_obsmode('K-imaging')
         take_exposure(exptime=6, coadds=1, sampmode='CDS', object='0.7" Long Slit')
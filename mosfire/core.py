@@ -64,10 +64,19 @@ name = 'MOSFIRE'
 modes = ['dark-imaging', 'dark-spectroscopy', 'imaging', 'spectroscopy']
 filters = ['Y', 'J', 'H', 'K', 'Ks', 'J2', 'J3', 'nb1061']
 csu_bar_state_file = Path('/s/sdata1300/logs/server/mcsus/csu_bar_state')
+# Mechanical limits of CSU bar travel (mm) and the minimum gap (mm) between
+# the two bars forming a slit
+csu_bar_min_mm = 4.0
+csu_bar_max_mm = 270.4
+csu_min_gap_mm = 0.1
+csu_move_log_file = Path('~/CSU_move_history.csv').expanduser()
 mosfire_data_file_path = Path(__file__).parent
 # Load default CSU coordinate transformations
 with open(mosfire_data_file_path.joinpath('MOSFIRE_transforms.txt'), 'r') as FO:
     transforms = yaml.safe_load(FO.read())
+# Load default CSU move time model
+with open(mosfire_data_file_path.joinpath('CSU_move_model.txt'), 'r') as FO:
+    csu_move_model = yaml.safe_load(FO.read())
 
 log = create_log(name, loglevel='INFO', logfile='~/pymosfire.log')
 
@@ -50,8 +50,17 @@ def CSUready():
 ##-----------------------------------------------------------------------------
 ## Setup Mask
 ##-----------------------------------------------------------------------------
-def setup_mask(mask, wait=True, skipprecond=False, skippostcond=False):
+def setup_mask(mask, wait=True, minimal=False, current_mask=None,
+               skipprecond=False, skippostcond=False):
     '''Setup the given mask.  Accepts a Mask object.
+
+    If minimal is True, only the bars which need to move relative to the
+    current CSU state are given new target positions (see `plan_mask_moves`).
+    The current state may be passed in as current_mask (e.g. from
+    `read_csu_bar_state`), otherwise it is read from the bar keywords.  The
+    targets of the other bars are read back and any which do not match the
+    bar's current position (e.g. left from an aborted setup) are set to the
+    current position, so that SETUPINIT only moves the planned bars.
     '''
     this_function_name = inspect.currentframe().f_code.co_name
     log.debug(f"Executing: {this_function_name}")
@@ -63,12 +72,26 @@ def setup_mask(mask, wait=True, skipprecond=False, skippostcond=False):
         log.debug('Verifying input')
         if type(mask) != Mask:
             raise FailedCondition(f"Input {mask} is not a Mask object")
+        violations = validate_mask(mask)
+        if len(violations) > 0:
+            for violation in violations:
+                log.error(f"  Slit {violation['slitNumber']}: {violation['problem']}")
+            raise FailedCondition(f"Mask {mask.name} failed validation")
         CSU_ok()
         CSUbars_ok()
     
     ##-------------------------------------------------------------------------
     ## Script Contents
     log.info(f'Setting up mask: {mask.name}')
+    if minimal is True:
+        if current_mask is None:
+            current_mask = get_current_mask(skipprecond=True)
+        plan = plan_mask_moves(mask, current_mask=current_mask)
+        bars_to_move = list(plan['barNumber'])
+        log.info(f'  {len(bars_to_move)} bars need to move (estimated move '
+                 f'time {estimate_move_time(plan["travelMM"]):.0f} s)')
+    else:
+        bars_to_move = list(range(1,93,1))
     log.debug('Setting bar target position keywords')
 
     mcsus = ktl.cache(service='mcsus')
@@ -77,10 +100,14 @@ def setup_mask(mask, wait=True, skipprecond=False, skippostcond=False):
         rbp = slit['rightBarPositionMM']
         lbn = slit['leftBarNumber']
         lbp = slit['leftBarPositionMM']
-        log.debug(f"  Setting B{rbn:02d}TARG = {rbp}")
-        mcsus[f"B{rbn:02d}TARG"].write(rbp)
-        log.debug(f"  Setting B{lbn:02d}TARG = {lbp}")
-        mcsus[f"B{lbn:02d}TARG"].write(lbp)
+        if rbn in bars_to_move:
+            log.debug(f"  Setting B{rbn:02d}TARG = {rbp}")
+            mcsus[f"B{rbn:02d}TARG"].write(rbp)
+        if lbn in bars_to_move:
+            log.debug(f"  Setting B{lbn:02d}TARG = {lbp}")
+            mcsus[f"B{lbn:02d}TARG"].write(lbp)
+    if minimal is True:
+        _hold_bars(current_mask, bars_to_move, mcsus)
 
     log.debug('Invoke SETUP process on CSU')
     mcsus['SETUPINIT'].write(1)
@@ -107,12 +134,49 @@ def setup_mask(mask, wait=True, skipprecond=False, skippostcond=False):
     return None
 
 
+def _hold_bars(current_mask, bars_to_move, mcsus, tolerance=0.01):
+    '''Check the target position keywords of the bars which are not in
+    bars_to_move against their positions in current_mask and set any stale
+    targets to the current position.  Returns the list of bar numbers whose
+    targets were reset.
+    '''
+    current = bar_positions(current_mask)
+    reset = []
+    for barno in range(1,93,1):
+        if barno in bars_to_move:
+            continue
+        if np.isnan(current[barno-1]):
+            raise FailedCondition(f'Position of bar {barno} is unknown')
+        try:
+            target = float(mcsus[f"B{barno:02d}TARG"].read())
+        except ValueError:
+            target = np.nan
+        if not abs(target - current[barno-1]) < tolerance:
+            log.warning(f'  B{barno:02d}TARG = {target} is stale, setting it '
+                        f'to the current position {current[barno-1]:.3f}')
+            mcsus[f"B{barno:02d}TARG"].write(current[barno-1])
+            reset.append(barno)
+    return reset
+
+
 ##-----------------------------------------------------------------------------
 ## execute_mask
 ##-----------------------------------------------------------------------------
-def execute_mask(wait=True, override=False,
-                 skipprecond=False, skippostcond=False):
+def execute_mask(wait=True, override=False, mask=None, timeout=None,
+                 record_move=None, skipprecond=False, skippostcond=False):
     '''Execute a mask which has already been set up.
+
+    If the mask which was set up is passed in, the predicted move time (see
+    `predict_move_time`) is logged.  If no timeout is given and the move time
+    model has been fitted to the move history (see `fit_move_time_model`),
+    the timeout is extended for moves predicted to take longer than the
+    default of 480 seconds (it is never shortened).
+
+    If record_move is True, the move duration and bar positions are appended
+    to the CSU move history (csu_move_log_file) used to fit the move time
+    model (see CSU_move_model.txt).  By default (None) moves are recorded when
+    the mask is passed in.  The CSU state is only read before the move when a
+    mask is passed in or the move is recorded.
     '''
     this_function_name = inspect.currentframe().f_code.co_name
     log.debug(f"Executing: {this_function_name}")
@@ -128,12 +192,39 @@ def execute_mask(wait=True, override=False,
     
     ##-------------------------------------------------------------------------
     ## Script Contents
+    if record_move is None:
+        record_move = mask is not None
+    current_mask = None
+    if wait is True and (mask is not None or record_move is True):
+        try:
+            current_mask = read_csu_bar_state()
+        except Exception as e:
+            log.debug(f'Unable to read csu_bar_state: {e}')
+    predicted = None
+    if mask is not None and current_mask is not None:
+        predicted = predict_move_time(current_mask, mask)
+        log.info(f'Predicted CSU move time is {predicted:.0f} s')
+    if timeout is None:
+        timeout = 480
+        if predicted is not None and csu_move_model.get('fitted', False) is True:
+            timeout = max(timeout, 60 + 2*predicted)
+
     log.info('Executing mask')
     csugokw = ktl.cache(service='mcsus', keyword='SETUPGO')
+    setupgo_time = datetime.utcnow()
     csugokw.write(1)
     sleep(3) # shim needed because CSUREADY keyword doesn't update fast enough
     if wait is True:
-        waitfor_CSU(skipprecond=True)
+        waitfor_CSU(timeout=timeout, skipprecond=True)
+        duration = (datetime.utcnow() - setupgo_time).total_seconds()
+        log.info(f'CSU move took {duration:.0f} s')
+        if record_move is True and current_mask is not None:
+            try:
+                record_csu_move(setupgo_time, duration,
+                                bar_positions(current_mask),
+                                bar_positions(read_csu_bar_state()))
+            except Exception as e:
+                log.warning(f'Unable to record CSU move: {e}')
     
     ##-------------------------------------------------------------------------
     ## Post-Condition Checks
@@ -154,6 +245,11 @@ def initialize_bars(bars, timeout=360, skipprecond=False, skippostcond=False):
     To initialize all bars, use "all" as the input.  To initialize
     a single bar, use the ID number of the bar (1-92) as the input.  To
     initialize a subset of bars, use a list of bar ID numbers as the input.
+
+    The timeout is per bar (or for all bars).  It does not use the move time
+    model (see `predict_move_time`), which is fit to SETUPGO moves between
+    known positions, while initializing drives each bar to its limit switch
+    and back from an unknown position.
     '''
     this_function_name = inspect.currentframe().f_code.co_name
     log.debug(f"Executing: {this_function_name}")
@@ -305,7 +401,9 @@ def get_current_mask(skipprecond=False, skippostcond=False):
 ## read_csu_bar_state
 ##-----------------------------------------------------------------------------
 def read_csu_bar_state(skipprecond=False, skippostcond=False):
-    '''docstring
+    '''Build a Mask object from the bar positions in the csu_bar_state file
+    written by the CSU server.  Bars missing from the file have a bar number
+    of -1 and a position of nan.
     '''
     this_function_name = inspect.currentframe().f_code.co_name
     log.debug(f"Executing: {this_function_name}")
@@ -323,28 +421,17 @@ def read_csu_bar_state(skipprecond=False, skippostcond=False):
     mask = Mask(None)
     mask.name = 'From csu_bar_state'
     with open(csu_bar_state_file, 'r') as cbs:
-        lines = cbs.readlines()
-    t = Table(names=('slitNumber', 'leftBarNumber', 'rightBarNumber',
-                     'leftBarPositionMM', 'rightBarPositionMM',
-                     'centerPositionArcsec', 'slitWidthArcsec', 'target'),
-              dtype=('i4', 'i4', 'i4', 'f4', 'f4', 'f4', 'f4', 'a30'))
-    for line in lines:
-        barno, barpos, barstate = line.strip('\n').split(',')
-        slit = bar_to_slit(int(barno))
-        if int(barno) % 2 != 0:
-            dict = {'slitNumber': slit}
-            dict['leftBarNumber'] = -1
-            dict['leftBarPositionMM'] = float('nan')
-            dict['rightBarNumber'] = int(barno)
-            dict['rightBarPositionMM'] = float(barpos)
-            dict['centerPositionArcsec'] = float('nan')
-            dict['slitWidthArcsec'] = float('nan')
-            dict['target'] = ''
-            t.add_row(dict)
-        else:
-            t[slit-1]['leftBarNumber'] = int(barno)
-            t[slit-1]['leftBarPositionMM'] = float(barpos)
-    mask.slitpos = t
+        positions, states = parse_csu_bar_state(cbs)
+    barnos = np.where(np.isnan(positions), -1, np.arange(1, 93))
+    nan_column = np.full(46, np.nan)
+    mask.slitpos = Table([np.arange(1, 47), barnos[1::2], barnos[0::2],
+                          positions[1::2], positions[0::2],
+                          nan_column, nan_column, np.full(46, '')],
+                         names=('slitNumber', 'leftBarNumber', 'rightBarNumber',
+                                'leftBarPositionMM', 'rightBarPositionMM',
+                                'centerPositionArcsec', 'slitWidthArcsec',
+                                'target'),
+                         dtype=('i4', 'i4', 'i4', 'f4', 'f4', 'f4', 'f4', 'a30'))
 
     ##-------------------------------------------------------------------------
     ## Post-Condition Checks
@@ -356,6 +443,316 @@ def read_csu_bar_state(skipprecond=False, skippostcond=False):
     return mask
 
 
+def parse_csu_bar_state(lines, max_malformed=2):
+    '''Parse the lines of a csu_bar_state file (each line is
+    "barnumber,position,state") in a single pass.  Lines may arrive in any
+    order.
+
+    Returns a (92,) array of bar positions in mm and a (92,) array of bar
+    state strings, where index 0 is bar 1.  Bars which are not in the file
+    have a position of nan and an empty state.  Raises FailedCondition if a
+    bar number is not in the range 1-92.  Blank lines are ignored.  Other
+    lines which can not be parsed are logged and skipped, and
+    FailedCondition is raised if there are more than max_malformed of them.
+    '''
+    positions = np.full(92, np.nan)
+    states = np.full(92, '', dtype='U20')
+    malformed = 0
+    for line in lines:
+        if line.strip() == '':
+            continue
+        fields = line.strip().split(',')
+        try:
+            if len(fields) != 3:
+                raise ValueError(f'expected 3 fields, found {len(fields)}')
+            barno = int(fields[0])
+            position = float(fields[1])
+        except ValueError as e:
+            malformed += 1
+            log.warning(f'Skipping malformed csu_bar_state line "{line.strip()}": {e}')
+            continue
+        if barno < 1 or barno > 92:
+            raise FailedCondition(f'Bar {barno} in csu_bar_state is not in range 1-92')
+        positions[barno-1] = position
+        states[barno-1] = fields[2].strip()
+    if malformed > max_malformed:
+        raise FailedCondition(f'{malformed} malformed lines in csu_bar_state')
+    return positions, states
+
+
+def follow_csu_bar_state(interval=1, timeout=None, tolerance=0.01):
+    '''Watch the csu_bar_state file and yield an event for each bar whose
+    position (by more than tolerance mm) or state changes.  The file is only
+    re-parsed when its modification time or size changes.
+
+    This is a generator.  Each event is a dict with the timestamp (the file
+    modification time, UT), barNumber, and the old and new position and state.
+    Runs until timeout seconds have passed (forever if timeout is None).
+
+    Example:
+    for event in follow_csu_bar_state(timeout=300):
+        print(event['barNumber'], event['newPositionMM'])
+    '''
+    if timeout is not None:
+        endat = datetime.utcnow() + timedelta(seconds=timeout)
+    last_stat = None
+    positions = None
+    states = None
+    while timeout is None or datetime.utcnow() < endat:
+        stat = csu_bar_state_file.stat()
+        if (stat.st_mtime, stat.st_size) != last_stat:
+            last_stat = (stat.st_mtime, stat.st_size)
+            with open(csu_bar_state_file, 'r') as cbs:
+                new_positions, new_states = parse_csu_bar_state(cbs)
+            if positions is not None:
+                timestamp = datetime.utcfromtimestamp(stat.st_mtime)
+                moved = np.abs(new_positions - positions) >= tolerance
+                moved |= np.isnan(new_positions) != np.isnan(positions)
+                changed = moved | (new_states != states)
+                for i in np.where(changed)[0]:
+                    yield {'timestamp': timestamp,
+                           'barNumber': int(i+1),
+                           'oldPositionMM': float(positions[i]),
+                           'newPositionMM': float(new_positions[i]),
+                           'oldState': str(states[i]),
+                           'newState': str(new_states[i])}
+            positions, states = new_positions, new_states
+        sleep(interval)
+
+
+##-----------------------------------------------------------------------------
+## plan_mask_moves
+##-----------------------------------------------------------------------------
+def plan_mask_moves(mask, current_mask=None, tolerance=0.01):
+    '''Determine which bars must move to go from the current CSU state to the
+    given target Mask.  If current_mask is None, the current state is read
+    using `get_current_mask`.
+
+    Bars whose target is within tolerance (mm) of their current position are
+    left alone, as are bars which the target mask does not specify.  Both bars
+    in a row are always moved together so that the controller's collision
+    check for that row sees a consistent pair of targets.
+
+    Returns a Table with one row per bar to move containing the bar number
+    and the current position, target position, and travel distance in mm.
+    '''
+    if current_mask is None:
+        current_mask = get_current_mask(skipprecond=True)
+    current = bar_positions(current_mask)
+    target = bar_positions(mask)
+    travel = np.abs(target - current)
+    changed = ~np.isnan(target) & ~(travel < tolerance)
+    # Move both bars of a row if either bar in that row changes
+    rows_changed = changed.reshape(46, 2).any(axis=1)
+    changed = np.repeat(rows_changed, 2) & ~np.isnan(target)
+    barnos = np.arange(1, 93)[changed]
+    plan = Table([barnos, current[changed], target[changed], travel[changed]],
+                 names=('barNumber', 'currentPositionMM', 'targetPositionMM',
+                        'travelMM'),
+                 dtype=('i4', 'f8', 'f8', 'f8'))
+    log.debug(f'{len(plan)} of 92 bars need to move')
+    return plan
+
+
+def masks_match(current_mask, mask, tolerance=0.01):
+    '''Return True if every bar specified by mask is within tolerance (mm)
+    of its position in current_mask, i.e. no bars need to move to go from
+    current_mask to mask.  Use this rather than comparing Mask objects, as the
+    mask in the CSU (e.g. from `read_csu_bar_state`) is never the same object
+    as an input mask.
+    '''
+    plan = plan_mask_moves(mask, current_mask=current_mask, tolerance=tolerance)
+    return len(plan) == 0
+
+
+def estimate_move_time(travel, model=None):
+    '''Estimate the duration of a CSU move in seconds given the travel
+    distances (mm) of the bars which move.  Bars move simultaneously, so the
+    longest travel dominates.  The model is a dict of coefficients as
+    described in CSU_move_model.txt (defaults to the packaged model).
+    '''
+    if model is None:
+        model = csu_move_model
+    travel = np.array(travel, dtype=float)
+    if len(travel) == 0:
+        return 0
+    if np.all(np.isnan(travel)):
+        # Current positions unknown, assume a full length move
+        max_travel = csu_bar_max_mm - csu_bar_min_mm
+    else:
+        max_travel = np.nanmax(travel)
+    return model['overhead'] + model['seconds_per_mm']*max_travel\
+           + model['seconds_per_bar']*len(travel)
+
+
+def predict_move_time(current_mask, target_mask, model=None):
+    '''Predict how long the CSU will take to move from the configuration in
+    current_mask to the configuration in target_mask.  Returns seconds.
+    '''
+    plan = plan_mask_moves(target_mask, current_mask=current_mask)
+    return estimate_move_time(plan['travelMM'], model=model)
+
+
+##-----------------------------------------------------------------------------
+## CSU Move History
+##-----------------------------------------------------------------------------
+def record_csu_move(start_time, duration, start_positions, end_positions,
+                    movelog=csu_move_log_file):
+    '''Append a CSU move to the move history file.  The start time is when
+    SETUPGO was written, the duration is the time until CSUREADY reported the
+    move complete, and the positions are (92,) arrays of bar positions (mm)
+    before and after the move.
+    '''
+    movelog = Path(movelog).expanduser()
+    if not movelog.exists():
+        columns = ['setupgo', 'duration']
+        columns.extend([f"B{bar:02d}START" for bar in range(1,93,1)])
+        columns.extend([f"B{bar:02d}END" for bar in range(1,93,1)])
+        with open(movelog, 'w') as FO:
+            FO.write(','.join(columns)+'\n')
+    values = [start_time.strftime('%Y-%m-%dT%H:%M:%S'), f'{duration:.1f}']
+    values.extend([f'{pos:.3f}' for pos in start_positions])
+    values.extend([f'{pos:.3f}' for pos in end_positions])
+    with open(movelog, 'a') as FO:
+        FO.write(','.join(values)+'\n')
+
+
+def fit_move_time_model(movelog=csu_move_log_file, outfile=None,
+                        tolerance=0.01):
+    '''Fit the coefficients of the CSU move time model to the moves recorded
+    in the move history file by `record_csu_move`.
+
+    Returns the model as a dict (with fitted set to True and the number of
+    moves used).  If outfile is given, the model is also written there in the
+    format of CSU_move_model.txt.
+    '''
+    movelog = Path(movelog).expanduser()
+    if not movelog.exists():
+        raise FailedCondition(f'Unable to locate CSU move history: {movelog}')
+    moves = Table.read(movelog, format='ascii.csv')
+    start = np.array([moves[f"B{bar:02d}START"] for bar in range(1,93,1)],
+                     dtype=float).transpose()
+    end = np.array([moves[f"B{bar:02d}END"] for bar in range(1,93,1)],
+                   dtype=float).transpose()
+    travel = np.abs(end - start)
+    moved = travel >= tolerance
+    max_travel = np.nanmax(np.where(moved, travel, 0), axis=1)
+    nbars = np.sum(moved, axis=1)
+    duration = np.array(moves['duration'], dtype=float)
+    if len(duration) < 3:
+        raise FailedCondition(f'Need at least 3 moves to fit model, '
+                              f'found {len(duration)}')
+
+    A = np.vstack([np.ones(len(duration)), max_travel, nbars]).transpose()
+    coeffs, res, rank, s = np.linalg.lstsq(A, duration, rcond=None)
+    model = {'overhead': float(coeffs[0]),
+             'seconds_per_mm': float(coeffs[1]),
+             'seconds_per_bar': float(coeffs[2]),
+             'fitted': True,
+             'nmoves': len(duration)}
+    residuals = duration - A.dot(coeffs)
+    log.info(f'Fit move time model to {len(duration)} moves: {model}')
+    log.info(f'  RMS residual = {np.std(residuals):.1f} s')
+
+    if outfile is not None:
+        # Keep the comment block describing the model
+        with open(mosfire_data_file_path.joinpath('CSU_move_model.txt'), 'r') as FO:
+            header = [line for line in FO.readlines() if line.startswith('#')]
+        with open(Path(outfile).expanduser(), 'w') as FO:
+            FO.write(''.join(header))
+            FO.write(yaml.dump(model))
+    return model
+
+
+##-----------------------------------------------------------------------------
+## validate_mask
+##-----------------------------------------------------------------------------
+def validate_mask(mask, tolerance=0.001):
+    '''Check a Mask's slitpos table against the mechanical limits of the CSU
+    before anything is sent to the controller.  All rows are checked at once
+    and every problem is reported rather than stopping at the first one.
+
+    Checks that:
+    - slit numbers are in the range 1-46 and are not repeated
+    - bar numbers match the slit number (left = 2*slit, right = 2*slit-1)
+    - bar positions are within the range of travel (csu_bar_min_mm to
+      csu_bar_max_mm, see mosfire.core)
+    - the left bar is at least csu_min_gap_mm beyond the right bar (otherwise
+      the two bars in the row would collide)
+
+    Only the two bars of a row can collide: each row of bars travels in its
+    own slot, so bars in neighbouring rows are not checked against each
+    other.  Constraints between rows which come from the mask design (e.g.
+    overlapping spectra) are not checked either.
+
+    Returns a Table of violations with the slit number, bar number, and a
+    description of the problem.  An empty table means the mask is valid.
+    '''
+    slitpos = mask.slitpos
+    slitno = np.array(slitpos['slitNumber'], dtype=int)
+    leftbar = np.array(slitpos['leftBarNumber'], dtype=int)
+    rightbar = np.array(slitpos['rightBarNumber'], dtype=int)
+    leftmm = np.array(slitpos['leftBarPositionMM'], dtype=float)
+    rightmm = np.array(slitpos['rightBarPositionMM'], dtype=float)
+    gap = leftmm - rightmm
+
+    _, first_index, counts = np.unique(slitno, return_index=True,
+                                       return_counts=True)
+    repeated = np.zeros(len(slitno), dtype=bool)
+    repeated[first_index[counts > 1]] = True
+
+    checks = [
+        ((slitno < 1) | (slitno > 46), rightbar,
+         lambda i: f'slit number {slitno[i]} out of range 1-46'),
+        (repeated, rightbar,
+         lambda i: f'slit number {slitno[i]} is repeated'),
+        (leftbar != 2*slitno, leftbar,
+         lambda i: f'left bar {leftbar[i]} does not belong to slit {slitno[i]}'),
+        (rightbar != 2*slitno-1, rightbar,
+         lambda i: f'right bar {rightbar[i]} does not belong to slit {slitno[i]}'),
+        (~((leftmm >= csu_bar_min_mm-tolerance) & (leftmm <= csu_bar_max_mm+tolerance)),
+         leftbar, lambda i: f'left bar position {leftmm[i]:.3f} mm out of range'),
+        (~((rightmm >= csu_bar_min_mm-tolerance) & (rightmm <= csu_bar_max_mm+tolerance)),
+         rightbar, lambda i: f'right bar position {rightmm[i]:.3f} mm out of range'),
+        (~(gap >= csu_min_gap_mm-tolerance), leftbar,
+         lambda i: f'bars collide (gap = {gap[i]:.3f} mm)'),
+    ]
+
+    violations = Table(names=('slitNumber', 'barNumber', 'problem'),
+                       dtype=('i4', 'i4', 'U80'))
+    for failed, barnos, describe in checks:
+        for i in np.where(failed)[0]:
+            violations.add_row([slitno[i], barnos[i], describe(i)])
+    violations.sort(['slitNumber', 'barNumber'])
+    return violations
+
+
+def validate_mask_library(directory, pattern='*.xml'):
+    '''Run `validate_mask` on every mask file in a directory (e.g. the mask
+    library) so bad masks can be found during the day rather than at the
+    telescope.
+
+    Returns a dict with the file as key and the table of violations as value
+    for every mask which failed validation or could not be read.
+    '''
+    directory = Path(directory).expanduser()
+    maskfiles = sorted(directory.glob(pattern))
+    log.info(f'Validating {len(maskfiles)} masks in {directory}')
+    bad_masks = {}
+    for maskfile in maskfiles:
+        try:
+            violations = validate_mask(Mask(maskfile))
+        except Exception as e:
+            violations = Table(names=('slitNumber', 'barNumber', 'problem'),
+                               dtype=('i4', 'i4', 'U80'))
+            violations.add_row([0, 0, f'Unable to read mask: {e}'[:80]])
+        if len(violations) > 0:
+            log.warning(f'{maskfile.name}: {len(violations)} problems found')
+            bad_masks[maskfile] = violations
+    log.info(f'{len(bad_masks)} of {len(maskfiles)} masks failed validation')
+    return bad_masks
+
+
 ## ------------------------------------------------------------------
 ##  Coordinate Transformation Utilities
 ## ------------------------------------------------------------------
@@ -366,6 +763,19 @@ def slit_to_bars(slit):
     return (slit*2-1, slit*2)
 
 
+def bar_positions(mask):
+    '''Given a Mask, return a (92,) array of bar positions in mm where index 0
+    is bar 1.  Bars which are not defined by the mask are nan.
+    '''
+    barpos = np.full(92, np.nan)
+    for side in ['left', 'right']:
+        barnos = np.array(mask.slitpos[f'{side}BarNumber'], dtype=int)
+        mms = np.array(mask.slitpos[f'{side}BarPositionMM'], dtype=float)
+        defined = (barnos >= 1) & (barnos <= 92)
+        barpos[barnos[defined]-1] = mms[defined]
+    return barpos
+
+
 def bar_to_slit(bar):
     '''Given a bar number, retun the slit associated with that bar.
     '''
@@ -1,15 +1,33 @@
 import re
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from astropy.io import fits
+from astropy.table import Table
 
 from .core import *
-from .metadata import lastfile, set_object
+from .metadata import lastfile, path_resolver
 from .fcs import update_FCS, waitfor_FCS
 
 
+##-----------------------------------------------------------------------------
+## Detector Properties
+##-----------------------------------------------------------------------------
+# Approximate timing (s) used to estimate exposure durations
+read_time = 1.45 # time for one read of the full array
+exposure_overhead = 5 # per frame overhead (GO handshake, FITS writing, etc.)
+# Approximate counts per coadd above which a pixel is considered saturated
+saturation_level = 30000
+
+
 ##-----------------------------------------------------------------------------
 ## pre- and post- conditions
 ##-----------------------------------------------------------------------------
-def waitfor_exposure(timeout=240, shim=False):
+def waitfor_exposure(timeout=240, shim=False, profile=None):
     '''Block and wait for the current exposure to be complete.
+
+    If an ExposureProfile is given, the times at which the detector server
+    became ready (end of the exposure phase) and the image was done (end of
+    the write phase) are marked in it, and the keywords are polled more often.
     '''
     log.debug('Waiting for exposure to finish')
     endat = datetime.utcnow() + timedelta(seconds=timeout)
@@ -17,17 +35,23 @@ def waitfor_exposure(timeout=240, shim=False):
         sleep(1)
     IMAGEDONEkw = ktl.cache(service='mds', keyword='IMAGEDONE')
     READYkw = ktl.cache(service='mds', keyword='READY')
+    poll = 0.5 if profile is None else 0.1
 
     imagedone = bool(int(IMAGEDONEkw.read()))
     mdsready = bool(int(READYkw.read()))
     done_and_ready = imagedone and mdsready
     while datetime.utcnow() < endat and not done_and_ready:
-        sleep(0.5)
+        if profile is not None and mdsready:
+            profile.mark('exposure', once=True)
+        sleep(poll)
         imagedone = bool(int(IMAGEDONEkw.read()))
         mdsready = bool(int(READYkw.read()))
         done_and_ready = imagedone and mdsready
     if not done_and_ready:
         raise FailedCondition('Timeout exceeded on waitfor_exposure to finish')
+    if profile is not None:
+        profile.mark('exposure', once=True)
+        profile.mark('write')
 
 
 ##-----------------------------------------------------------------------------
@@ -78,6 +102,7 @@ def set_exptime(input, skipprecond=False, skippostcond=False):
     new_exptime = float(input)*1000
     log.debug(f'Setting exposure time to {new_exptime:.1f} ms')
     ITIMEkw.write(new_exptime)
+    _update_exposure_config(ITIME=new_exptime)
     
     ##-------------------------------------------------------------------------
     ## Post-Condition Checks
@@ -149,6 +174,7 @@ def set_coadds(input, skipprecond=False, skippostcond=False):
     COADDSkw = ktl.cache(service='mds', keyword='COADDS')
     log.debug(f'Setting coadds to {int(input)}')
     COADDSkw.write(int(input))
+    _update_exposure_config(COADDS=int(input))
     
     ##-------------------------------------------------------------------------
     ## Post-Condition Checks
@@ -230,9 +256,11 @@ def set_sampmode(input, skipprecond=False, skippostcond=False):
     SAMPMODEkw = ktl.cache(service='mds', keyword='SAMPMODE')
     NUMREADSkw = ktl.cache(service='mds', keyword='NUMREADS')
     SAMPMODEkw.write(mode)
+    _update_exposure_config(SAMPMODE=mode)
     if mode == 3:
         nreads = int(namematch.group(2))
         NUMREADSkw.write(nreads)
+        _update_exposure_config(NUMREADS=nreads)
     
     ##-------------------------------------------------------------------------
     ## Post-Condition Checks
@@ -259,63 +287,612 @@ def sampmode_with_args():
 
 
 
+##-----------------------------------------------------------------------------
+## Batched Exposure Parameters
+##-----------------------------------------------------------------------------
+class ExposureConfig(object):
+    '''Set the exposure parameters (exptime, coadds, sampmode, object) for
+    the next exposure, writing only the keywords which need to change.
+
+    The current values are kept in a local cache which is filled by one read
+    of all the keywords and then kept up to date by monitoring them (unless
+    monitor is False).  If the keywords are not monitored, the cached values
+    of the keywords which would be skipped are confirmed first by one
+    gathered read.  The needed writes are issued concurrently and then
+    verified in a single gathered read.
+    '''
+    keywords = ['ITIME', 'COADDS', 'SAMPMODE', 'NUMREADS', 'OBJECT']
+
+    def __init__(self, monitor=True):
+        self.monitor = monitor
+        self.current = dict()
+        self.writes = 0
+        self.skipped = 0
+        self.monitored = False
+
+    def _make_callback(self, keyword):
+        def callback(kw):
+            self.current[keyword] = str(kw['ascii'])
+        return callback
+
+    def _read(self, keywords):
+        '''Read the given keywords concurrently and return a dict of values.
+        '''
+        keywords = list(keywords)
+        with ThreadPoolExecutor(max_workers=len(keywords)) as executor:
+            values = executor.map(lambda kw: str(ktl.cache(service='mds', keyword=kw).read()),
+                                  keywords)
+        return dict(zip(keywords, values))
+
+    def refresh(self):
+        '''Read all of the exposure keywords to fill the cache.
+        '''
+        self.current = self._read(self.keywords)
+        if self.monitor is True and self.monitored is False:
+            for keyword in self.keywords:
+                kw = ktl.cache(service='mds', keyword=keyword)
+                kw.callback(self._make_callback(keyword))
+                kw.monitor()
+            self.monitored = True
+
+    def targets(self, exptime=None, coadds=None, sampmode=None, object=None):
+        '''Translate the exposure parameters to keyword values.
+        '''
+        targets = dict()
+        if exptime is not None:
+            targets['ITIME'] = float(exptime)*1000
+        if coadds is not None:
+            targets['COADDS'] = int(coadds)
+        if sampmode is not None:
+            namematch = re.match('(M?CDS)(\d*)', sampmode.strip())
+            if namematch is None:
+                raise FailedCondition(f'Unable to parse "{sampmode}"')
+            targets['SAMPMODE'] = {'CDS': 2, 'MCDS': 3}.get(namematch.group(1))
+            if targets['SAMPMODE'] == 3:
+                targets['NUMREADS'] = int(namematch.group(2))
+        if object is not None:
+            targets['OBJECT'] = str(object)
+        return targets
+
+    @staticmethod
+    def matches(keyword, current, target):
+        if current is None:
+            return False
+        try:
+            if keyword == 'ITIME':
+                return abs(float(current) - target) < 1
+            elif keyword == 'OBJECT':
+                return current == target
+            else:
+                return int(current) == target
+        except ValueError:
+            return False
+
+    def parameters(self):
+        '''Return the cached (exptime, coadds, sampmode) as they would be
+        passed to `take_exposure`.
+        '''
+        if len(self.current) == 0:
+            self.refresh()
+        exptime = float(self.current['ITIME'])/1000
+        coadds = int(self.current['COADDS'])
+        if int(self.current['SAMPMODE']) == 3:
+            sampmode = f"MCDS{int(self.current['NUMREADS'])}"
+        else:
+            sampmode = 'CDS'
+        return exptime, coadds, sampmode
+
+    def apply(self, exptime=None, coadds=None, sampmode=None, object=None,
+              verify=True):
+        '''Write the keywords which differ from the requested parameters.
+        Returns the number of keywords written.
+        '''
+        targets = self.targets(exptime=exptime, coadds=coadds,
+                               sampmode=sampmode, object=object)
+        if len(self.current) == 0:
+            self.refresh()
+        unchanged = [keyword for keyword, value in targets.items()
+                     if self.matches(keyword, self.current.get(keyword), value)]
+        if len(unchanged) > 0 and self.monitored is False:
+            # Without a monitor the cache may be stale (e.g. a write by
+            # another client), so read the keywords which would be skipped
+            self.current.update(self._read(unchanged))
+        changes = {keyword: value for keyword, value in targets.items()
+                   if not self.matches(keyword, self.current.get(keyword), value)}
+        self.skipped += len(targets) - len(changes)
+        if len(changes) == 0:
+            log.debug('Exposure parameters unchanged')
+            return 0
+
+        log.debug(f'Setting {changes}')
+        with ThreadPoolExecutor(max_workers=len(changes)) as executor:
+            list(executor.map(lambda kv: ktl.cache(service='mds', keyword=kv[0]).write(kv[1]),
+                              changes.items()))
+        self.writes += len(changes)
+
+        if verify is True:
+            result = self._read(changes.keys())
+            failed = [keyword for keyword, value in changes.items()
+                      if not self.matches(keyword, result[keyword], value)]
+            self.current.update(result)
+            if len(failed) > 0:
+                raise FailedCondition('Failed to set ' + ', '.join(
+                    [f'{kw} to "{changes[kw]}" (is "{result[kw]}")' for kw in failed]))
+        else:
+            self.current.update({kw: str(value) for kw, value in changes.items()})
+        return len(changes)
+
+
+# Shared by take_exposure, created on first use
+_exposure_config = None
+
+
+def get_exposure_config():
+    '''Return the ExposureConfig used by `take_exposure`.
+    '''
+    global _exposure_config
+    if _exposure_config is None:
+        _exposure_config = ExposureConfig()
+    return _exposure_config
+
+
+def _update_exposure_config(**values):
+    '''Update the cache of the shared ExposureConfig, if it has been filled,
+    with keyword values written outside of it (e.g. by `set_exptime`).
+    '''
+    if _exposure_config is not None and len(_exposure_config.current) > 0:
+        _exposure_config.current.update({keyword: str(value)
+                                         for keyword, value in values.items()})
+
+
 ##-----------------------------------------------------------------------------
 ## take exposure
 ##-----------------------------------------------------------------------------
 def take_exposure(exptime=None, coadds=None, sampmode=None, object=None,
                   wait=True, waitforFCS=False, updateFCS=False,
-                  skipprecond=False, skippostcond=False):
+                  check_async=False, skipprecond=False, skippostcond=False):
     '''Take an exposure.
     
     If the exptime, coadds, sampmode inputs are specified, those parameters for
-    the exposure will be set prior to triggering the exposure.
+    the exposure will be set prior to triggering the exposure.  Only the
+    parameters which differ from the current values are written (see
+    `ExposureConfig`).
+
+    If check_async is True, the check that the file is on disk is done in the
+    background and a missing file raises FailedCondition at the start of the
+    next exposure instead.
     '''
     this_function_name = inspect.currentframe().f_code.co_name
     log.debug(f"Executing: {this_function_name}")
 
+    profile = ExposureProfile() if _profiler is not None else None
+
     ##-------------------------------------------------------------------------
     ## Pre-Condition Checks
     if skipprecond is True:
         log.debug('Skipping pre condition checks')
     else:
+        path_resolver.raise_if_missing()
         waitfor_exposure()
+    _mark(profile, 'precondition')
     
     ##-------------------------------------------------------------------------
     ## Script Contents
-    if exptime is not None:
-        set_exptime(exptime)
-    if coadds is not None:
-        set_coadds(coadds)
-    if sampmode is not None:
-        set_sampmode(sampmode)
-    if object is not None:
-        set_object(object)
+    get_exposure_config().apply(exptime=exptime, coadds=coadds,
+                                sampmode=sampmode, object=object)
     if updateFCS is True:
         update_FCS()
         sleep(1)
     if waitforFCS is True:
         waitfor_FCS()
+    _mark(profile, 'parameters')
     
     GOkw = ktl.cache(service='mds', keyword='GO')
     log.info('Starting exposure')
     GOkw.write(True)
+    _mark(profile, 'go')
 
     ##-------------------------------------------------------------------------
     ## Post-Condition Checks
+    imagefile = None
     if skippostcond is True:
         log.debug('Skipping post condition checks')
     else:
         if wait is True:
-            waitfor_exposure(shim=True)
-        imagefile = lastfile()
-        if imagefile.exists():
+            waitfor_exposure(shim=True, profile=profile)
+        imagefile = lastfile(check_async=check_async)
+        _mark(profile, 'lastfile')
+        if check_async is False:
             log.info(f'  Found last file {imagefile.name}')
-        else:
-            raise FailedCondition(f'Did not find file: {imagefile}')
+    _record_profile(profile, imagefile)
 
     return None
 
 
+##-----------------------------------------------------------------------------
+## Exposure Sequence
+##-----------------------------------------------------------------------------
+def exposure_frame(exptime=None, coadds=None, sampmode=None, object=None,
+                   frameid=None, xoffset=None, yoffset=None, before=None,
+                   done=None):
+    '''Describe a single frame for `ExposureSequence`.  Parameters which are
+    None are left at their current values.
+
+    before is called (with no arguments) after the previous frame has been
+    written and before this frame starts, e.g. to offset the telescope.  done
+    is called with the path of the frame's file once it is found on disk (on
+    a background thread, errors are logged).
+    '''
+    return {'exptime': exptime,
+            'coadds': coadds,
+            'sampmode': sampmode,
+            'object': object,
+            'metadata': {keyword: value for keyword, value
+                         in [('FRAMEID', frameid),
+                             ('XOFFSET', xoffset),
+                             ('YOFFSET', yoffset)]
+                         if value is not None},
+            'before': before,
+            'done': done}
+
+
+def waitfor_mds_ready(timeout=240, shim=True):
+    '''Block until the detector server is ready to accept parameters for the
+    next exposure.  This can happen before the current frame has been written
+    to disk.
+    '''
+    endat = datetime.utcnow() + timedelta(seconds=timeout)
+    if shim is True:
+        sleep(1)
+    READYkw = ktl.cache(service='mds', keyword='READY')
+    while not bool(int(READYkw.read())):
+        if datetime.utcnow() > endat:
+            raise FailedCondition('Timeout exceeded on waitfor_mds_ready')
+        sleep(0.1)
+
+
+class ExposureSequence(object):
+    '''Take a list of frames (see `exposure_frame`) with as little dead time
+    between them as possible.
+
+    While frame N is being read out, the detector parameters (exptime, coadds,
+    sampmode) for frame N+1 are written as soon as the detector server is
+    ready to accept them.  The other keywords in the header of frame N
+    (OBJECT, FRAMEID, XOFFSET, YOFFSET) are written only after frame N has
+    been written, concurrently with frame N+1's before function.  The check
+    that each file is on disk runs in the background and does not delay the
+    next frame.  It also compares the ITIME and COADDS in the header with the
+    values requested for the frame and logs an error if they differ (e.g. if
+    the next frame's parameters reached the header).
+
+    After `run`, the `timing` attribute holds one row per frame with the time
+    between the previous frame being written and this frame starting (dead),
+    the time from GO to the frame being written (elapsed), and the time in
+    excess of the integration and reads (overhead).
+    '''
+    def __init__(self, frames, waitforFCS=False):
+        self.frames = list(frames)
+        self.waitforFCS = waitforFCS
+        self.files = [None]*len(self.frames)
+        self.failed = []
+        self.timing = None
+
+    def _detector_parameters(self, frame):
+        return {'exptime': frame['exptime'],
+                'coadds': frame['coadds'],
+                'sampmode': frame['sampmode']}
+
+    def _write_metadata(self, frame, config):
+        '''Write OBJECT and the mosfire frame keywords concurrently, and at
+        the same time run the frame's before function (e.g. a telescope offset
+        and the wait for the guider to settle).
+        '''
+        writes = [lambda: config.apply(object=frame['object'])]
+        for keyword, value in frame['metadata'].items():
+            kw = ktl.cache(service='mosfire', keyword=keyword)
+            writes.append(lambda kw=kw, value=value: kw.write(value))
+        with ThreadPoolExecutor(max_workers=len(writes)) as executor:
+            futures = [executor.submit(write) for write in writes]
+            if frame['before'] is not None:
+                frame['before']()
+        for future in futures:
+            future.result()
+
+    def _check_header(self, imagefile, params):
+        '''Log an error if the exposure time or coadds in the header of a
+        frame differ from the effective parameters it was requested with.
+        '''
+        try:
+            with open(imagefile, 'rb') as FO:
+                header = fits.Header.fromfile(FO)
+            itime = float(header['ITIME'])/1000
+            coadds = int(header['COADDS'])
+        except Exception as e:
+            log.warning(f'Unable to check the header of {imagefile.name}: {e}')
+            return
+        if abs(itime - float(params['exptime'])) > 0.001\
+           or coadds != int(params['coadds']):
+            log.error(f'{imagefile.name} was taken with {itime:.3f} s x '
+                      f'{coadds} coadds, not {float(params["exptime"]):.3f} s '
+                      f'x {int(params["coadds"])} coadds')
+
+    def _check_file(self, index, imagefile, params=None):
+        found = path_resolver.find(imagefile)
+        if found is None:
+            log.error(f'Did not find file: {imagefile}')
+            self.failed.append((index, imagefile))
+            return None
+        log.info(f'  Found file {found.name}')
+        if params is not None:
+            self._check_header(found, params)
+        self.files[index] = found
+        if self.frames[index]['done'] is not None:
+            try:
+                self.frames[index]['done'](found)
+            except Exception as e:
+                log.error(f'Error handling {found.name} after it was written: {e}')
+        return found
+
+    def _raise_if_failed(self):
+        if len(self.failed) > 0:
+            raise FailedCondition('Did not find files: ' + ', '.join(
+                [str(imagefile) for index, imagefile in self.failed]))
+
+    def _effective_parameters(self, frame, previous):
+        '''The detector parameters a frame is taken with: a parameter which is
+        None is left at its value for the previous frame.
+        '''
+        return {key: frame[key] if frame[key] is not None else previous[key]
+                for key in ['exptime', 'coadds', 'sampmode']}
+
+    def _nominal_time(self, params):
+        '''The time for the integration and reads of a frame (s) taken with
+        the given effective parameters.
+        '''
+        return estimate_exposure_time(params['exptime'],
+                                      coadds=params['coadds'],
+                                      sampmode=params['sampmode'])\
+               - exposure_overhead
+
+    def run(self):
+        '''Take the frames.  Returns the list of files written.
+        '''
+        nframes = len(self.frames)
+        if nframes == 0:
+            return []
+        waitfor_exposure()
+        config = get_exposure_config()
+        current = dict(zip(['exptime', 'coadds', 'sampmode'],
+                           config.parameters()))
+        config.apply(**self._detector_parameters(self.frames[0]))
+        GOkw = ktl.cache(service='mds', keyword='GO')
+        rows = []
+        previous_done = datetime.utcnow()
+        with ThreadPoolExecutor(max_workers=1) as checker:
+            for i, frame in enumerate(self.frames):
+                profile = ExposureProfile() if _profiler is not None else None
+                _mark(profile, 'precondition')
+                parameters = config.parameters()
+                self._write_metadata(frame, config)
+                if self.waitforFCS is True:
+                    waitfor_FCS()
+                self._raise_if_failed()
+                _mark(profile, 'parameters')
+                go = datetime.utcnow()
+                log.info(f'Starting exposure {i+1}/{nframes}: {frame["object"]}')
+                GOkw.write(True)
+                _mark(profile, 'go')
+                if i+1 < nframes:
+                    waitfor_mds_ready()
+                    _mark(profile, 'exposure')
+                    config.apply(**self._detector_parameters(self.frames[i+1]))
+                    waitfor_exposure(profile=profile)
+                else:
+                    waitfor_exposure(shim=True, profile=profile)
+                done = datetime.utcnow()
+                imagefile = lastfile(skippostcond=True)
+                _mark(profile, 'lastfile')
+                _record_profile(profile, imagefile, parameters=parameters)
+                current = self._effective_parameters(frame, current)
+                checker.submit(self._check_file, i, imagefile, current)
+                dead = (go - previous_done).total_seconds()
+                elapsed = (done - go).total_seconds()
+                nominal = self._nominal_time(current)
+                rows.append((i+1, str(frame['object']), dead, elapsed,
+                             dead + elapsed - nominal))
+                previous_done = done
+        self._raise_if_failed()
+
+        self.timing = Table(rows=rows, names=('frame', 'object', 'dead',
+                                              'elapsed', 'overhead'))
+        log.info(f'Took {nframes} frames, mean overhead per frame '
+                 f'{np.mean(self.timing["overhead"]):.1f} s')
+        return self.files
+
+
+##-----------------------------------------------------------------------------
+## Exposure Profiling
+##-----------------------------------------------------------------------------
+class ExposureProfile(object):
+    '''Timestamps for the end of each phase of a single exposure:
+
+    - precondition: waiting for the previous exposure to finish
+    - parameters: writing the exposure parameters (and waiting for the FCS)
+    - go: writing GO until the detector server acknowledges it
+    - exposure: the integration and reads, until the server is ready
+    - write: writing the FITS file, until IMAGEDONE
+    - lastfile: resolving the file on disk
+
+    A phase which was skipped has a duration of zero.
+    '''
+    phases = ['precondition', 'parameters', 'go', 'exposure', 'write',
+              'lastfile']
+
+    def __init__(self):
+        self.start = datetime.utcnow()
+        self.marks = dict()
+
+    def mark(self, phase, once=False):
+        if once is True and phase in self.marks:
+            return
+        self.marks[phase] = datetime.utcnow()
+
+    def durations(self):
+        '''Return a dict of the duration (s) of each phase.
+        '''
+        durations = dict()
+        previous = self.start
+        for phase in self.phases:
+            if phase in self.marks:
+                durations[phase] = (self.marks[phase] - previous).total_seconds()
+                previous = self.marks[phase]
+            else:
+                durations[phase] = 0
+        return durations
+
+
+# Exposure profile logs, one per UT date, kept out of the data directory
+exposure_profile_directory = Path('~/.mosfire').expanduser()
+
+
+def exposure_profile_file(night=None):
+    '''Return the exposure profile log for a night given as a UT date string
+    (YYYYMMDD), by default the current UT date.
+    '''
+    if night is None:
+        night = datetime.utcnow().strftime('%Y%m%d')
+    return exposure_profile_directory.joinpath(f'exposure_profile_{night}.csv')
+
+
+class ExposureProfiler(object):
+    '''Append one line per exposure with the duration of each phase (see
+    `ExposureProfile`) to a CSV log.  If no logfile is given, each exposure
+    goes to the log for the UT date it was taken on (see
+    `exposure_profile_file`).
+    '''
+    columns = ['time', 'file', 'exptime', 'coadds', 'sampmode', 'nominal']\
+              + ExposureProfile.phases + ['total']
+
+    def __init__(self, logfile=None):
+        if logfile is not None:
+            logfile = Path(logfile).expanduser()
+        self.fixed_logfile = logfile
+        self._start_log()
+
+    @property
+    def logfile(self):
+        if self.fixed_logfile is not None:
+            return self.fixed_logfile
+        return exposure_profile_file()
+
+    def _start_log(self):
+        logfile = self.logfile
+        if not logfile.exists():
+            logfile.parent.mkdir(parents=True, exist_ok=True)
+            with open(logfile, 'w') as FO:
+                FO.write(','.join(self.columns) + '\n')
+        return logfile
+
+    def record(self, profile, imagefile, exptime, coadds, sampmode):
+        durations = profile.durations()
+        nominal = estimate_exposure_time(exptime, coadds=coadds,
+                                         sampmode=sampmode) - exposure_overhead
+        values = [profile.start.isoformat(timespec='seconds'),
+                  Path(imagefile).name if imagefile is not None else '',
+                  f'{exptime:.2f}', f'{coadds:d}', sampmode, f'{nominal:.2f}']\
+                 + [f'{durations[phase]:.2f}' for phase in ExposureProfile.phases]\
+                 + [f'{sum(durations.values()):.2f}']
+        with open(self._start_log(), 'a') as FO:
+            FO.write(','.join(values) + '\n')
+
+
+# The active profiler, if profiling has been started
+_profiler = None
+
+
+def start_exposure_profiling(logfile=None):
+    '''Record the phases of every exposure taken by `take_exposure` and
+    `ExposureSequence` to a log (see `ExposureProfiler`) until
+    `stop_exposure_profiling` is called.  Profiling is off unless this is
+    called.
+    '''
+    global _profiler
+    _profiler = ExposureProfiler(logfile=logfile)
+    log.info(f'Recording exposure profiles to {_profiler.logfile}')
+    return _profiler.logfile
+
+
+def stop_exposure_profiling():
+    global _profiler
+    _profiler = None
+
+
+def _mark(profile, phase):
+    if profile is not None:
+        profile.mark(phase)
+
+
+def _record_profile(profile, imagefile, parameters=None):
+    if profile is None or _profiler is None:
+        return
+    if parameters is None:
+        parameters = get_exposure_config().parameters()
+    try:
+        _profiler.record(profile, imagefile, *parameters)
+    except OSError as e:
+        log.warning(f'Unable to record exposure profile: {e}')
+
+
+def summarize_exposure_profile(logfile=None, night=None):
+    '''Read an exposure profile log and return a Table with the mean duration
+    of each phase, the mean total, and the mean overhead (total minus the
+    nominal integration and read time) for each sampmode and coadds.
+
+    If no logfile is given, the log for the night (a UT date string YYYYMMDD,
+    by default the current UT date) is read.
+    '''
+    if logfile is None:
+        logfile = exposure_profile_file(night=night)
+    profile = Table.read(logfile, format='ascii.csv')
+    profile['overhead'] = profile['total'] - profile['nominal']
+    grouped = profile.group_by(['sampmode', 'coadds'])
+    numeric = ['nominal'] + ExposureProfile.phases + ['total', 'overhead']
+    summary = grouped[['sampmode', 'coadds'] + numeric].groups.aggregate(np.mean)
+    summary['nframes'] = np.diff(grouped.groups.indices)
+    for col in numeric:
+        summary[col].format = '.2f'
+    return summary
+
+
+def summarize_exposure_profile_with_args():
+    description = '''Summarize the exposure profile log by sampmode and coadds
+    '''
+    p = argparse.ArgumentParser(description=description)
+    p.add_argument('logfile', type=str, nargs='?', default=None,
+                   help=f"The exposure profile log (default is the log for "
+                        f"the night in {exposure_profile_directory})")
+    p.add_argument('-n', '--night', dest='night', type=str, default=None,
+                   help="The UT date of the night (YYYYMMDD, default today)")
+    args = p.parse_args()
+    summary = summarize_exposure_profile(logfile=args.logfile, night=args.night)
+    summary.pprint(max_lines=-1, max_width=-1)
+
+
+##-----------------------------------------------------------------------------
+## estimate exposure time
+##-----------------------------------------------------------------------------
+def estimate_exposure_time(exptime, coadds=1, sampmode='CDS'):
+    '''Estimate the wall clock time (s) for a single frame including the
+    reads for the sampling mode and the per frame overhead.  Does not touch
+    the hardware.
+    '''
+    namematch = re.match('(M?CDS)(\d*)', sampmode.strip())
+    if namematch is None:
+        raise FailedCondition(f'Unable to parse "{sampmode}"')
+    nreads = 1 if namematch.group(1) == 'CDS' else int(namematch.group(2))
+    return coadds*(exptime + 2*nreads*read_time) + exposure_overhead
+
+
 ##-------------------------------------------------------------------------
 ## Aliases
 ##-------------------------------------------------------------------------
@@ -0,0 +1,311 @@
+from concurrent.futures import ThreadPoolExecutor
+import csv
+import json
+import os
+import numpy as np
+from astropy.io import fits
+from astropy.table import Table
+
+from .core import *
+from .detector import read_time
+from .metadata import outdir
+from .quicklook import header_sampmode
+
+
+##-------------------------------------------------------------------------
+## Calibration Journal
+##-------------------------------------------------------------------------
+class CalibrationJournal(object):
+    '''A durable record of the calibration frames which have been taken, so
+    that an interrupted calibration run can be resumed.
+
+    Each frame is identified by the mask name, the configuration section
+    (e.g. "K" or "K-imaging"), the frame type (e.g. "Ne arc"), and its index
+    within the set.  Each completed frame is appended to the journal file and
+    flushed to disk immediately.
+
+    The exposure time chosen for a set of adaptive flats (see
+    `tune_flat_exptime`) is recorded too, so that a resumed run takes the
+    rest of the set, and the matching lamps off flats, at the same exposure
+    time.
+
+    The mask attribute holds the name of the mask currently being calibrated
+    and must be set by the caller before frames are taken.
+    '''
+
+    def __init__(self, journalfile, resume=False):
+        '''If resume is True, frames recorded since the start of the last run
+        in the journal file are treated as completed.  Otherwise a new run is
+        started in the journal file.  If journalfile is None, the journal is
+        only kept in memory (e.g. for a dry run).
+        '''
+        self.file = Path(journalfile).expanduser() if journalfile is not None else None
+        self.mask = None
+        self.completed = set()
+        self.exptimes = dict()
+        if self.file is None:
+            return
+        if resume is True and self.file.exists():
+            with open(self.file, 'r') as FO:
+                for row in csv.reader(FO):
+                    if len(row) == 0:
+                        continue
+                    elif row[0] == '# start':
+                        self.completed = set()
+                        self.exptimes = dict()
+                    elif row[0] == '# exptime':
+                        timestamp, mask, section, frametype, exptime = row[1:]
+                        self.exptimes[(mask, section, frametype)] = float(exptime)
+                    elif row[0] == '# retake':
+                        timestamp, mask, section, frametype, index = row[1:]
+                        self.completed.discard( (mask, section, frametype, int(index)) )
+                    else:
+                        timestamp, mask, section, frametype, index = row
+                        self.completed.add( (mask, section, frametype, int(index)) )
+            log.info(f'Resuming calibrations: {len(self.completed)} frames '
+                     f'already taken according to {self.file}')
+        else:
+            self._append(['# start', datetime.utcnow().isoformat()])
+
+    def _append(self, row):
+        if self.file is None:
+            return
+        with open(self.file, 'a') as FO:
+            csv.writer(FO).writerow(row)
+            FO.flush()
+            os.fsync(FO.fileno())
+
+    def is_done(self, section, frametype, index):
+        return (self.mask, section, frametype, index) in self.completed
+
+    def remaining(self, section, frametype, count):
+        '''Return the indices (1 to count) of frames not yet taken.
+        '''
+        return [i for i in range(1, count+1)
+                if not self.is_done(section, frametype, i)]
+
+    def record(self, section, frametype, index):
+        self.completed.add( (self.mask, section, frametype, index) )
+        self._append([datetime.utcnow().isoformat(), self.mask, section,
+                      frametype, index])
+
+    def record_exptime(self, section, frametype, exptime):
+        '''Record the exposure time chosen for a set of frames.
+        '''
+        self.exptimes[(self.mask, section, frametype)] = exptime
+        self._append(['# exptime', datetime.utcnow().isoformat(), self.mask,
+                      section, frametype, exptime])
+
+    def exptime(self, section, frametype, mask=None):
+        '''Return the exposure time recorded for a set of frames of the
+        current mask (or the named mask), or None.
+        '''
+        mask = self.mask if mask is None else mask
+        return self.exptimes.get((mask, section, frametype), None)
+
+    def mark_done(self, mask, section, frametype, index):
+        '''Mark a frame of the named mask as taken (e.g. one found on disk).
+        '''
+        if (mask, section, frametype, index) in self.completed:
+            return
+        self.completed.add( (mask, section, frametype, index) )
+        self._append([datetime.utcnow().isoformat(), mask, section,
+                      frametype, index])
+
+    def forget(self, mask, section, frametype, index):
+        '''Mark a frame as needing to be taken again.
+        '''
+        self.completed.discard( (mask, section, frametype, index) )
+        self._append(['# retake', datetime.utcnow().isoformat(), mask, section,
+                      frametype, index])
+
+
+def _remaining(journal, section, frametype, count):
+    '''Return the indices (1 to count) of frames still to be taken.
+    '''
+    if journal is None:
+        return list(range(1, count+1))
+    return journal.remaining(section, frametype, count)
+
+
+def _record(journal, section, frametype, index):
+    if journal is not None:
+        journal.record(section, frametype, index)
+
+
+def _recorded_exptime(journal, section, frametype):
+    if journal is None:
+        return None
+    return journal.exptime(section, frametype)
+
+
+def _record_exptime(journal, section, frametype, exptime):
+    if journal is not None:
+        journal.record_exptime(section, frametype, exptime)
+
+
+##-------------------------------------------------------------------------
+## Existing Calibration Frames
+##-------------------------------------------------------------------------
+# Cache of header information keyed by file, used to avoid re-reading headers
+# of files which have not changed.  Values are (mtime, size, header info).
+# `index_calibration_frames` keeps a copy of the cache for each data directory
+# in a file under header_cache_directory (not in the data directory itself),
+# so it survives between runs.
+_frame_header_cache = {}
+# Columns of the index (see `read_calibration_frame_header`) and their types
+index_columns = {'file': 'U256', 'object': 'U68', 'mask': 'U68',
+                 'section': 'U20', 'exptime': 'f8', 'coadds': 'i4',
+                 'sampmode': 'U8', 'lamps': 'U3'}
+header_cache_directory = Path('~/.mosfire/calibration_header_cache').expanduser()
+
+
+def _header_cache_file(directory):
+    '''The header cache file for a data directory, e.g.
+    s_sdata1300_mosfire3_2026oct19.json for /s/sdata1300/mosfire3/2026oct19.
+    '''
+    return header_cache_directory.joinpath('_'.join(directory.parts[1:]) + '.json')
+
+
+def read_calibration_frame_header(fitsfile):
+    '''Read the information needed to identify a calibration frame from the
+    primary header of a FITS file.  Only the header blocks are read.  Results
+    are cached and only re-read if the file modification time or size change.
+
+    Returns a dict with the object, mask name, configuration section (e.g.
+    "K" or "K-imaging"), exposure time per coadd, coadds, sampling mode (e.g.
+    "MCDS16"), and dome flat lamp state ("on", "off", or "" if unknown).
+    '''
+    fitsfile = Path(fitsfile).expanduser()
+    stat = fitsfile.stat()
+    cached = _frame_header_cache.get(str(fitsfile), None)
+    if cached is not None and cached[0] == stat.st_mtime and cached[1] == stat.st_size:
+        return cached[2]
+
+    with open(fitsfile, 'rb') as FO:
+        header = fits.Header.fromfile(FO)
+    filt = str(header.get('FILTER', '')).strip()
+    obsmode = str(header.get('OBSMODE', '')).strip()
+    section = f"{filt}-imaging" if obsmode.endswith('imaging') else filt
+    if 'TRUITIME' in header.keys():
+        exptime = float(header.get('TRUITIME'))
+    else:
+        exptime = float(header.get('ITIME', np.nan))/1000
+    lamps = [str(header.get(kw, '')).strip().lower()
+             for kw in ['FLSPECTR', 'FLIMAGIN']]
+    if 'on' in lamps:
+        lampstate = 'on'
+    elif 'off' in lamps:
+        lampstate = 'off'
+    else:
+        lampstate = ''
+    info = {'file': str(fitsfile),
+            'object': str(header.get('OBJECT', '')).strip(),
+            'mask': str(header.get('MASKNAME', '')).strip(),
+            'section': section,
+            'exptime': exptime,
+            'coadds': int(header.get('COADDS', 1)),
+            'sampmode': header_sampmode(header),
+            'lamps': lampstate,
+            }
+    _frame_header_cache[str(fitsfile)] = (stat.st_mtime, stat.st_size, info)
+    return info
+
+
+def _read_calibration_frame_header_or_none(fitsfile):
+    '''Wrapper around `read_calibration_frame_header` for use in batch mode.
+    '''
+    try:
+        return read_calibration_frame_header(fitsfile)
+    except Exception as e:
+        log.warning(f'Unable to read header of {fitsfile}: {e}')
+        return None
+
+
+def _load_header_cache(directory):
+    '''Add the entries in the directory's header cache file to the cache.
+    '''
+    cachefile = _header_cache_file(directory)
+    if not cachefile.exists():
+        return
+    try:
+        with open(cachefile, 'r') as FO:
+            entries = json.load(FO)
+    except Exception as e:
+        log.warning(f'Unable to read header cache {cachefile}: {e}')
+        return
+    for name, (mtime, size, info) in entries.items():
+        if not set(index_columns).issubset(info.keys()):
+            # Written before a column was added, read the header again
+            continue
+        _frame_header_cache.setdefault(str(directory.joinpath(name)),
+                                       (mtime, size, info))
+
+
+def _save_header_cache(directory, files):
+    '''Write the cache entries for the given files to the directory's header
+    cache file.
+    '''
+    entries = {}
+    for fitsfile in files:
+        cached = _frame_header_cache.get(str(fitsfile), None)
+        if cached is not None:
+            entries[fitsfile.name] = cached
+    cachefile = _header_cache_file(directory)
+    tmpfile = cachefile.with_name(f'{cachefile.name}.tmp')
+    try:
+        cachefile.parent.mkdir(parents=True, exist_ok=True)
+        with open(tmpfile, 'w') as FO:
+            json.dump(entries, FO)
+        tmpfile.replace(cachefile)
+    except Exception as e:
+        log.warning(f'Unable to write header cache {cachefile}: {e}')
+
+
+def index_calibration_frames(directory=None, pattern='*.fits', nthreads=8):
+    '''Build an index of the frames in a directory (the current output
+    directory by default) from their headers, using a pool of threads.
+    Headers cached for the directory by a previous run (see
+    header_cache_directory) are only re-read if the file modification time or
+    size changed.
+
+    Returns a Table with one row per frame with the columns described in
+    `read_calibration_frame_header`.
+    '''
+    if directory is None:
+        directory = outdir()
+    directory = Path(directory).expanduser().resolve()
+    files = sorted(directory.glob(pattern))
+    tick = datetime.utcnow()
+    _load_header_cache(directory)
+    with ThreadPoolExecutor(max_workers=nthreads) as executor:
+        results = list(executor.map(_read_calibration_frame_header_or_none, files))
+    _save_header_cache(directory, files)
+    results = [info for info in results if info is not None]
+    names = tuple(index_columns.keys())
+    index = Table([[info[name] for info in results] for name in names],
+                  names=names, dtype=tuple(index_columns.values()))
+    duration = (datetime.utcnow()-tick).total_seconds()
+    log.info(f'Indexed {len(index)} frames in {directory} in {duration:.1f} s')
+    return index
+
+
+def count_existing_frames(index, maskname, section, frametype, exptime,
+                          coadds=1, sampmode='CDS'):
+    '''Count the frames in an index built by `index_calibration_frames`
+    which match the given calibration frame.
+    '''
+    if len(index) == 0:
+        return 0
+    match = (index['object'] == frametype)\
+            & (index['mask'] == maskname)\
+            & (index['section'] == section)\
+            & (index['coadds'] == coadds)\
+            & (index['sampmode'] == sampmode.strip())\
+            & (np.abs(index['exptime'] - exptime) <= read_time)
+    # Reject frames where the dome lamp state contradicts the frame type
+    if frametype == 'Dome Flat':
+        match &= (index['lamps'] != 'off')
+    elif frametype == 'Dome Flat (lamps off)':
+        match &= (index['lamps'] != 'on')
+    return int(np.sum(match))
@@ -1,6 +1,7 @@
 import random
 import re
 import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
 
 from astropy.io import fits
 from astropy.table import Table, Column
@@ -195,17 +196,20 @@ class Mask(object):
 
 
     def read_fits_header(self, fitsfile):
-        '''Read the FITS header keywords in the first extension.
+        '''Read the slit positions from the bar positions (B##POS keywords) in
+        the primary header of a FITS file (see `read_fits_bar_positions`).
+        The mask name is taken from the MASKNAME keyword if it is present.
         '''
-        fitsfile = Path(fitsfile).expanduser()
-        hdul = fits.open(fitsfile)
+        maskname, barpos = read_fits_bar_positions(fitsfile)
+        if maskname != '':
+            self.name = maskname
 
         slits_list = []
         for slitno in range(1,47,1):
             leftbar = slitno*2
-            leftmm = float(hdul[0].header.get(f"B{leftbar:02d}POS"))
+            leftmm = barpos[leftbar-1]
             rightbar = slitno*2-1
-            rightmm = float(hdul[0].header.get(f"B{rightbar:02d}POS"))
+            rightmm = barpos[rightbar-1]
             slitcent = (slitno-23) * .490454545
             width = (leftmm-rightmm) * 0.35795
             slits_list.append( {'centerPositionArcsec': slitcent,
@@ -445,3 +449,54 @@ class Mask(object):
                                 'target': ''} )
         self.slitpos = Table(slits_list)
         
+
+
+##-------------------------------------------------------------------------
+## Header-only FITS Readers
+##-------------------------------------------------------------------------
+def read_fits_bar_positions(fitsfile):
+    '''Read the mask name and the CSU bar positions from the primary header
+    of a FITS file.  Only the header blocks are read, the pixel data are never
+    touched.
+
+    Returns a tuple of the mask name (the MASKNAME keyword) and a (92,) array
+    of bar positions in mm where index 0 is bar 1.  Missing B##POS keywords
+    are returned as nan.
+    '''
+    fitsfile = Path(fitsfile).expanduser()
+    with open(fitsfile, 'rb') as FO:
+        header = fits.Header.fromfile(FO)
+    maskname = str(header.get('MASKNAME', '')).strip()
+    barpos = np.array([float(header.get(f"B{bar:02d}POS", np.nan))
+                       for bar in range(1,93,1)])
+    return maskname, barpos
+
+
+def _read_fits_bar_positions_or_nan(fitsfile):
+    '''Wrapper around `read_fits_bar_positions` for use in batch mode.  A
+    file which can not be read results in a warning and a row of nan values
+    rather than stopping the whole batch.
+    '''
+    try:
+        return read_fits_bar_positions(fitsfile)
+    except Exception as e:
+        log.warning(f'Unable to read header of {fitsfile}: {e}')
+        return '', np.full(92, np.nan)
+
+
+def read_fits_bar_positions_from_directory(directory, pattern='*.fits',
+                                           nthreads=8):
+    '''Scan a directory of frames (e.g. a night of data) and read the bar
+    positions from each header using a pool of threads.
+
+    Returns a tuple of the list of files (sorted by name), the list of mask
+    names, and a (n_frames, 92) array of bar positions in mm.
+    '''
+    directory = Path(directory).expanduser()
+    files = sorted(directory.glob(pattern))
+    log.info(f'Reading bar positions from {len(files)} headers in {directory}')
+    with ThreadPoolExecutor(max_workers=nthreads) as executor:
+        results = list(executor.map(_read_fits_bar_positions_or_nan, files))
+    masknames = [result[0] for result in results]
+    barpos = np.array([result[1] for result in results]).reshape(len(files), 92)
+    return files, masknames, barpos
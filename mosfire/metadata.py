@@ -1,6 +1,122 @@
+from concurrent.futures import ThreadPoolExecutor
+
 from .core import *
 
 
+##-----------------------------------------------------------------------------
+## Path Resolution
+##-----------------------------------------------------------------------------
+class PathResolver(object):
+    '''Map paths reported by the keyword services to the paths at which they
+    are visible on this host.  On some hosts (e.g. vm-mosfire) the data disks
+    are only mounted with /s prepended.
+
+    The prefix which works is learned once per top level directory (e.g.
+    /sdata1300) and then remembered, so later paths are resolved with no
+    filesystem access.  A prefix is only remembered once a full path was
+    found under it, and it is forgotten again when a path resolved with it
+    turns out to be missing.  Existence checks of files can be queued with
+    `check_async` so the caller does not wait on NFS.
+    '''
+    prefixes = ['/', '/s']
+
+    def __init__(self):
+        self.mapping = dict()
+        self.executor = None
+        self.pending = []
+
+    def _learn(self, path):
+        '''Find the prefix under which the path exists and remember it for
+        the path's top level directory.  If the file is not found under any
+        prefix, return the first prefix under which the top level directory
+        exists without remembering it.
+        '''
+        top = path.parts[1]
+        for prefix in self.prefixes:
+            if Path(prefix).joinpath(*path.parts[1:]).exists():
+                log.debug(f'Resolving /{top} to {Path(prefix).joinpath(top)}')
+                self.mapping[top] = prefix
+                return prefix
+        for prefix in self.prefixes:
+            if Path(prefix).joinpath(top).exists():
+                return prefix
+        return None
+
+    def forget(self, path):
+        '''Drop the prefix remembered for the path's top level directory, so
+        it is probed again next time.  Returns True if a prefix was dropped.
+        '''
+        path = Path(path)
+        if not path.is_absolute() or len(path.parts) < 2:
+            return False
+        if self.mapping.pop(path.parts[1], None) is None:
+            return False
+        log.debug(f'Forgetting prefix for /{path.parts[1]}')
+        return True
+
+    def resolve(self, path):
+        '''Return the path at which the given path is visible on this host.
+        Paths under a top level directory which can not be found are returned
+        unchanged (and the directory is probed again next time).
+        '''
+        path = Path(path)
+        if not path.is_absolute() or len(path.parts) < 2:
+            return path
+        prefix = self.mapping.get(path.parts[1], None)
+        if prefix is None:
+            prefix = self._learn(path)
+        if prefix is None:
+            return path
+        return Path(prefix).joinpath(*path.parts[1:])
+
+    def find(self, path):
+        '''Resolve the path and return it if the file exists, otherwise None.
+        If the file is missing at a remembered prefix, the prefix is forgotten
+        and the path is resolved once more.
+        '''
+        resolved = self.resolve(path)
+        if resolved.exists():
+            return resolved
+        if self.forget(path) is True:
+            resolved = self.resolve(path)
+            if resolved.exists():
+                return resolved
+        return None
+
+    def check_async(self, path):
+        '''Queue a check that the file exists.  Missing files are reported by
+        `raise_if_missing`.  Returns the resolved path.
+        '''
+        resolved = self.resolve(path)
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=1)
+        self.pending.append((path, resolved,
+                             self.executor.submit(resolved.exists)))
+        return resolved
+
+    def raise_if_missing(self, wait=False):
+        '''Raise FailedCondition if any of the queued checks found a missing
+        file.  Checks which have not finished are left queued unless wait is
+        True.
+        '''
+        missing = []
+        still_pending = []
+        for path, resolved, future in self.pending:
+            if wait is True or future.done():
+                if future.result() is False:
+                    self.forget(path)
+                    missing.append(resolved)
+            else:
+                still_pending.append((path, resolved, future))
+        self.pending = still_pending
+        if len(missing) > 0:
+            raise FailedCondition('Could not find files on disk: '
+                                  + ', '.join([str(p) for p in missing]))
+
+
+path_resolver = PathResolver()
+
+
 ##-----------------------------------------------------------------------------
 ## OUTDIR
 ##-----------------------------------------------------------------------------
@@ -44,13 +160,9 @@ def set_outdir(input, skipprecond=False, skippostcond=False):
     if skipprecond is True:
         log.debug('Skipping pre condition checks')
     else:
-        p = Path(input)
+        p = path_resolver.resolve(input)
         if not p.parent.exists():
-            trypath = Path('/s')
-            for part in p.parent.parts[1:]:
-                trypath = trypath.joinpath(part)
-            if not trypath.exists():
-                raise FailedCondition(f'Can not find parent directory for {input}')
+            raise FailedCondition(f'Can not find parent directory for {input}')
 
     ##-------------------------------------------------------------------------
     ## Script Contents
@@ -224,11 +336,13 @@ def filename(skipprecond=False, skippostcond=False):
 ##-----------------------------------------------------------------------------
 ## lastfile
 ##-----------------------------------------------------------------------------
-def lastfile(skipprecond=False, skippostcond=False):
+def lastfile(check_async=False, skipprecond=False, skippostcond=False):
     '''Return the last filename value as a `pathlib.Path` object.
     
-    This also checks that the file exists.  If it does not, it checks a
-    similar path with /s prepended.  This handles the vm-mosfire machine case.
+    The path is resolved to where it is visible on this host (see
+    `PathResolver`), which handles the vm-mosfire machine case.  This also
+    checks that the file exists.  If check_async is True, the check is queued
+    and a missing file is reported by `path_resolver.raise_if_missing`.
     '''
     this_function_name = inspect.currentframe().f_code.co_name
     log.debug(f"Executing: {this_function_name}")
@@ -243,23 +357,18 @@ def lastfile(skipprecond=False, skippostcond=False):
     ##-------------------------------------------------------------------------
     ## Script Contents
     lastfilekw = ktl.cache(service='mds', keyword='LASTFILE')
-    lastfile_path = Path(lastfilekw.read())
+    lastfile_path = path_resolver.resolve(lastfilekw.read())
     
     ##-------------------------------------------------------------------------
     ## Post-Condition Checks
     if skippostcond is True:
         log.debug('Skipping post condition checks')
+    elif check_async is True:
+        path_resolver.check_async(lastfile_path)
     else:
         if lastfile_path.exists():
             log.debug(f'Found file at {lastfile_path}')
         else:
-            trypath = Path('/s')
-            for part in lastfile_path.parts[1:]:
-                trypath = trypath.joinpath(part)
-            if trypath.exists():
-                log.debug(f'Found file at {trypath}')
-                return trypath
-            else:
-                raise FailedCondition(f'Could not find last file on disk: {lastfile_path}')
+            raise FailedCondition(f'Could not find last file on disk: {lastfile_path}')
 
     return lastfile_path
@@ -0,0 +1,177 @@
+from astropy.table import Table
+
+from .core import *
+from .tel import mxy, gotobase, markbase, slit_angle
+from .detector import exposure_frame, ExposureSequence
+
+
+##-----------------------------------------------------------------------------
+## Pattern Definitions
+##-----------------------------------------------------------------------------
+# Each pattern is a list of frames.  The position of each frame is given
+# relative to base by x and y (arcsec in the mxy coordinates) plus an offset
+# along the slit (arcsec, as for sltmov).  A value may be a number or a
+# (factor, parameter) pair, which is factor times the named parameter of the
+# pattern.  The pscale parameter is read from the mosfire PSCALE keyword.
+#
+# The PATTERN keyword is set to the pattern name, or to the pattern's keyword
+# value if it has one.
+#
+# Other keys for each frame:
+# - frameid, xoffset, yoffset: values for the FRAMEID, XOFFSET, and YOFFSET
+#   keywords (same value rules as the position)
+# - via_base: return to base before moving to this position (the move is
+#   not merged with the previous one)
+# - settle: this is a large offset, wait settle_cycles guide cycles after it
+#   instead of nod_cycles
+def _long2pos_frames(wide=False):
+    frames = []
+    for x, y, xoffset, via_base in [(245.8, -88.0, -45.0, False),
+                                    (-245.8, 88.0, +45.0, True)]:
+        position = {'x': (x, 'pscale'), 'y': (y, 'pscale'), 'xoffset': xoffset}
+        if wide is True:
+            frames.append(dict(position, slit=0, frameid='A', yoffset=0.0,
+                               via_base=via_base, settle=True))
+        frames.append(dict(position, slit=-7.0, frameid='B', yoffset=-7.0,
+                           via_base=via_base and not wide, settle=not wide))
+        frames.append(dict(position, slit=+7.0, frameid='A', yoffset=+7.0))
+    return frames
+
+
+dither_patterns = {
+    'ABBA': {'parameters': {'throw': 3.0},
+             'frames': [{'slit': (s, 'throw'), 'yoffset': (s, 'throw'),
+                         'frameid': frameid}
+                        for frameid, s in [('A', 0.5), ('B', -0.5),
+                                           ('B', -0.5), ('A', 0.5)]]},
+    'long2pos': {'parameters': {},
+                 'frames': _long2pos_frames(wide=False)},
+    'long2pos_specphot': {'parameters': {},
+                          'keyword': 'long2pos',
+                          'frames': _long2pos_frames(wide=True)},
+    'box4': {'parameters': {'throw': 5.0},
+             'frames': [{'x': (x, 'throw'), 'y': (y, 'throw'),
+                         'xoffset': (x, 'throw'), 'yoffset': (y, 'throw'),
+                         'frameid': frameid}
+                        for frameid, x, y in [('A', 0.5, 0.5), ('B', -0.5, 0.5),
+                                              ('C', -0.5, -0.5), ('D', 0.5, -0.5)]]},
+    'box5': {'parameters': {'throw': 5.0},
+             'frames': [{'x': (x, 'throw'), 'y': (y, 'throw'),
+                         'xoffset': (x, 'throw'), 'yoffset': (y, 'throw'),
+                         'frameid': frameid}
+                        for frameid, x, y in [('A', 0, 0), ('B', 0.5, 0.5),
+                                              ('C', -0.5, 0.5), ('D', -0.5, -0.5),
+                                              ('E', 0.5, -0.5)]]},
+}
+
+
+##-----------------------------------------------------------------------------
+## Plan Pattern
+##-----------------------------------------------------------------------------
+def _value(value, parameters):
+    if isinstance(value, tuple):
+        factor, name = value
+        if name not in parameters:
+            raise FailedCondition(f'Pattern parameter {name} is not defined')
+        return factor*parameters[name]
+    return value
+
+
+def plan_pattern(name, repeats=1, **parameters):
+    '''Compute the position of each frame of a pattern (see dither_patterns)
+    and the moves between them, without touching the telescope.
+
+    The pattern parameters (e.g. throw) can be overridden by keyword.  If the
+    pattern uses pscale and it is not given, it is read from the mosfire
+    PSCALE keyword.
+
+    Returns a Table with one row per frame: the frame keyword values, the
+    position relative to base (x, y in the mxy coordinates), whether the move
+    to it goes via base, and the single mxy offset (dx, dy) which gets there.
+    Consecutive offsets with no frame between them are merged into one move.
+    '''
+    if name not in dither_patterns.keys():
+        raise FailedCondition(f'Unknown pattern "{name}"')
+    pattern = dither_patterns[name]
+    parameters = dict(pattern['parameters'], **parameters)
+    uses_pscale = any([isinstance(value, tuple) and value[1] == 'pscale'
+                       for frame in pattern['frames'] for value in frame.values()])
+    if uses_pscale and 'pscale' not in parameters:
+        pscalekw = ktl.cache(service='mosfire', keyword='PSCALE')
+        parameters['pscale'] = float(pscalekw.read(binary=True))
+
+    rows = []
+    current = (0.0, 0.0)
+    for frame in pattern['frames']*repeats:
+        slit = _value(frame.get('slit', 0), parameters)
+        x = _value(frame.get('x', 0), parameters) + slit*np.sin(slit_angle)
+        y = _value(frame.get('y', 0), parameters) + slit*np.cos(slit_angle)
+        via_base = frame.get('via_base', False)
+        if via_base is True:
+            current = (0.0, 0.0)
+        dx, dy = x - current[0], y - current[1]
+        if abs(dx) < 0.001 and abs(dy) < 0.001:
+            dx, dy = 0.0, 0.0
+        rows.append((str(frame.get('frameid', '')),
+                     float(_value(frame.get('xoffset', 0), parameters)),
+                     float(_value(frame.get('yoffset', 0), parameters)),
+                     x, y, via_base, dx, dy, frame.get('settle', False)))
+        current = (x, y)
+    return Table(rows=rows, names=('frameid', 'xoffset', 'yoffset', 'x', 'y',
+                                   'via_base', 'dx', 'dy', 'settle'))
+
+
+##-----------------------------------------------------------------------------
+## Run Pattern
+##-----------------------------------------------------------------------------
+def _move(dx, dy, via_base, guidecycles):
+    def move():
+        if via_base is True:
+            log.info('Returning to base')
+            gotobase(guidecycles=guidecycles if dx == dy == 0 else 0)
+        if dx != 0 or dy != 0:
+            log.info(f'Offsetting {dx:.2f}, {dy:.2f} arcsec')
+            mxy(dx, dy, guidecycles=guidecycles)
+    return move
+
+
+def run_pattern(name, repeats=1, nod_cycles=2, settle_cycles=4,
+                exptime=None, coadds=None, sampmode=None, object=None,
+                **parameters):
+    '''Take one frame at each position of a pattern (see `plan_pattern`).
+
+    The moves are planned up front, each move waits for nod_cycles guide
+    cycles (settle_cycles for the large offsets marked settle), and the
+    frame keywords are written while the telescope moves.  The frames are
+    taken as an `ExposureSequence`.  Returns to base at the end.
+
+    Returns the list of files written.
+    '''
+    plan = plan_pattern(name, repeats=repeats, **parameters)
+    log.info(f'Starting {name} pattern ({len(plan)} frames)')
+    start_scriptrun()
+    try:
+        markbase()
+        ktl.cache(service='mosfire', keyword='PATTERN').write(
+                  dither_patterns[name].get('keyword', name))
+        frames = []
+        for row in plan:
+            guidecycles = settle_cycles if row['settle'] else nod_cycles
+            before = None
+            if row['via_base'] or row['dx'] != 0 or row['dy'] != 0:
+                before = _move(float(row['dx']), float(row['dy']),
+                               bool(row['via_base']), guidecycles)
+            frames.append(exposure_frame(exptime=exptime, coadds=coadds,
+                                         sampmode=sampmode, object=object,
+                                         frameid=str(row['frameid']),
+                                         xoffset=float(row['xoffset']),
+                                         yoffset=float(row['yoffset']),
+                                         before=before))
+        files = ExposureSequence(frames).run()
+        log.info('Returning to base')
+        gotobase(guidecycles=0)
+        ktl.cache(service='mosfire', keyword='XOFFSET').write(0.0)
+        ktl.cache(service='mosfire', keyword='YOFFSET').write(0.0)
+    finally:
+        stop_scriptrun()
+    return files
@@ -0,0 +1,320 @@
+import itertools
+import numpy as np
+from astropy.table import Table
+
+from .core import *
+from .csu import execute_mask, predict_move_time, estimate_move_time, masks_match
+from .detector import estimate_exposure_time
+from .state import InstrumentState
+
+
+##-------------------------------------------------------------------------
+## Calibration Scheduling
+##-------------------------------------------------------------------------
+# Approximate duration (s) of each mechanism action.  Used to estimate and
+# order calibrations, not to control the hardware.
+mechanism_times = {'hatch': 30,
+                   'obsmode': 40,
+                   'go_dark': 15,
+                   'dome_lamps': 10,
+                   'arc_lamp': 5,
+                   'csu_setup': 10,
+                   }
+
+
+def calibration_blocks(mask, filters, cfg, imaging=False):
+    '''Return the list of calibration blocks needed for one mask.  Each
+    block is a (mask, filter, caltype) tuple where caltype is "arcs" or
+    "flats".  Blocks with no frames to take are left out.
+    '''
+    blocks = []
+    for filt in filters:
+        section = filt if imaging is False else f"{filt}-imaging"
+        if section not in cfg.keys():
+            raise FailedCondition(f'Filter "{section}" not in configuration')
+        config = cfg[section]
+        narcs = config.ne_arc_count + config.ar_arc_count
+        nflats = config.flat_count + config.flatoff_count
+        if imaging is False and narcs > 0:
+            blocks.append( (mask, filt, 'arcs') )
+        if nflats > 0:
+            blocks.append( (mask, filt, 'flats') )
+    return blocks
+
+
+def block_mechanism_time(block, state, cfg, imaging=False):
+    '''Estimate the mechanism time (s) of a calibration block, not counting
+    CSU moves, and the instrument state after it.  The state is a tuple of
+    the hatch position, the obsmode, and whether the instrument is dark
+    ("dark"), has a go_dark pending ("pending", see `InstrumentState`), or
+    neither (None).
+
+    The rules follow `InstrumentState`: the instrument goes dark before the
+    hatch moves, a pending go_dark is merged into an obsmode change, and
+    going back to the same obsmode from dark only moves the filter wheels
+    (charged as a go_dark).  Each block ends with a pending go_dark.
+    '''
+    mask, filt, caltype = block
+    hatch, obsmode, dark = state
+    duration = 0
+    if caltype == 'arcs':
+        config = cfg[filt]
+        needed = 'Closed'
+        mode = f"{filt}-spectroscopy"
+        nlamps = int(config.ne_arc_count > 0) + int(config.ar_arc_count > 0)
+        duration += 2*nlamps*mechanism_times['arc_lamp']
+    else:
+        section = filt if imaging is False else f"{filt}-imaging"
+        config = cfg[section]
+        needed = 'Open'
+        mode = f"{filt}-spectroscopy" if imaging is False else f"{filt}-imaging"
+        nlamps = int(config.flat_count > 0) + int(config.flatoff_count > 0)
+        duration += nlamps*mechanism_times['dome_lamps']
+    if hatch != needed:
+        if dark != 'dark':
+            duration += mechanism_times['go_dark']
+            dark = 'dark'
+        duration += mechanism_times['hatch']
+        hatch = needed
+    if obsmode != mode:
+        duration += mechanism_times['obsmode']
+    elif dark == 'dark':
+        duration += mechanism_times['go_dark']
+    return duration, (hatch, mode, 'pending')
+
+
+def plan_calibrations(calibration_inputs, cfg, imaging=False,
+                      current_mask=None, hatch=None, obsmode=None,
+                      max_exact=7, max_exact_blocks=6):
+    '''Determine the order in which to take calibrations which minimizes the
+    time spent moving mechanisms.
+
+    calibration_inputs is a list of (Mask, filters) tuples.  The current_mask
+    (e.g. from `read_csu_bar_state`), hatch position, and obsmode describe the
+    starting state of the instrument.
+
+    The cost of an order is the CSU move time (see `predict_move_time`) plus
+    the hatch, obsmode, go_dark, and lamp times of each block (see
+    `block_mechanism_time`).  The mask order is searched over all mask orders
+    if there are max_exact or fewer masks, otherwise the order is built by
+    always going to the cheapest remaining mask.  Within each mask, the order
+    of the (filter, caltype) blocks is searched over all orders if there are
+    max_exact_blocks or fewer blocks, otherwise it is built by always taking
+    the cheapest remaining block.  The block order of each mask is the best
+    one for the state the instrument is in when that mask is reached.
+
+    Returns the plan as a list of (mask, filter, caltype) blocks and the
+    predicted mechanism time (s) for the plan.  See
+    `estimate_calibration_time` for an estimate of the whole run.
+    '''
+    blocks = [calibration_blocks(mask, filters, cfg, imaging=imaging)
+              for mask, filters in calibration_inputs]
+    masks = [mask for mask, filters in calibration_inputs]
+    nmasks = len(masks)
+
+    # CSU move times between masks.  Index 0 is the starting state.
+    move_times = np.zeros((nmasks+1, nmasks+1))
+    for i,mask1 in enumerate([current_mask] + masks):
+        for j,mask2 in enumerate(masks):
+            if mask1 is None:
+                move_times[i,j+1] = estimate_move_time([np.nan])
+            elif mask1 is mask2 or masks_match(mask1, mask2):
+                continue
+            else:
+                move_times[i,j+1] = predict_move_time(mask1, mask2)
+
+    def blocks_cost(block_order, state):
+        cost = 0
+        for block in block_order:
+            duration, state = block_mechanism_time(block, state, cfg,
+                                                   imaging=imaging)
+            cost += duration
+        return cost, state
+
+    best_blocks = {}
+    def order_mask_blocks(idx, state):
+        # Best block order for a mask starting from state, and its cost
+        if (idx, state) not in best_blocks:
+            mask_blocks = blocks[idx]
+            if len(mask_blocks) <= max_exact_blocks:
+                block_order = min(itertools.permutations(mask_blocks),
+                                  key=lambda order: blocks_cost(order, state)[0])
+            else:
+                block_order = []
+                remaining = list(mask_blocks)
+                while len(remaining) > 0:
+                    next_block = min(remaining, key=lambda block:
+                                     blocks_cost(block_order+[block], state)[0])
+                    block_order.append(next_block)
+                    remaining.remove(next_block)
+            best_blocks[(idx, state)] = (list(block_order),)\
+                                        + blocks_cost(block_order, state)
+        return best_blocks[(idx, state)]
+
+    def walk(order):
+        cost = 0
+        plan = []
+        previous = 0
+        state = (hatch, obsmode, None)
+        for idx in order:
+            if move_times[previous, idx+1] > 0:
+                cost += move_times[previous, idx+1] + mechanism_times['csu_setup']
+                if state[2] != 'dark':
+                    cost += mechanism_times['go_dark']
+                state = state[:2] + ('dark',)
+            previous = idx+1
+            block_order, duration, state = order_mask_blocks(idx, state)
+            cost += duration
+            plan.extend(block_order)
+        return cost, plan
+
+    def order_cost(order):
+        return walk(order)[0]
+
+    if nmasks <= max_exact:
+        best_order = min(itertools.permutations(range(nmasks)), key=order_cost)
+    else:
+        best_order = []
+        remaining = list(range(nmasks))
+        while len(remaining) > 0:
+            next_idx = min(remaining, key=lambda idx: order_cost(best_order+[idx]))
+            best_order.append(next_idx)
+            remaining.remove(next_idx)
+
+    # Build the explicit plan
+    predicted_time, plan = walk(best_order)
+
+    log.info(f'Calibration plan ({len(plan)} blocks, predicted mechanism '
+             f'time {predicted_time/60:.1f} min):')
+    for i,(mask, filt, caltype) in enumerate(plan):
+        log.info(f'  {i+1:2d}: {mask.name} {filt} {caltype}')
+    return plan, predicted_time
+
+##-------------------------------------------------------------------------
+## Dry Run Time Estimate
+##-------------------------------------------------------------------------
+class DryRunState(InstrumentState):
+    '''An `InstrumentState` which does not touch the hardware.  Commands are
+    tracked as in a real run, so the same commands are skipped, but instead
+    of being issued their approximate duration (see mechanism_times and
+    `predict_move_time`) is added to the elapsed attribute.
+
+    The starting CSU state (current_mask), hatch position, and obsmode may be
+    given, otherwise they are treated as unknown.  As in `block_mechanism_time`,
+    going back to the same obsmode from dark is charged as a go_dark.
+    '''
+    # Function called by InstrumentState: key in mechanism_times
+    mechanisms = {'go_dark': 'go_dark',
+                  'set_obsmode': 'obsmode',
+                  'open_hatch': 'hatch',
+                  'close_hatch': 'hatch',
+                  'Ne_lamp': 'arc_lamp',
+                  'Ar_lamp': 'arc_lamp',
+                  'dome_flat_lamps': 'dome_lamps',
+                  'setup_mask': 'csu_setup',
+                  }
+
+    def __init__(self, current_mask=None, hatch=None, obsmode=None):
+        InstrumentState.__init__(self, track=False)
+        self.track = True
+        if hatch is not None:
+            self.values['hatch'] = hatch
+        if obsmode is not None:
+            self.values['obsmode'] = obsmode
+        self.csu_mask = current_mask
+        self.elapsed = 0
+
+    def _issue(self, function, *args, **kwargs):
+        self.issued += 1
+        if function is execute_mask:
+            if self.csu_mask is None:
+                self.elapsed += estimate_move_time([np.nan])
+            else:
+                self.elapsed += predict_move_time(self.csu_mask, kwargs['mask'])
+            self.csu_mask = kwargs['mask']
+        elif function.__name__ == 'set_obsmode'\
+             and self.values.get('obsmode', '').lower() == args[0].lower():
+            self.elapsed += mechanism_times['go_dark']
+        else:
+            self.elapsed += mechanism_times[self.mechanisms[function.__name__]]
+
+    def _confirm(self, names, holds):
+        # The model is the only state in a dry run: never read the keywords
+        with self.lock:
+            return holds()
+
+    def current_mask(self):
+        return self.csu_mask
+
+
+class StepTimeEstimate(object):
+    '''A stand in for `run_steps` which estimates how long the steps would
+    take instead of running them.  Mechanism steps are called on a
+    `DryRunState`, which only adds up their durations, and exposures are
+    estimated by `estimate_exposure_time`.  If overlap is True, each step
+    starts when the steps it comes after are done (as in `run_steps`),
+    otherwise the steps are run one after the other.
+
+    exposure is a function which returns the section, frame type, and
+    exposure dict (exptime, coadds, and sampmode) of an exposure step, or
+    None for other steps.
+
+    Each call adds rows to the budget Table: one for the mechanism time since
+    the previous call (including CSU moves between blocks) and one for each
+    set of frames.  The mask names are taken from the journal.
+    '''
+    def __init__(self, state, journal, exposure, overlap=False):
+        self.state = state
+        self.journal = journal
+        self.exposure = exposure
+        self.overlap = overlap
+        self.accounted = 0
+        self.budget = Table(names=('mask', 'section', 'item', 'count', 'seconds'),
+                            dtype=('U68', 'U20', 'U60', 'i4', 'f8'))
+
+    def __call__(self, steps):
+        maskname = self.journal.mask
+        # Mechanism time spent between blocks (e.g. CSU moves)
+        between = self.state.elapsed - self.accounted
+        ends = {}
+        frames = {}
+        for this_step in steps:
+            exposure = self.exposure(this_step)
+            if exposure is None:
+                before = self.state.elapsed
+                this_step['function'](*this_step['args'], **this_step['kwargs'])
+                duration = self.state.elapsed - before
+            else:
+                section, frametype, params = exposure
+                duration = estimate_exposure_time(params['exptime'],
+                                                  coadds=params['coadds'],
+                                                  sampmode=params['sampmode'])
+                item = (section, f"{frametype} ({params['exptime']:.0f}s "
+                                 f"x{params['coadds']} {params['sampmode']})")
+                count, seconds = frames.get(item, (0, 0))
+                frames[item] = (count+1, seconds+duration)
+            if self.overlap is True:
+                start = max([ends[name] for name in this_step['after']], default=0)
+            else:
+                start = max(ends.values(), default=0)
+            ends[this_step['name']] = start + duration
+        if len(frames) == 0:
+            return None
+        exposing = np.sum([seconds for count, seconds in frames.values()])
+        block_time = max(ends.values())
+        mechanisms = between + block_time - exposing
+        section = list(frames.keys())[0][0]
+        self.budget.add_row([maskname, section, 'mechanisms', 1, mechanisms])
+        for (section, item), (count, seconds) in frames.items():
+            self.budget.add_row([maskname, section, item, count, seconds])
+        self.accounted = self.state.elapsed
+        return None
+
+    def finish(self):
+        '''Add a row for the mechanism time after the last block.
+        '''
+        if self.state.elapsed > self.accounted:
+            self.budget.add_row(['', '', 'mechanisms', 1,
+                                 self.state.elapsed - self.accounted])
+            self.accounted = self.state.elapsed
+        return self.budget
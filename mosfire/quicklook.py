@@ -0,0 +1,169 @@
+from collections import OrderedDict
+import os
+import re
+import threading
+
+import numpy as np
+from astropy.io import fits
+
+from .core import *
+
+
+##-----------------------------------------------------------------------------
+## Detector Noise
+##-----------------------------------------------------------------------------
+# Read noise (ADU) of a single CDS frame.  The difference of two CDS darks
+# has a standard deviation of about 10.5 ADU (see `checkout`).
+cds_read_noise = 10.5/np.sqrt(2)
+
+
+def read_noise(sampmode):
+    '''Return the expected read noise (ADU) for the sampling mode.  MCDS with
+    N reads averages N reads at each end of the ramp, so the noise is lower
+    than CDS by sqrt(N).
+    '''
+    namematch = re.match('(M?CDS)(\d*)', str(sampmode).strip())
+    if namematch is None:
+        raise FailedCondition(f'Unable to parse "{sampmode}"')
+    if namematch.group(1) == 'CDS':
+        return cds_read_noise
+    return cds_read_noise/np.sqrt(int(namematch.group(2)))
+
+
+def header_sampmode(header):
+    '''Return the sampling mode of a frame (e.g. CDS, MCDS16) from the
+    SAMPMODE and NUMREADS keywords in its header.
+    '''
+    sampmode = header.get('SAMPMODE', None)
+    numreads = header.get('NUMREADS', 1)
+    if str(sampmode).strip() in ['3', 'MCDS']:
+        return f'MCDS{int(numreads)}'
+    elif str(sampmode).strip().startswith('MCDS'):
+        return str(sampmode).strip()
+    return 'CDS'
+
+
+##-----------------------------------------------------------------------------
+## Quick Look Frame
+##-----------------------------------------------------------------------------
+class QuickLookFrame(object):
+    '''A memory mapped view of a detector frame for quick look analysis.
+
+    Pixels are only read from disk when they are used: each method reads the
+    rows (or region) it needs through the HDU section, so checking a few slits
+    costs a few hundred kB of I/O instead of the whole 16 MB frame.  Values
+    are returned as float arrays in ADU.
+    '''
+    def __init__(self, imagefile):
+        self.file = Path(imagefile).expanduser()
+        self.hdul = fits.open(self.file, memmap=True)
+        self.header = self.hdul[0].header
+        self.shape = (int(self.header['NAXIS2']), int(self.header['NAXIS1']))
+        self.coadds = int(self.header.get('COADDS', 1))
+        self.sampmode = self._sampmode()
+
+    def _sampmode(self):
+        return header_sampmode(self.header)
+
+    def close(self):
+        '''Close the file and its memory map.
+        '''
+        # The memory map stays open while an HDU holds its data array
+        for hdu in self.hdul:
+            if 'data' in vars(hdu):
+                del hdu.data
+        self.hdul.close()
+
+    def region(self, y1, y2, x1=None, x2=None, step=1):
+        '''Read the region [y1:y2:step, x1:x2].
+        '''
+        return np.asarray(self.hdul[0].section[y1:y2:step, x1:x2], dtype=float)
+
+    def rows(self, y1, y2, step=1):
+        '''Read the full width of the rows y1 to y2.
+        '''
+        return self.region(y1, y2, step=step)
+
+    def collapse(self, y1, y2, x1=None, x2=None, axis=0):
+        '''Median collapse a region along the given axis (0 collapses rows to
+        a profile along X, 1 collapses columns to a profile along Y).
+        '''
+        return np.median(self.region(y1, y2, x1, x2), axis=axis)
+
+    def region_median(self, regions):
+        '''Median of all the pixels in a list of (y1, y2, x1, x2) regions.
+        '''
+        if len(regions) == 0:
+            return np.nan
+        return float(np.median(np.concatenate(
+                     [self.region(y1, y2, x1, x2).ravel()
+                      for y1, y2, x1, x2 in regions])))
+
+    def saturated_fraction(self, saturation, step=8):
+        '''Estimate the fraction of pixels at or above the saturation level
+        (per coadd) from every step'th row.
+        '''
+        data = self.rows(0, self.shape[0], step=step)
+        return float(np.mean(data >= saturation*self.coadds))
+
+    def stats(self, region=None, step=1):
+        '''Return robust statistics for a (y1, y2, x1, x2) region (the
+        central quarter of the array if None): mean, median, std (from the
+        median absolute deviation), min, max, the median per coadd, and the
+        ratio of the std to the read noise expected for the sampling mode.
+        '''
+        if region is None:
+            ny, nx = self.shape
+            region = (int(ny/4), int(3*ny/4), int(nx/4), int(3*nx/4))
+        y1, y2, x1, x2 = region
+        data = self.region(y1, y2, x1, x2, step=step)
+        median = float(np.median(data))
+        std = float(1.4826*np.median(np.abs(data - median)))
+        return {'mean': float(np.mean(data)),
+                'median': median,
+                'std': std,
+                'min': float(np.min(data)),
+                'max': float(np.max(data)),
+                'median_per_coadd': median/self.coadds,
+                'noise_ratio': float(std/(read_noise(self.sampmode)*np.sqrt(self.coadds))),
+                }
+
+
+##-----------------------------------------------------------------------------
+## Frame Cache
+##-----------------------------------------------------------------------------
+# Open frames keyed by file, values are ((mtime, size), QuickLookFrame), in
+# order of use.  A file which changes on disk is opened again.
+_frame_cache = OrderedDict()
+_frame_cache_lock = threading.Lock()
+frame_cache_size = 8
+
+
+def quicklook_frame(imagefile):
+    '''Return a `QuickLookFrame` for the file, reusing a cached one if the
+    file has not changed.  At most frame_cache_size frames are kept open.
+    '''
+    imagefile = Path(imagefile).expanduser().absolute()
+    stat = os.stat(imagefile)
+    signature = (stat.st_mtime, stat.st_size)
+    key = str(imagefile)
+    with _frame_cache_lock:
+        cached = _frame_cache.pop(key, None)
+        if cached is not None and cached[0] == signature:
+            _frame_cache[key] = cached
+            return cached[1]
+        if cached is not None:
+            cached[1].close()
+        frame = QuickLookFrame(imagefile)
+        _frame_cache[key] = (signature, frame)
+        while len(_frame_cache) > frame_cache_size:
+            oldkey, (oldsignature, oldframe) = _frame_cache.popitem(last=False)
+            oldframe.close()
+    return frame
+
+
+def clear_quicklook_cache():
+    with _frame_cache_lock:
+        while len(_frame_cache) > 0:
+            key, (signature, frame) = _frame_cache.popitem()
+            frame.close()
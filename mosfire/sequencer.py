@@ -0,0 +1,101 @@
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from astropy.table import Table
+
+from .core import *
+
+
+##-----------------------------------------------------------------------------
+## Define Steps
+##-----------------------------------------------------------------------------
+def step(name, function, *args, after=None, **kwargs):
+    '''Describe a single step (a mechanism action or an exposure) for
+    `run_steps`.  The step calls function(*args, **kwargs) once all of the
+    steps named in the after list have completed.
+
+    Example:
+    steps = [step('go_dark', go_dark),
+             step('open_hatch', open_hatch, after=['go_dark']),
+             step('lamps_on', dome_flat_lamps, 9),
+             step('obsmode', set_obsmode, 'J-spectroscopy', after=['open_hatch'])]
+    '''
+    return {'name': name,
+            'function': function,
+            'args': args,
+            'kwargs': kwargs,
+            'after': list(after) if after is not None else []}
+
+
+##-----------------------------------------------------------------------------
+## Run Steps
+##-----------------------------------------------------------------------------
+def _run_step(this_step):
+    start = datetime.utcnow()
+    log.debug(f"Starting step: {this_step['name']}")
+    this_step['function'](*this_step['args'], **this_step['kwargs'])
+    end = datetime.utcnow()
+    log.debug(f"Finished step: {this_step['name']}")
+    return this_step['name'], start, end
+
+
+def run_steps(steps, nthreads=4):
+    '''Run a set of steps (see `step`) as a dependency graph.  Each step
+    starts as soon as all of the steps it must come after have completed, so
+    independent steps (e.g. a lamp warming up while a mechanism moves) run at
+    the same time.
+
+    If a step fails, no new steps are started, the steps which are already
+    running are allowed to finish, and the exception is raised.
+
+    Returns a timeline Table with the start time, end time, and duration of
+    each step in the order in which they finished.
+    '''
+    names = [this_step['name'] for this_step in steps]
+    if len(set(names)) != len(names):
+        raise FailedCondition('Step names are not unique')
+    for this_step in steps:
+        for name in this_step['after']:
+            if name not in names:
+                raise FailedCondition(f"Step {this_step['name']} depends on "
+                                      f"unknown step {name}")
+
+    pending = list(steps)
+    running = {}
+    done = set()
+    timeline = []
+    error = None
+    t0 = datetime.utcnow()
+    with ThreadPoolExecutor(max_workers=nthreads) as executor:
+        while True:
+            if error is None:
+                ready = [s for s in pending if set(s['after']).issubset(done)]
+                for this_step in ready:
+                    pending.remove(this_step)
+                    running[executor.submit(_run_step, this_step)] = this_step['name']
+            if len(running) == 0:
+                break
+            finished, not_finished = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                name = running.pop(future)
+                try:
+                    timeline.append(future.result())
+                    done.add(name)
+                except Exception as e:
+                    log.error(f'Step {name} failed: {e}')
+                    if error is None:
+                        error = e
+    if error is not None:
+        raise error
+    if len(pending) > 0:
+        raise FailedCondition(f'Unable to run steps with circular dependencies: '
+                              f'{[s["name"] for s in pending]}')
+
+    timeline = Table(rows=[(name, start.isoformat(), end.isoformat(),
+                            (end-start).total_seconds())
+                           for name, start, end in timeline],
+                     names=('step', 'start', 'end', 'duration'),
+                     dtype=('U40', 'U26', 'U26', 'f8'))
+    elapsed = (datetime.utcnow() - t0).total_seconds()
+    serial = np.sum(timeline['duration'])
+    log.info(f'Ran {len(timeline)} steps in {elapsed:.1f} s '
+             f'(serial time {serial:.1f} s, saved {serial-elapsed:.1f} s)')
+    return timeline
@@ -0,0 +1,263 @@
+import threading
+
+from .core import *
+from .filter import go_dark
+from .obsmode import set_obsmode
+from .hatch import open_hatch, close_hatch
+from .domelamps import dome_flat_lamps
+from .power import Ne_lamp, Ar_lamp
+from .csu import setup_mask, execute_mask, read_csu_bar_state, masks_match
+
+
+##-----------------------------------------------------------------------------
+## Instrument State Model
+##-----------------------------------------------------------------------------
+class InstrumentState(object):
+    '''A local model of the state of the mechanisms used by the calibration
+    scripts.  The model is fed by monitored keywords, so finding that a
+    mechanism has to move does not require a round trip.
+
+    Commands are issued through the methods of this object, which have the
+    same names as the module level functions they call.  A command whose
+    target state already holds is skipped at once.  If a keyword it depends
+    on is not monitored (monitor is False, or no broadcast has arrived yet),
+    it is read once first so that the skip is not based on a stale value.
+    A go_dark which is requested with defer=True is held until the next
+    command which needs it:
+    if the next command is a set_obsmode the dark is dropped (the filter wheels
+    would be moved again immediately), otherwise it is issued first.
+
+    If track is False, the model is not used and every command is issued.
+    This lets the calibration code use a single code path.
+    '''
+    keywords = {'filter': ('mosfire', 'FILTER'),
+                'obsmode': ('mosfire', 'OBSMODE'),
+                'hatch': ('mmdcs', 'POSNAME'),
+                'Ne': ('mp1s', 'PWSTAT7'),
+                'Ar': ('mp1s', 'PWSTAT8'),
+                'flamp1': ('dcs', 'FLAMP1'),
+                'flamp2': ('dcs', 'FLAMP2'),
+                'fpower': ('dcs', 'FPOWER'),
+                }
+
+    def __init__(self, track=True, monitor=True):
+        self.track = track
+        self.values = dict()
+        # Names of the values which have been updated by a monitor callback
+        self.monitored = set()
+        self.pending_dark = False
+        self.issued = 0
+        self.skipped = 0
+        self.merged = 0
+        # Commands may be issued from the threads of `run_steps` and values
+        # are updated by keyword callbacks, so the model is only read and
+        # changed with the lock held.  The lock is not held while a command
+        # runs, so that independent mechanisms can move at the same time.
+        self.lock = threading.RLock()
+        if self.track is True:
+            for name, (service, keyword) in self.keywords.items():
+                kw = ktl.cache(service=service, keyword=keyword)
+                self.values[name] = str(kw.read())
+                if monitor is True:
+                    kw.callback(self._make_callback(name))
+                    kw.monitor()
+
+    def _make_callback(self, name):
+        def callback(keyword):
+            with self.lock:
+                self.values[name] = str(keyword['ascii'])
+                self.monitored.add(name)
+        return callback
+
+    def _issue(self, function, *args, **kwargs):
+        with self.lock:
+            self.issued += 1
+        return function(*args, **kwargs)
+
+    def _skip(self, description):
+        with self.lock:
+            self.skipped += 1
+        log.debug(f'Skipping {description}: already in target state')
+        return None
+
+    def _set(self, **values):
+        with self.lock:
+            self.values.update(values)
+
+    def _confirm(self, names, holds):
+        '''Before a command is skipped, read the keywords behind the named
+        values which are not kept current by a monitor, so that the decision
+        is not made on a stale value.  Monitored values are used as they are.
+        Returns holds() evaluated on the current values.
+        '''
+        with self.lock:
+            unmonitored = [name for name in names
+                           if name not in self.monitored]
+        fresh = {name: str(ktl.cache(service=self.keywords[name][0],
+                                     keyword=self.keywords[name][1]).read())
+                 for name in unmonitored}
+        with self.lock:
+            self.values.update(fresh)
+            return holds()
+
+    ##-------------------------------------------------------------------------
+    ## State Queries
+    def is_dark(self):
+        return self.values.get('filter', '') in ['Dark', 'NB1061']
+
+    def lamp_is_on(self, lamp):
+        return self.values.get(lamp, '').lower() in ['1', 'on']
+
+    def dome_lamps_are_on(self):
+        return self.values.get('flamp1', '') != 'off'\
+               and self.values.get('flamp2', '') != 'off'
+
+    def dome_lamps_are_off(self):
+        return self.values.get('flamp1', '') == 'off'\
+               and self.values.get('flamp2', '') == 'off'
+
+    ##-------------------------------------------------------------------------
+    ## Commands
+    def flush(self):
+        '''Issue a deferred go_dark if there is one.
+        '''
+        with self.lock:
+            pending = self.pending_dark
+            self.pending_dark = False
+        if pending is True:
+            self.go_dark()
+
+    def go_dark(self, defer=False):
+        if self.track is False:
+            return self._issue(go_dark)
+        with self.lock:
+            if defer is True:
+                self.pending_dark = True
+                return None
+            self.pending_dark = False
+            skip = self.is_dark()
+        if skip and self._confirm(['filter'], self.is_dark):
+            return self._skip('go_dark')
+        self._issue(go_dark)
+        self._set(filter='Dark')
+
+    def set_obsmode(self, destination):
+        if self.track is False:
+            return self._issue(set_obsmode, destination)
+        def in_mode():
+            obsmode = self.values.get('obsmode', '')
+            return obsmode.lower() == destination.lower()\
+                   and not self.is_dark()
+        with self.lock:
+            if self.pending_dark is True:
+                # The dark would be undone by this obsmode change
+                self.pending_dark = False
+                self.merged += 1
+                log.debug(f'Merged go_dark into set_obsmode {destination}')
+            skip = in_mode()
+        if skip and self._confirm(['obsmode', 'filter'], in_mode):
+            return self._skip(f'set_obsmode {destination}')
+        self._issue(set_obsmode, destination)
+        self._set(obsmode=destination, filter=destination.split('-')[0])
+
+    def _set_hatch(self, function, destination):
+        if self.track is False:
+            return self._issue(function)
+        def in_place():
+            return self.values.get('hatch', '') == destination
+        if in_place() and self._confirm(['hatch'], in_place):
+            return self._skip(f'hatch {destination}')
+        # Never move the hatch with a dark still pending
+        self.flush()
+        self._issue(function)
+        self._set(hatch=destination)
+
+    def open_hatch(self):
+        return self._set_hatch(open_hatch, 'Open')
+
+    def close_hatch(self):
+        return self._set_hatch(close_hatch, 'Closed')
+
+    def _arc_lamp(self, lamp, function, onoff):
+        if self.track is False:
+            return self._issue(function, onoff)
+        def in_state():
+            return self.lamp_is_on(lamp) == (onoff == 'on')
+        if in_state() and self._confirm([lamp], in_state):
+            return self._skip(f'{lamp} lamp {onoff}')
+        if onoff == 'on':
+            self.flush()
+        self._issue(function, onoff)
+        self._set(**{lamp: {'on': '1', 'off': '0'}[onoff]})
+
+    def Ne_lamp(self, onoff):
+        return self._arc_lamp('Ne', Ne_lamp, onoff)
+
+    def Ar_lamp(self, onoff):
+        return self._arc_lamp('Ar', Ar_lamp, onoff)
+
+    def dome_flat_lamps(self, power):
+        if self.track is False:
+            return self._issue(dome_flat_lamps, power)
+        if power in [None, 'off']:
+            if self.dome_lamps_are_off() and\
+               self._confirm(['flamp1', 'flamp2'], self.dome_lamps_are_off):
+                return self._skip('dome lamps off')
+            self._issue(dome_flat_lamps, power)
+            self._set(flamp1='off', flamp2='off')
+        else:
+            def lamps_on():
+                try:
+                    fpower = float(self.values.get('fpower'))
+                    same_power = abs(fpower - float(power)) <= 0.2
+                except (TypeError, ValueError):
+                    same_power = False
+                return self.dome_lamps_are_on() and same_power
+            with self.lock:
+                skip = lamps_on()
+            if skip and self._confirm(['flamp1', 'flamp2', 'fpower'],
+                                      lamps_on):
+                return self._skip(f'dome lamps on at {power}')
+            self.flush()
+            self._issue(dome_flat_lamps, power)
+            self._set(flamp1='on', flamp2='on', fpower=str(power))
+
+    ##-------------------------------------------------------------------------
+    ## CSU
+    def current_mask(self):
+        '''Return the mask in the CSU from `read_csu_bar_state`, or None if it
+        can not be read.
+        '''
+        try:
+            return read_csu_bar_state()
+        except Exception as e:
+            log.debug(f'Unable to read csu_bar_state: {e}')
+            return None
+
+    def configure_csu(self, mask):
+        '''Go dark and configure the CSU for mask.  If the current CSU state
+        is known (see `current_mask`), nothing is done if the mask is already
+        in place and otherwise only the bars which need to move are given new
+        targets (see `setup_mask`).
+        '''
+        current_mask = self.current_mask()
+        if current_mask is not None and masks_match(current_mask, mask):
+            log.info(f'CSU is already configured for {mask.name}')
+            return self._skip(f'CSU setup for {mask.name}')
+        log.info(f'Configuring CSU for {mask.name}')
+        self.go_dark()
+        self._issue(setup_mask, mask, minimal=current_mask is not None,
+                    current_mask=current_mask)
+        self._issue(execute_mask, mask=mask)
+
+    ##-------------------------------------------------------------------------
+    ## Summary
+    def report(self):
+        '''Log and return the number of mechanism commands issued, skipped, and
+        merged.
+        '''
+        if self.track is True:
+            log.info(f'Issued {self.issued} mechanism commands, skipped '
+                     f'{self.skipped} already in their target state, merged '
+                     f'{self.merged} redundant go_dark commands')
+        return self.issued, self.skipped, self.merged
@@ -1,6 +1,14 @@
+import atexit
+import os
+import queue
+import threading
+
 from .core import *
 dcs = ktl.cache(service='dcs')
 
+# slit angle with respect to detector y pixels [rad]
+slit_angle = -3.74 * np.pi/180
+
 ##-----------------------------------------------------------------------------
 ## pre- and post- conditions
 ##-----------------------------------------------------------------------------
@@ -18,6 +26,93 @@ def are_we_guiding():
     return dcs['AUTACTIV'].read() == 'yes'
 
 
+##-----------------------------------------------------------------------------
+## Offset Journal
+##-----------------------------------------------------------------------------
+class OffsetJournal(object):
+    '''Append records of telescope offsets to the nightly instrumentOffsets
+    file from a background thread, so the offset itself does not wait on the
+    file system or on a subprocess.
+
+    Records are queued by `log` and written in batches in the order they were
+    made.  With method='direct' (the default) the records are appended to the
+    file directly with one write and fsync per batch; with method='script'
+    each record is passed to mosfireScriptMsg (as was done in line by mxy).
+    Queued records are written before the program exits, but a killed
+    program loses them, so callers should `flush` before they return.
+    '''
+    def __init__(self, method='direct'):
+        self.method = method
+        self.queue = queue.Queue()
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def _start(self):
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run,
+                                               name='OffsetJournal',
+                                               daemon=True)
+                self.thread.start()
+                atexit.register(self.close)
+
+    def log(self, logfile, message):
+        '''Queue a message to be appended to logfile.
+        '''
+        self._start()
+        self.queue.put((str(logfile), message))
+
+    def _run(self):
+        while True:
+            records = [self.queue.get()]
+            while True:
+                try:
+                    records.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = None in records
+            try:
+                self._write([record for record in records if record is not None])
+            except Exception as e:
+                log.warning(f'Failed to write offset journal: {e}')
+            for record in records:
+                self.queue.task_done()
+            if stop is True:
+                return
+
+    def _write(self, records):
+        if self.method == 'direct':
+            logfiles = {}
+            for logfile, message in records:
+                logfiles.setdefault(logfile, []).append(message)
+            for logfile, messages in logfiles.items():
+                with open(logfile, 'a') as FO:
+                    FO.write('\n'.join(messages) + '\n')
+                    FO.flush()
+                    os.fsync(FO.fileno())
+        else:
+            for logfile, message in records:
+                subprocess.call(['mosfireScriptMsg', '-f', logfile, '-m', message])
+
+    def flush(self):
+        '''Block until all queued records have been written.
+        '''
+        if self.thread is not None:
+            self.queue.join()
+
+    def close(self):
+        '''Write all queued records and stop the background thread.
+        '''
+        with self.lock:
+            if self.thread is not None:
+                self.queue.put(None)
+                self.thread.join()
+                self.thread = None
+
+
+offset_journal = OffsetJournal()
+
+
 ##-----------------------------------------------------------------------------
 ## Get MAGIQ Exposure Parameters
 ##-----------------------------------------------------------------------------
@@ -41,7 +136,7 @@ def get_camparms(skipprecond=False, skippostcond=False):
     CAMPARMSkw = ktl.cache(service='magiq', keyword='CAMPARMS')
     camname, starx, stary, boxx, boxy, exptime, aa, bb, count = CAMPARMSkw.read().split(',')
     CAMPARMS = {'camname': camname,
-                'stary': float(stary),
+                'starx': float(starx),
                 'stary': float(stary),
                 'boxx': int(boxx),
                 'boxy': int(boxy),
@@ -61,11 +156,76 @@ def get_camparms(skipprecond=False, skippostcond=False):
     return CAMPARMS
 
 
+##-----------------------------------------------------------------------------
+## Guide Cycle Counter
+##-----------------------------------------------------------------------------
+# Keyword which is broadcast when the guider measures a new centroid.  This
+# can be pointed at a stand in keyword when running in simulation.
+#
+# AUTXCENT is only broadcast when its value changes, so a guide frame with
+# the same centroid as the previous one is not counted.  Each broadcast is a
+# new guide frame, but on a steady guider the count can stall, so the count
+# is only used to end the wait in wait_for_guider early and the time based
+# wait is always the limit.
+guide_cycle_keyword = ('dcs', 'AUTXCENT')
+
+
+class GuideCycleCounter(object):
+    '''Count guide cycles by monitoring a keyword which is broadcast when a
+    guide frame is measured (see guide_cycle_keyword).  Frames which do not
+    change the keyword value are not counted, so the count is a lower limit.
+    '''
+    def __init__(self, service, keyword):
+        self.count = 0
+        self.condition = threading.Condition()
+        kw = ktl.cache(service=service, keyword=keyword)
+        kw.callback(self._callback)
+        kw.monitor()
+
+    def _callback(self, keyword):
+        with self.condition:
+            self.count += 1
+            self.condition.notify_all()
+
+    def wait(self, ncycles, since, timeout):
+        '''Block until ncycles broadcasts have been counted since the count
+        was since.  Returns False if the timeout (s) expired first.
+        '''
+        with self.condition:
+            return self.condition.wait_for(lambda: self.count - since >= ncycles,
+                                           timeout=timeout)
+
+
+_guide_counter = None
+
+
+def get_guide_counter():
+    '''Return the GuideCycleCounter, starting it on first use.  Returns None
+    if the keyword can not be monitored.
+    '''
+    global _guide_counter
+    if _guide_counter is None:
+        try:
+            _guide_counter = GuideCycleCounter(*guide_cycle_keyword)
+        except Exception as e:
+            log.warning(f'Unable to monitor {guide_cycle_keyword}: {e}')
+            return None
+    return _guide_counter
+
+
 ##-----------------------------------------------------------------------------
 ## wait_for_guider
 ##-----------------------------------------------------------------------------
 def wait_for_guider(ncycles=2, timeout=20, skipprecond=False, skippostcond=False):
     '''Wait for guider to complete ncycles
+
+    This waits at most ncycles guider exposure times after AUTGO.  Guide
+    cycles are counted from the guide_cycle_keyword broadcasts after the
+    guider resumes (including cycles which complete while waiting for AUTGO)
+    and the wait ends early once ncycles have been counted.  The keyword is
+    only broadcast when the centroid changes, so on a steady guider the count
+    may not reach ncycles and the full time is waited, as it is if the
+    keyword can not be monitored.
     '''
     this_function_name = inspect.currentframe().f_code.co_name
     log.debug(f"Executing: {this_function_name}")
@@ -83,6 +243,7 @@ def wait_for_guider(ncycles=2, timeout=20, skipprecond=False, skippostcond=False
     log.debug('Checking for guiding')
     if are_we_guiding() is False:
         return None
+    counter = get_guide_counter()
 
     # waitfor -s dcs axestat=tracking
     log.debug('Wait for tracking')
@@ -92,6 +253,8 @@ def wait_for_guider(ncycles=2, timeout=20, skipprecond=False, skippostcond=False
     # wait until AURESUM increments (j) (timeout=20s)
     log.debug(f'Wait for AUTRESUM to increment (timeout={timeout})')
     ktl.waitfor(f'$dcs.AUTRESUM != {autresum0}', timeout=timeout)
+    resumed = datetime.utcnow()
+    since = counter.count if counter is not None else None
     # wait until AUTGO is RESUMEACK or GUIDE (timeout=20s)
     log.debug('Wait for AUTGO to be guide or resumeAck')
     if dcs['AUTGO'].read() not in ['guide', 'resumeAck']:
@@ -99,8 +262,25 @@ def wait_for_guider(ncycles=2, timeout=20, skipprecond=False, skippostcond=False
 
     camparms = get_camparms()
     waittime = ncycles*camparms['exptime']
-    log.debug(f'Waiting {ncycles} guide cycles ({waittime:.1f} s)')
-    sleep(waittime)
+    if counter is None:
+        log.debug(f'Waiting {ncycles} guide cycles ({waittime:.1f} s)')
+        sleep(waittime)
+    else:
+        log.debug(f'Waiting for {ncycles} guide cycles')
+        start = datetime.utcnow()
+        counted = counter.wait(ncycles, since, timeout=waittime)
+        end = datetime.utcnow()
+        if counted is False:
+            log.debug(f'Counted {counter.count-since} of {ncycles} '
+                      f'{guide_cycle_keyword[1]} broadcasts, waited {waittime:.1f} s')
+        else:
+            waited = (end - start).total_seconds()
+            since_resume = (end - resumed).total_seconds()
+            # The broadcasts are a lower limit on the guide cycles, so the
+            # guider may have needed more time than was waited
+            log.debug(f'Counted {ncycles} {guide_cycle_keyword[1]} broadcasts '
+                      f'{since_resume:.1f} s after resume, saved at most '
+                      f'{waittime-waited:.1f} s of sleep')
 
     ##-------------------------------------------------------------------------
     ## Post-Condition Checks
@@ -148,15 +328,12 @@ def mxy(dx, dy, guidecycles=2, skipprecond=False, skippostcond=False):
     dcs['instyoff'].write(v)
     dcs['rel2curr'].write(True)
 
-    # log the move. This should be temporary because it adds 0.05 sec to
-    # the execution of the mxy command.
+    # log the move in the background (see OffsetJournal)
     nightpath = f'/s/nightly1/{now.year:4d}/{now.month:02d}/{now.day:02d}/'
 #     offset_str = f'modify -s dcs instxoff={u:.3f} instyoff={v:.3f} rel2base=t'
     offset_str = f"dcs['instxoff'].write({u}) dcs['instyoff'].write({v}) dcs['rel2curr'].write(True)"
-    mosfireScriptMsg = ['mosfireScriptMsg',
-                        '-f', f'{nightpath}instrumentOffsets',
-                        '-m', '{exec_date}        {offset_str}']
-    subprocess.call(mosfireScriptMsg)
+    offset_journal.log(f'{nightpath}instrumentOffsets',
+                       f'{exec_date}        {offset_str}')
 
 #     tick = datetime.utcnow()
 #     subprocess.call(['wftel', autresum])
@@ -165,6 +342,8 @@ def mxy(dx, dy, guidecycles=2, skipprecond=False, skippostcond=False):
 #     log.debug(f'mxy wftel completed in {duration:.2f} sec')
 
     wait_for_guider(ncycles=guidecycles)
+    # make sure the offset record is on disk before returning
+    offset_journal.flush()
 
     ##-------------------------------------------------------------------------
     ## Post-Condition Checks
@@ -206,9 +385,8 @@ def sltmov(distance, guidecycles=2, skipprecond=False, skippostcond=False):
     ##-------------------------------------------------------------------------
     ## Script Contents
 
-    angle = -3.74 * np.pi/180 # slit angle with respect to detector y pixels
-    dx = distance * np.sin(angle)
-    dy = distance * np.cos(angle)
+    dx = distance * np.sin(slit_angle)
+    dy = distance * np.cos(slit_angle)
     log.info(f'Making sltmov {distance}')
     mxy(dx, dy, guidecycles=guidecycles)
     
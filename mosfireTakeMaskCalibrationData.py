@@ -4,7 +4,8 @@
 import argparse
 
 from mosfire.core import log
-from mosfire.calibration import take_calibrations
+from mosfire.calibration import take_calibrations, read_calibration_config
+from mosfire.detector import start_exposure_profiling
 
 
 description = '''
@@ -67,50 +68,38 @@ p.add_argument('Shutdown', type=int, help='flag whether to shut down MOSFIRE aft
 # p.add_argument('KstatusN ', type=bool, help='calibrate mask N in K band?')
 p.add_argument('masks', nargs='+',
                help='Mask path and whether to take Y, J, H, K calibrations')
+p.add_argument('--skip-existing', dest='skip_existing', action='store_true',
+               default=False,
+               help='skip frames which already exist in the output directory')
+p.add_argument('--adaptive-flats', dest='adaptive_flats', action='store_true',
+               default=False,
+               help='tune the flat exposure time with a short probe exposure')
+p.add_argument('--retake-failed', dest='retake_failed', action='store_true',
+               default=False,
+               help='retake frames which fail the quality checks')
+p.add_argument('--profile', dest='profile', action='store_true',
+               default=False,
+               help='record the timing of each exposure to the nightly '
+                    'exposure profile log')
 
 args = p.parse_args()
 
-cfg = {'Y':
-        {'flat_count': args.YFlatCount,
-         'flat_exptime': args.YFlatTime,
-         'flatoff_count': args.YFlatCount if args.YLampsOff == 1 else 0,
-         'flat_power': 4,
-         'ne_arc_exptime': args.YNeonTime,
-         'ne_arc_count': args.YNeonCount,
-         'ar_arc_exptime': args.YArgonTime,
-         'ar_arc_count': args.YArgonCount,
-        },
-       'J':
-        {'flat_count': args.JFlatCount,
-         'flat_exptime': args.JFlatTime,
-         'flatoff_count': args.JFlatCount if args.JLampsOff == 1 else 0,
-         'flat_power': 9,
-         'ne_arc_exptime': args.JNeonTime,
-         'ne_arc_count': args.JNeonCount,
-         'ar_arc_exptime': args.JArgonTime,
-         'ar_arc_count': args.JArgonCount,
-        },
-       'H':
-        {'flat_count': args.HFlatCount,
-         'flat_exptime': args.HFlatTime,
-         'flatoff_count': args.HFlatCount if args.HLampsOff == 1 else 0,
-         'flat_power': 13.5,
-         'ne_arc_exptime': args.HNeonTime,
-         'ne_arc_count': args.HNeonCount,
-         'ar_arc_exptime': args.HArgonTime,
-         'ar_arc_count': args.HArgonCount,
-        },
-       'K':
-        {'flat_count': args.KFlatCount,
-         'flat_exptime': args.KFlatTime,
-         'flatoff_count': args.KFlatCount if args.KLampsOff == 1 else 0,
-         'flat_power': 14,
-         'ne_arc_exptime': args.KNeonTime,
-         'ne_arc_count': args.KNeonCount,
-         'ar_arc_exptime': args.KArgonTime,
-         'ar_arc_count': args.KArgonCount,
-        },
-      }
+# Build the configuration for each band from the arguments and validate it
+# before anything moves
+flat_power = {'Y': 4, 'J': 9, 'H': 13.5, 'K': 14}
+cfg = dict()
+for band in ['Y', 'J', 'H', 'K']:
+    nflats = getattr(args, f'{band}FlatCount')
+    cfg[band] = {'flat_count': nflats,
+                 'flat_exptime': getattr(args, f'{band}FlatTime'),
+                 'flatoff_count': nflats if getattr(args, f'{band}LampsOff') == 1 else 0,
+                 'flat_power': flat_power[band],
+                 'ne_arc_exptime': getattr(args, f'{band}NeonTime'),
+                 'ne_arc_count': getattr(args, f'{band}NeonCount'),
+                 'ar_arc_exptime': getattr(args, f'{band}ArgonTime'),
+                 'ar_arc_count': getattr(args, f'{band}ArgonCount'),
+                }
+cfg = read_calibration_config(cfg)
 
 assert len(args.masks) % 5 == 0
 
@@ -126,7 +115,7 @@ for masknumber in range(int(len(args.masks) / 5)):
 log.info(f'mosfireTakeMaskCalibrationData started')
 log.info('Configuration:')
 for filt in cfg.keys():
-    log.info(f"{filt}: {cfg[filt]}")
+    log.info(f"{filt}: {cfg[filt].to_dict()}")
 log.info('Masks:')
 for maskname in filters.keys():
     log.info(f"{maskname}: {filters[maskname]}")
@@ -134,8 +123,13 @@ for maskname in filters.keys():
 if args.Shutdown == 1:
     log.info(f"Shutdown when done requested")
 
+if args.profile is True:
+    start_exposure_profiling()
+
 log.info('Taking calibrations')
-take_calibrations(filters, config=cfg)
+take_calibrations(filters, config=cfg, skip_existing=args.skip_existing,
+                  adaptive_flats=args.adaptive_flats,
+                  retake_failed=args.retake_failed)
 
 if args.Shutdown == 1:
     from mosfire.shutdown import end_of_night_shutdown
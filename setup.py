@@ -8,6 +8,7 @@ cl_scripts = [# detector
               'exptime=mosfire.detector:exptime_with_args',
               'coadds=mosfire.detector:coadds_with_args',
               'sampmode=mosfire.detector:sampmode_with_args',
+              'exposure_profile=mosfire.detector:summarize_exposure_profile_with_args',
               # dcs
               'markbase=mosfire.dcs:markbase',
               'gotobase=mosfire.dcs:gotobase',
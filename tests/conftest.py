@@ -0,0 +1,79 @@
+import sys
+import types
+
+import numpy as np
+from astropy.io import fits
+
+
+##-----------------------------------------------------------------------------
+## ktl
+##-----------------------------------------------------------------------------
+# The tests replace ktl.cache with a stub server (see Keyword), so a minimal
+# ktl module is enough for the suite to run where ktl is not installed.
+try:
+    import ktl
+except ImportError:
+    class _NoServer(object):
+        '''A service or keyword which can be cached but not read or written
+        unless the test replaces ktl.cache.
+        '''
+        def __init__(self, *args, **kwargs):
+            pass
+
+        def __getitem__(self, keyword):
+            return self
+
+        def _unavailable(self, *args, **kwargs):
+            raise RuntimeError('ktl is not available in the tests')
+
+        read = write = callback = monitor = _unavailable
+
+    ktl = types.ModuleType('ktl')
+    ktl.cache = _NoServer
+    ktl.waitfor = _NoServer()._unavailable
+    ktl.Exceptions = types.ModuleType('ktl.Exceptions')
+    ktl.Exceptions.ktlError = type('ktlError', (Exception,), {})
+    sys.modules['ktl'] = ktl
+    sys.modules['ktl.Exceptions'] = ktl.Exceptions
+
+
+class Keyword(object):
+    '''A keyword on a stub server which records its reads and writes.
+    '''
+    def __init__(self, value):
+        self.value = value
+        self.reads = 0
+        self.writes = []
+        self.callbacks = []
+
+    def read(self, **kwargs):
+        self.reads += 1
+        return self.value
+
+    def write(self, value, **kwargs):
+        self.writes.append(value)
+        self.value = str(value)
+
+    def __getitem__(self, item):
+        return {'ascii': str(self.value)}[item]
+
+    def callback(self, function):
+        self.callbacks.append(function)
+
+    def monitor(self):
+        # Broadcast the current value, as ktl does when a monitor starts
+        for function in self.callbacks:
+            function(self)
+
+
+##-----------------------------------------------------------------------------
+## FITS
+##-----------------------------------------------------------------------------
+def write_frame(fitsfile, data=None, **keywords):
+    '''Write a frame with the given data (a small blank image if None) and
+    header keywords.
+    '''
+    if data is None:
+        data = np.zeros((4, 4))
+    fits.PrimaryHDU(data=data, header=fits.Header(keywords)).writeto(fitsfile)
+    return fitsfile
@@ -0,0 +1,55 @@
+import pytest
+
+import numpy as np
+
+from conftest import write_frame
+import mosfire
+from mosfire.analysis import slit_regions, calibration_frame_metrics
+
+
+@pytest.mark.parametrize('maskname, nslits', [('LONGSLIT-46x0.7', 46),
+                                              ('LONGSLIT-3x0.7', 3)])
+def test_slit_regions_imaging_narrow_slit(maskname, nslits):
+    mask = mosfire.Mask(maskname)
+    regions = slit_regions(mask, imaging=True)
+    assert len(regions) == nslits
+    for y1, y2, x1, x2 in regions:
+        assert y2 > y1
+        # A 0.7 arcsec slit is about 4 pixels wide
+        assert 1 <= x2 - x1 <= 6
+
+
+def test_slit_regions_imaging_closed_slit():
+    mask = mosfire.Mask('LONGSLIT-3x0.7')
+    mask.slitpos['leftBarPositionMM'] = mask.slitpos['rightBarPositionMM']
+    assert slit_regions(mask, imaging=True) == []
+
+
+def flat_frame(fitsfile, value, coadds=1):
+    return write_frame(fitsfile, data=np.full((64, 64), value, dtype=np.float32),
+                       COADDS=coadds)
+
+
+def test_calibration_frame_metrics_saturated_frame(tmp_path):
+    imagefile = flat_frame(tmp_path / 'saturated.fits', 40000)
+    metrics = calibration_frame_metrics(imagefile, saturation=30000)
+    assert metrics['saturated_fraction'] == 1.0
+    assert metrics['slit_median'] == 40000
+    # A flat collapse has no scatter to measure lines against
+    assert np.isnan(metrics['line_snr'])
+    # Saturation is per coadd
+    imagefile = flat_frame(tmp_path / 'coadded.fits', 40000, coadds=2)
+    assert calibration_frame_metrics(imagefile, saturation=30000)['saturated_fraction'] == 0
+
+
+def test_calibration_frame_metrics_empty_frame(tmp_path):
+    imagefile = flat_frame(tmp_path / 'empty.fits', 0)
+    metrics = calibration_frame_metrics(imagefile)
+    assert metrics['saturated_fraction'] == 0
+    assert metrics['slit_median'] == 0
+    assert np.isnan(metrics['line_snr'])
+    # No slit on the detector
+    mask = mosfire.Mask('LONGSLIT-3x0.7')
+    mask.slitpos['leftBarPositionMM'] = mask.slitpos['rightBarPositionMM']
+    metrics = calibration_frame_metrics(imagefile, mask=mask, imaging=True)
+    assert np.isnan(metrics['slit_median'])
@@ -0,0 +1,178 @@
+import pytest
+
+import mosfire
+from conftest import write_frame
+from mosfire import calibration
+from mosfire.journal import CalibrationJournal, index_columns
+
+
+filters = {'LONGSLIT-3x0.7': ['K', 'H']}
+
+
+def total(budget):
+    return sum(budget['seconds'])
+
+
+def test_estimate_follows_run_options():
+    serial = calibration.estimate_calibration_time(filters, schedule=True)
+    overlapped = calibration.estimate_calibration_time(filters, schedule=True,
+                                                       overlap=True)
+    assert total(overlapped) < total(serial)
+    assert not any('probe' in item for item in serial['item'])
+    adaptive = calibration.estimate_calibration_time(filters,
+                                                     adaptive_flats=True)
+    assert sum('probe' in item for item in adaptive['item']) == 2
+
+
+def test_estimate_skips_frames_in_journal(monkeypatch, tmp_path):
+    monkeypatch.setattr(calibration, 'outdir', lambda: tmp_path)
+    full = calibration.estimate_calibration_time(filters)
+    journal = CalibrationJournal(tmp_path.joinpath('calibration_journal.txt'))
+    journal.mask = 'LONGSLIT-3x0.7'
+    cfg = calibration.read_calibration_config(None)
+    for i in range(1, cfg['K'].flat_count+1):
+        journal.record('K', 'Dome Flat', i)
+    resumed = calibration.estimate_calibration_time(filters, resume=True,
+                                                    adaptive_flats=True)
+    assert total(resumed) < total(full)
+    assert not any(('Dome Flat' in item) and (section == 'K')
+                   for section, item in zip(resumed['section'], resumed['item']))
+
+
+def test_existing_flats_match_tuned_exptime(tmp_path):
+    cfg = calibration.read_calibration_config(None)
+    cfg['K'].flatoff_count = 1
+    mask = mosfire.Mask('LONGSLIT-3x0.7')
+    journal = CalibrationJournal(tmp_path.joinpath('calibration_journal.txt'))
+    journal.mask = mask.name
+    tuned = cfg['K'].flat_exptime + 5
+    journal.record_exptime('K', 'Dome Flat', tuned)
+    rows = [(f'm{i}.fits', frametype, mask.name, 'K', tuned,
+             cfg['K'].flat_coadds, cfg['K'].flat_sampmode, lamps)
+            for i, (frametype, lamps) in enumerate([('Dome Flat', 'on'),
+                                                    ('Dome Flat (lamps off)', 'off')])]
+    index = calibration.Table(rows=rows, names=tuple(index_columns),
+                              dtype=tuple(index_columns.values()))
+    nskipped = calibration.mark_existing_frames(journal, index,
+                                                [(mask, ['K'])], cfg)
+    assert nskipped == 2
+    assert journal.is_done('K', 'Dome Flat', 1)
+    assert journal.is_done('K', 'Dome Flat (lamps off)', 1)
+    # The marks are kept in the journal file
+    resumed = CalibrationJournal(tmp_path.joinpath('calibration_journal.txt'),
+                                 resume=True)
+    resumed.mask = mask.name
+    assert resumed.is_done('K', 'Dome Flat', 1)
+    assert resumed.is_done('K', 'Dome Flat (lamps off)', 1)
+
+
+def test_existing_frames_match_sampmode(tmp_path):
+    cfg = calibration.read_calibration_config({'K': {'ne_arc_count': 1,
+                                                     'ne_arc_sampmode': 'MCDS16'}})
+    mask = mosfire.Mask('LONGSLIT-3x0.7')
+    journal = CalibrationJournal(None)
+    journal.mask = mask.name
+    exptime = cfg['K'].ne_arc_exptime
+    rows = [('m1.fits', 'Ne arc', mask.name, 'K', exptime, 1, 'CDS', '')]
+    index = calibration.Table(rows=rows, names=tuple(index_columns),
+                              dtype=tuple(index_columns.values()))
+    assert calibration.mark_existing_frames(journal, index,
+                                            [(mask, ['K'])], cfg) == 0
+    index['sampmode'][0] = 'MCDS16'
+    assert calibration.mark_existing_frames(journal, index,
+                                            [(mask, ['K'])], cfg) == 1
+
+
+def test_overlap_without_schedule_is_not_used(caplog):
+    with_overlap = calibration.estimate_calibration_time(filters, overlap=True)
+    without = calibration.estimate_calibration_time(filters)
+    assert total(with_overlap) == total(without)
+    assert 'overlap requires schedule=True' in caplog.text
+
+
+def ancestors(steps, name):
+    after = {this_step['name']: this_step['after'] for this_step in steps}
+    found = set()
+    todo = list(after[name])
+    while len(todo) > 0:
+        previous = todo.pop()
+        if previous not in found:
+            found.add(previous)
+            todo.extend(after[previous])
+    return found
+
+
+@pytest.mark.parametrize('build, lamps', [(calibration.arc_steps, ['Ne_on', 'Ar_on']),
+                                          (calibration.flat_steps, ['lamps_on'])])
+def test_lamps_overlap_hatch_and_obsmode(build, lamps):
+    cfg = calibration.read_calibration_config({'K': {'ne_arc_count': 1,
+                                                     'ar_arc_count': 1,
+                                                     'flat_count': 1}})
+    steps = build('K', cfg)
+    names = [this_step['name'] for this_step in steps]
+    hatch = [name for name in names if name.endswith('_hatch')]
+    first_lamp = ancestors(steps, lamps[0])
+    assert 'go_dark' in first_lamp
+    assert 'set_obsmode' not in first_lamp
+    assert not first_lamp.intersection(hatch)
+    # Every exposure waits for the dark, hatch, obsmode, and its lamp
+    for this_step in steps:
+        if this_step['function'] is calibration._take_and_record:
+            before = ancestors(steps, this_step['name'])
+            assert {'go_dark', 'set_obsmode'}.union(hatch).issubset(before)
+            assert before.intersection(lamps)
+
+
+def test_state_counts_commands_from_step_threads():
+    state = calibration.InstrumentState(track=False)
+    steps = [mosfire.step(f'noop_{i}', state._issue, lambda: None)
+             for i in range(200)]
+    mosfire.run_steps(steps, nthreads=8)
+    assert state.issued == 200
+
+
+def test_qa_flags_saturated_flat(tmp_path):
+    cfg = calibration.read_calibration_config(None)
+    imagefile = tmp_path / 'm1.fits'
+    write_frame(imagefile, data=calibration.np.full((64, 64), 60000.0))
+    qa = calibration.CalibrationQA(cfg)
+    qa.check(imagefile, 'K', 'Dome Flat', 1)
+    results = qa.close()
+    assert list(results['ok']) == [False]
+    [(maskname, section, frametype, index, problems)] = qa.failures
+    assert (section, frametype, index) == ('K', 'Dome Flat', 1)
+    assert 'saturated' in problems[0]
+
+
+def test_config_keeps_configparser_access():
+    cfg = calibration.read_calibration_config(None)
+    assert 'K' in cfg.sections()
+    assert cfg['K'].getint('flat_count', 0) == cfg['K'].flat_count
+    assert cfg['K'].getfloat('flat_exptime') == cfg['K'].flat_exptime
+    assert cfg['K'].get('flat_sampmode', 'CDS') == cfg['K'].flat_sampmode
+    assert cfg['K']['flat_count'] == str(cfg['K'].flat_count)
+    assert cfg['K'].getfloat('flat_probe_exptime', 3.0) == 3.0
+    assert calibration.read_calibration_config(cfg) is cfg
+
+
+@pytest.mark.parametrize('sampmode', ['MCDS16x', 'xCDS', 'MCDS'])
+def test_config_rejects_bad_sampmode(sampmode):
+    with pytest.raises(calibration.FailedCondition):
+        calibration.read_calibration_config({'K': {'flat_sampmode': sampmode}})
+
+
+class UnreadableKeyword(object):
+    def read(self):
+        raise RuntimeError('dry run read a keyword')
+
+
+def test_estimate_does_not_read_keywords(monkeypatch):
+    monkeypatch.setattr(calibration.ktl, 'cache',
+                        lambda *args, **kwargs: UnreadableKeyword())
+    mask = mosfire.Mask('LONGSLIT-3x0.7')
+    estimates = [total(calibration.estimate_calibration_time(
+                     filters, current_mask=mask, hatch='Closed',
+                     obsmode='K-spectroscopy'))
+                 for i in range(2)]
+    assert estimates[0] == estimates[1]
+    assert estimates[0] > 0
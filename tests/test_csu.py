@@ -0,0 +1,141 @@
+import pytest
+
+import ktl
+import numpy as np
+
+import mosfire
+from mosfire import csu
+from mosfire.core import FailedCondition
+
+
+class RecordingKeyword(object):
+    def __init__(self, name, service):
+        self.name = name
+        self.service = service
+
+    def write(self, value, **kwargs):
+        self.service.writes[self.name] = value
+        self.service.values[self.name] = value
+
+    def read(self, **kwargs):
+        return str(self.service.values.get(self.name, ''))
+
+
+class RecordingService(object):
+    def __init__(self, current_mask=None):
+        self.writes = {}
+        self.values = {}
+        if current_mask is not None:
+            # The controller's targets match the current bar positions
+            for barno, position in enumerate(csu.bar_positions(current_mask)):
+                self.values[f'B{barno+1:02d}TARG'] = position
+
+    def __getitem__(self, name):
+        return RecordingKeyword(name, self)
+
+
+def setup_minimal(monkeypatch, stale={}):
+    current_mask = mosfire.Mask('LONGSLIT-46x0.7')
+    service = RecordingService(current_mask=current_mask)
+    service.values.update(stale)
+    monkeypatch.setattr(ktl, 'cache', lambda *args, **kwargs: service,
+                        raising=False)
+    mask = mosfire.Mask('LONGSLIT-3x0.7')
+    mask.slitpos['leftBarPositionMM'] += 1.0
+    mask.slitpos['rightBarPositionMM'] += 1.0
+    plan = csu.plan_mask_moves(mask, current_mask=current_mask)
+    assert 0 < len(plan) < 92
+    csu.setup_mask(mask, wait=False, minimal=True, current_mask=current_mask,
+                   skipprecond=True, skippostcond=True)
+    written = {int(name[1:3]): value for name, value in service.writes.items()
+               if name.endswith('TARG')}
+    return service, plan, current_mask, mask, written
+
+
+def test_setup_mask_minimal_writes_only_planned_bars(monkeypatch):
+    service, plan, current_mask, mask, written = setup_minimal(monkeypatch)
+    assert set(written) == set(plan['barNumber'])
+    assert service.writes['SETUPNAME'] == mask.name
+
+
+def test_setup_mask_minimal_resets_stale_targets(monkeypatch):
+    stale = {'B01TARG': 100.0, 'B90TARG': 'garbage'}
+    service, plan, current_mask, mask, written = setup_minimal(monkeypatch,
+                                                               stale=stale)
+    assert set(written) == set(plan['barNumber']) | {1, 90}
+    current = csu.bar_positions(current_mask)
+    assert written[1] == pytest.approx(current[0])
+    assert written[90] == pytest.approx(current[89])
+
+
+def test_masks_match_compares_bar_positions():
+    mask = mosfire.Mask('LONGSLIT-3x0.7')
+    current_mask = mosfire.Mask('LONGSLIT-3x0.7')
+    current_mask.name = 'From csu_bar_state'
+    assert csu.masks_match(current_mask, mask)
+    assert not csu.masks_match(mosfire.Mask('LONGSLIT-3x1.0'), mask)
+
+
+def test_validate_mask_reports_violations():
+    mask = mosfire.Mask('LONGSLIT-46x0.7')
+    assert len(csu.validate_mask(mask)) == 0
+    slitpos = mask.slitpos
+    row = {slitno: i for i, slitno in enumerate(slitpos['slitNumber'])}
+    # Bars of slit 10 cross, slit 20 runs past the end of travel, and the
+    # right bar of slit 30 belongs to another slit
+    slitpos['leftBarPositionMM'][row[10]] = slitpos['rightBarPositionMM'][row[10]] - 1
+    slitpos['leftBarPositionMM'][row[20]] = mosfire.core.csu_bar_max_mm + 1
+    slitpos['rightBarNumber'][row[30]] = 1
+    violations = csu.validate_mask(mask)
+    assert list(violations['slitNumber']) == [10, 20, 30]
+    assert list(violations['barNumber']) == [20, 40, 1]
+    assert 'collide' in violations['problem'][0]
+    assert 'out of range' in violations['problem'][1]
+    assert 'does not belong' in violations['problem'][2]
+
+
+def test_parse_csu_bar_state_out_of_order_and_malformed():
+    lines = ['2,150.5,OK\n', '1,149.5,OK\n', '\n', '3,garbage,OK\n',
+             '4,140.0\n', '92,10.0,Moving\n']
+    positions, states = csu.parse_csu_bar_state(lines)
+    assert positions[0] == 149.5
+    assert positions[1] == 150.5
+    assert positions[91] == 10.0
+    assert states[91] == 'Moving'
+    # Malformed lines leave their bars unknown
+    assert np.isnan(positions[2]) and np.isnan(positions[3])
+    assert states[3] == ''
+    with pytest.raises(FailedCondition):
+        csu.parse_csu_bar_state(lines, max_malformed=1)
+
+
+@pytest.mark.parametrize('barno', [0, 93])
+def test_parse_csu_bar_state_rejects_bar_out_of_range(barno):
+    with pytest.raises(FailedCondition):
+        csu.parse_csu_bar_state(['1,149.5,OK\n', f'{barno},10.0,OK\n'])
+
+
+@pytest.mark.parametrize('with_mask', [True, False])
+def test_execute_mask_records_moves_given_the_mask(monkeypatch, with_mask):
+    mask = mosfire.Mask('LONGSLIT-3x0.7')
+    states = []
+    def read_state():
+        states.append(mosfire.Mask('LONGSLIT-46x0.7'))
+        return states[-1]
+    recorded = []
+    setupgo = RecordingService()['SETUPGO']
+    monkeypatch.setattr(ktl, 'cache', lambda *args, **kwargs: setupgo,
+                        raising=False)
+    monkeypatch.setattr(csu, 'read_csu_bar_state', read_state)
+    monkeypatch.setattr(csu, 'waitfor_CSU', lambda **kwargs: None)
+    monkeypatch.setattr(csu, 'sleep', lambda seconds: None)
+    monkeypatch.setattr(csu, 'record_csu_move',
+                        lambda *args: recorded.append(args))
+    csu.execute_mask(mask=mask if with_mask else None, skipprecond=True)
+    if with_mask:
+        assert len(recorded) == 1
+        assert len(states) == 2
+    else:
+        # Neither a prediction nor a record needs the CSU state
+        assert recorded == []
+        assert states == []
@@ -0,0 +1,150 @@
+import pytest
+
+from conftest import Keyword, write_frame
+from mosfire import detector
+
+
+@pytest.fixture
+def server(monkeypatch):
+    '''Keyword values on the server, created on first use.
+    '''
+    values = {('mds', 'ITIME'): '5000.0',
+              ('mds', 'COADDS'): '1',
+              ('mds', 'SAMPMODE'): '2',
+              ('mds', 'NUMREADS'): '1',
+              ('mds', 'OBJECT'): 'dark'}
+    keywords = {key: Keyword(value) for key, value in values.items()}
+    def cache(service=None, keyword=None):
+        return keywords.setdefault((service, keyword), Keyword('0'))
+    monkeypatch.setattr(detector.ktl, 'cache', cache)
+    return keywords
+
+
+def writes(server):
+    return {keyword: kw.writes for (service, keyword), kw in server.items()
+            if len(kw.writes) > 0}
+
+
+def test_apply_skips_unchanged_parameters(server):
+    config = detector.ExposureConfig(monitor=False)
+    assert config.apply(exptime=5, coadds=1, sampmode='CDS', object='dark') == 0
+    assert writes(server) == {}
+    assert config.skipped == 4
+
+
+def test_apply_writes_changes_once_and_verifies_in_one_read(server):
+    config = detector.ExposureConfig(monitor=False)
+    config.refresh()
+    gathered = []
+    read = config._read
+    def record_read(keywords):
+        keywords = list(keywords)
+        gathered.append(sorted(keywords))
+        return read(keywords)
+    config._read = record_read
+    assert config.apply(exptime=10, coadds=2, sampmode='CDS') == 2
+    assert writes(server) == {'ITIME': [10000.0], 'COADDS': [2]}
+    # One read to confirm the skipped SAMPMODE, one to verify the writes
+    assert gathered == [['SAMPMODE'], ['COADDS', 'ITIME']]
+    assert config.parameters() == (10, 2, 'CDS')
+
+
+def test_apply_catches_a_stale_cache(server):
+    config = detector.ExposureConfig(monitor=False)
+    config.refresh()
+    # Changed by another client, the cache is not monitored
+    server[('mds', 'COADDS')].value = '4'
+    assert config.apply(coadds=1) == 1
+    assert writes(server) == {'COADDS': [1]}
+    assert config.current['COADDS'] == '1'
+
+
+def test_set_functions_update_the_shared_cache(server, monkeypatch):
+    config = detector.ExposureConfig(monitor=False)
+    config.refresh()
+    monkeypatch.setattr(detector, '_exposure_config', config)
+    detector.set_coadds(3, skippostcond=True)
+    detector.set_sampmode('MCDS8', skippostcond=True)
+    assert config.parameters() == (5, 3, 'MCDS8')
+
+
+def test_targets_parse_sampmode():
+    config = detector.ExposureConfig(monitor=False)
+    assert config.targets(sampmode='MCDS16') == {'SAMPMODE': 3, 'NUMREADS': 16}
+    assert config.targets(sampmode='CDS') == {'SAMPMODE': 2}
+    with pytest.raises(detector.FailedCondition):
+        config.targets(sampmode='XYZ')
+
+
+def run_sequence(monkeypatch, tmp_path, coadds_written):
+    """Take three frames, the third with 2 coadds.  The frames are written
+    with the given COADDS in their headers.
+    """
+    config = detector.ExposureConfig(monitor=False)
+    monkeypatch.setattr(detector, '_exposure_config', config)
+    for name in ['waitfor_exposure', 'waitfor_mds_ready']:
+        monkeypatch.setattr(detector, name, lambda *args, **kwargs: None)
+    files = [write_frame(tmp_path / f'm{i+1}.fits', ITIME=5000, COADDS=coadds)
+             for i, coadds in enumerate(coadds_written)]
+    written = iter(files)
+    monkeypatch.setattr(detector, 'lastfile', lambda **kwargs: next(written))
+    monkeypatch.setattr(detector.path_resolver, 'find', lambda imagefile: imagefile)
+    frames = [detector.exposure_frame(exptime=5, coadds=1, sampmode='CDS',
+                                      object='A', frameid='A'),
+              detector.exposure_frame(object='B', frameid='B'),
+              detector.exposure_frame(coadds=2, object='A', frameid='A')]
+    return detector.ExposureSequence(frames).run()
+
+
+def test_sequence_sets_parameters_and_profiles_frames(server, monkeypatch,
+                                                      tmp_path, caplog):
+    logfile = detector.start_exposure_profiling(tmp_path / 'profile.csv')
+    try:
+        found = run_sequence(monkeypatch, tmp_path, [1, 1, 2])
+    finally:
+        detector.stop_exposure_profiling()
+    assert [imagefile.name for imagefile in found] == ['m1.fits', 'm2.fits', 'm3.fits']
+    assert writes(server)['COADDS'] == [2]
+    assert 'ITIME' not in writes(server)
+    assert writes(server)['FRAMEID'] == ['A', 'B', 'A']
+    assert not any(record.levelname == 'ERROR' for record in caplog.records)
+    summary = detector.summarize_exposure_profile(logfile)
+    assert sorted(zip(summary['coadds'], summary['nframes'])) == [(1, 2), (2, 1)]
+
+
+def test_sequence_reports_parameters_of_the_next_frame_in_a_header(
+        server, monkeypatch, tmp_path, caplog):
+    # The coadds for frame 3 reached the header of frame 2
+    run_sequence(monkeypatch, tmp_path, [1, 2, 2])
+    errors = [record.getMessage() for record in caplog.records
+              if record.levelname == 'ERROR']
+    assert len(errors) == 1
+    assert errors[0].startswith('m2.fits was taken with 5.000 s x 2 coadds')
+
+
+def test_apply_with_monitor_reads_only_to_verify(server):
+    config = detector.ExposureConfig()
+    config.refresh()
+    reads = {key: kw.reads for key, kw in server.items()}
+    assert config.apply(exptime=5, coadds=1, sampmode='CDS') == 0
+    assert {key: kw.reads for key, kw in server.items()} == reads
+    assert config.apply(coadds=2, sampmode='CDS') == 1
+    assert server[('mds', 'COADDS')].reads == reads[('mds', 'COADDS')] + 1
+    assert server[('mds', 'SAMPMODE')].reads == reads[('mds', 'SAMPMODE')]
+
+
+def test_profile_log_per_night(monkeypatch, tmp_path):
+    monkeypatch.setattr(detector, 'exposure_profile_directory', tmp_path)
+    logfile = detector.start_exposure_profiling()
+    try:
+        profile = detector.ExposureProfile()
+        for phase in detector.ExposureProfile.phases:
+            profile.mark(phase)
+        detector._record_profile(profile, tmp_path / 'm1.fits',
+                                 parameters=(5, 1, 'CDS'))
+    finally:
+        detector.stop_exposure_profiling()
+    night = detector.datetime.utcnow().strftime('%Y%m%d')
+    assert logfile == tmp_path / f'exposure_profile_{night}.csv'
+    summary = detector.summarize_exposure_profile(night=night)
+    assert list(summary['nframes']) == [1]
@@ -0,0 +1,144 @@
+import pytest
+
+pytest.importorskip('astropy')
+
+import find_read_timeouts as frt
+
+
+def filename_line(name):
+    return f'mds: lastFilename = Z:\\\\data\\\\{name}.fits\n'
+
+
+timeout_line = f'mds: exposureStatus = {frt.timeout_string}\n'
+abort_line = 'mds: exposureStatus = Exposure Aborted: Fits writing complete\n'
+
+
+def baseline(logfile):
+    return frt.find_read_timeouts(logfile=logfile)
+
+
+def indexed(tmp_path, logfile):
+    index = frt.ScanIndex(tmp_path / 'index.json')
+    index.update([logfile])
+    index.save()
+    return frt.ScanIndex(tmp_path / 'index.json')
+
+
+@pytest.mark.parametrize('text', [
+    filename_line('m1') + timeout_line + filename_line('m2').rstrip('\n'),
+    filename_line('m1') + abort_line.rstrip('\n'),
+    filename_line('m1') + filename_line('m2').rstrip('\n'),
+])
+def test_index_counts_last_line_without_newline(tmp_path, text):
+    logfile = tmp_path / '23jan01_mds.log'
+    logfile.write_text(text)
+    index = indexed(tmp_path, logfile)
+    assert index.results([logfile]) == baseline(logfile)
+    # A second update of the unchanged file must give the same answer
+    assert index.update([logfile]) == (0, 0)
+    assert index.results([logfile]) == baseline(logfile)
+
+
+def test_index_resolves_tail_abort_when_file_grows(tmp_path):
+    logfile = tmp_path / '23jan01_mds.log'
+    logfile.write_text(filename_line('m1') + abort_line.rstrip('\n'))
+    index = indexed(tmp_path, logfile)
+    assert index.results([logfile])[1]['Abort'] == ['']
+    with open(logfile, 'a') as fileobj:
+        fileobj.write('\n' + filename_line('m2'))
+    index.update([logfile])
+    assert index.results([logfile]) == baseline(logfile)
+    assert index.results([logfile])[1]['Abort'] == ['m2.fits']
+
+
+def line_by_line(text):
+    '''The original scan: each line is searched with the regular expressions
+    and the file name of an abort is taken from the next line.
+    '''
+    lines = text.splitlines(keepends=True)
+    all_files = []
+    aborted_files = {'Read Timeout': [], 'Abort': []}
+    for i, line in enumerate(lines):
+        match_filename = frt.find_filename.search(line)
+        if match_filename is not None:
+            all_files.append(match_filename.group(2))
+        if frt.find_abort.search(line) is not None:
+            type_str = {True: 'Read Timeout',
+                        False: 'Abort'}[frt.timeout_string in line]
+            next_line = lines[i+1] if i+1 < len(lines) else ''
+            match_filename = frt.find_filename.search(next_line)
+            filename = match_filename.group(2) if match_filename is not None else ''
+            aborted_files[type_str].append(filename)
+    return all_files, aborted_files
+
+
+def sample_log(seed, nlines=400):
+    '''A log with file names, aborts followed by their file name, aborts with
+    no file name, back to back aborts, and other lines.
+    '''
+    lines = []
+    for i in range(nlines):
+        kind = (seed*7 + i*13) % 11
+        if kind < 5:
+            lines.append(f'mds: heartbeat {seed} {i}\n')
+        elif kind < 8:
+            lines.append(filename_line(f'm{seed}_{i:04d}'))
+        elif kind == 8:
+            lines.append(timeout_line)
+        elif kind == 9:
+            lines.append(abort_line)
+        else:
+            lines.append(abort_line)
+            lines.append(timeout_line)
+    return ''.join(lines)
+
+
+@pytest.mark.parametrize('use_mmap', [False, True])
+def test_scanner_matches_line_by_line_scan(tmp_path, use_mmap):
+    text = sample_log(1)
+    logfile = tmp_path / '23jan01_mds.log'
+    logfile.write_text(text)
+    expected = line_by_line(text)
+    assert len(expected[1]['Read Timeout']) > 0 and '' in expected[1]['Abort']
+    assert frt.find_read_timeouts(logfile=logfile, use_mmap=use_mmap) == expected
+
+
+def test_index_matches_line_by_line_scan_when_abort_is_split(tmp_path):
+    text = sample_log(2)
+    # Stop the first part of the log right after an abort, so its file name
+    # is only in the second part
+    split = text.index(timeout_line) + len(timeout_line)
+    logfile = tmp_path / '23jan01_mds.log'
+    logfile.write_text(text[:split])
+    index = indexed(tmp_path, logfile)
+    with open(logfile, 'a') as fileobj:
+        fileobj.write(text[split:])
+    nparsed, nbytes = index.update([logfile])
+    assert nbytes == len(text) - split
+    assert index.results([logfile]) == line_by_line(text)
+
+
+def test_year_merge_order_with_process_pool(tmp_path, monkeypatch):
+    monkeypatch.setattr(frt, 'mds_log_directory', tmp_path)
+    texts = {}
+    for seed, name in enumerate(['23jan02', '23feb01', '23jan01', '23mar15']):
+        texts[name] = sample_log(seed, nlines=100+50*seed)
+        (tmp_path / f'{name}_mds.log').write_text(texts[name])
+    abort_file = tmp_path / 'aborts_2023.log'
+
+    frt.find_read_timeouts_by_year(23, use_index=False)
+    serial = abort_file.read_text()
+    abort_file.unlink()
+    with frt.ProcessPoolExecutor(max_workers=2) as executor:
+        frt.find_read_timeouts_by_year(23, executor=executor)
+    assert abort_file.read_text() == serial
+
+    expected = {'Read Timeout': [], 'Abort': []}
+    for name in sorted(texts.keys()):
+        all_files, aborted_files = line_by_line(texts[name])
+        for type_str in expected.keys():
+            expected[type_str].extend(aborted_files[type_str])
+    aborted = serial.split('\nRead Timeout:\n')[1]
+    timeouts, aborts = aborted.split('\nAborted:\n')
+    assert timeouts.splitlines() == expected['Read Timeout']
+    assert aborts.splitlines() == expected['Abort']
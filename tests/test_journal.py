@@ -0,0 +1,15 @@
+from conftest import write_frame
+from mosfire import journal
+
+
+def test_header_cache_is_kept_outside_the_data_directory(monkeypatch, tmp_path):
+    monkeypatch.setattr(journal, 'header_cache_directory', tmp_path / 'cache')
+    data = tmp_path / 'data'
+    data.mkdir()
+    write_frame(data / 'm1.fits', OBJECT='Ne arc', FILTER='K', ITIME=2000,
+                SAMPMODE=3, NUMREADS=16)
+    index = journal.index_calibration_frames(data)
+    assert len(index) == 1
+    assert index['sampmode'][0] == 'MCDS16'
+    assert sorted(p.name for p in data.iterdir()) == ['m1.fits']
+    assert len(list((tmp_path / 'cache').iterdir())) == 1
@@ -0,0 +1,45 @@
+import pytest
+
+import numpy as np
+
+from conftest import write_frame
+import mosfire
+from mosfire.mask import read_fits_bar_positions_from_directory
+
+
+def mask_frame(fitsfile, **keywords):
+    # Slit n is 2 mm wide, centered on 100 mm
+    for bar in range(1, 93):
+        keywords[f'B{bar:02d}POS'] = 101.0 if bar % 2 == 0 else 99.0
+    return write_frame(fitsfile, **keywords)
+
+
+def test_mask_from_fits_header_reads_bars_and_name(tmp_path):
+    mask_frame(tmp_path / 'm1.fits', MASKNAME='LONGSLIT-46x0.7 ')
+    mask = mosfire.Mask(str(tmp_path / 'm1.fits'))
+    assert mask.name == 'LONGSLIT-46x0.7'
+    assert len(mask.slitpos) == 46
+    assert np.all(mask.slitpos['leftBarPositionMM'] == 101.0)
+    assert np.all(mask.slitpos['rightBarPositionMM'] == 99.0)
+
+
+def test_mask_from_fits_header_without_maskname(tmp_path):
+    mask_frame(tmp_path / 'm1.fits')
+    mask = mosfire.Mask(str(tmp_path / 'm1.fits'))
+    assert mask.name is None
+    assert len(mask.slitpos) == 46
+
+
+def test_read_bar_positions_from_directory(tmp_path):
+    for i, maskname in [(3, 'MASK3'), (1, 'MASK1'), (4, 'MASK4')]:
+        mask_frame(tmp_path / f'm{i}.fits', MASKNAME=maskname)
+    # A file truncated in the middle of its header
+    (tmp_path / 'm2.fits').write_bytes((tmp_path / 'm1.fits').read_bytes()[:100])
+    files, masknames, barpos = read_fits_bar_positions_from_directory(tmp_path,
+                                                                      nthreads=4)
+    assert [f.name for f in files] == ['m1.fits', 'm2.fits', 'm3.fits', 'm4.fits']
+    assert masknames == ['MASK1', '', 'MASK3', 'MASK4']
+    assert barpos.shape == (4, 92)
+    assert np.all(np.isnan(barpos[1]))
+    assert np.all(barpos[[0, 2, 3], 1::2] == 101.0)
+    assert np.all(barpos[[0, 2, 3], 0::2] == 99.0)
@@ -0,0 +1,36 @@
+import pytest
+
+from mosfire.core import FailedCondition
+from mosfire.metadata import PathResolver
+
+
+@pytest.fixture
+def resolver(tmp_path):
+    for prefix in ['a', 'b']:
+        (tmp_path / prefix / 'sdata1300').mkdir(parents=True)
+    resolver = PathResolver()
+    resolver.prefixes = [str(tmp_path / 'a'), str(tmp_path / 'b')]
+    return resolver
+
+
+def test_prefix_is_learned_from_the_full_path(tmp_path, resolver):
+    (tmp_path / 'b' / 'sdata1300' / 'm1.fits').touch()
+    assert resolver.find('/sdata1300/m1.fits') == tmp_path / 'b' / 'sdata1300' / 'm1.fits'
+    assert resolver.mapping == {'sdata1300': str(tmp_path / 'b')}
+
+
+def test_missing_file_is_not_remembered(tmp_path, resolver):
+    assert resolver.find('/sdata1300/m1.fits') is None
+    assert resolver.mapping == {}
+
+
+def test_prefix_is_forgotten_when_file_is_missing(tmp_path, resolver):
+    (tmp_path / 'b' / 'sdata1300' / 'm1.fits').touch()
+    resolver.find('/sdata1300/m1.fits')
+    (tmp_path / 'a' / 'sdata1300' / 'm2.fits').touch()
+    assert resolver.find('/sdata1300/m2.fits') == tmp_path / 'a' / 'sdata1300' / 'm2.fits'
+    assert resolver.mapping == {'sdata1300': str(tmp_path / 'a')}
+    resolver.check_async('/sdata1300/m3.fits')
+    with pytest.raises(FailedCondition):
+        resolver.raise_if_missing(wait=True)
+    assert resolver.mapping == {}
@@ -0,0 +1,108 @@
+import pytest
+
+import numpy as np
+
+from conftest import Keyword
+from mosfire import patterns
+from mosfire.tel import slit_angle
+
+
+pscale = 0.1798
+
+
+def along_slit(distance):
+    return distance*np.sin(slit_angle), distance*np.cos(slit_angle)
+
+
+def test_plan_abba():
+    plan = patterns.plan_pattern('ABBA', throw=3.0)
+    assert list(plan['frameid']) == ['A', 'B', 'B', 'A']
+    assert list(plan['yoffset']) == [1.5, -1.5, -1.5, 1.5]
+    moves = [along_slit(1.5), along_slit(-3.0), (0, 0), along_slit(3.0)]
+    assert np.allclose(list(zip(plan['dx'], plan['dy'])), moves)
+    assert not any(plan['via_base'])
+
+
+def test_plan_box5():
+    plan = patterns.plan_pattern('box5', throw=4.0)
+    assert list(plan['frameid']) == ['A', 'B', 'C', 'D', 'E']
+    positions = [(0, 0), (2, 2), (-2, 2), (-2, -2), (2, -2)]
+    assert np.allclose(list(zip(plan['x'], plan['y'])), positions)
+    moves = [(0, 0), (2, 2), (-4, 0), (0, -4), (4, 0)]
+    assert np.allclose(list(zip(plan['dx'], plan['dy'])), moves)
+
+
+@pytest.mark.parametrize('name', ['long2pos', 'long2pos_specphot'])
+def test_plan_long2pos_via_base(name):
+    plan = patterns.plan_pattern(name, pscale=pscale)
+    for i, row in enumerate(plan):
+        if row['via_base']:
+            # The move starts from base, not from the previous position
+            assert i > 0
+            assert np.isclose(row['dx'], row['x'])
+            assert np.isclose(row['dy'], row['y'])
+    assert sum(plan['via_base']) == 1
+    assert sum(plan['settle']) == 2
+
+
+class Telescope(object):
+    '''Offsets relative to base, and the position each frame was taken at.
+    '''
+    def __init__(self):
+        self.position = np.zeros(2)
+        self.frames = []
+
+    def mxy(self, dx, dy, guidecycles=2):
+        self.position = self.position + (dx, dy)
+
+    def sltmov(self, distance):
+        self.mxy(*along_slit(distance))
+
+    def gotobase(self, guidecycles=2):
+        self.position = np.zeros(2)
+
+    def take_exposure(self):
+        self.frames.append(tuple(self.position))
+
+
+def replaced_long2pos(telescope, wide=False):
+    '''The offsets made by acq_long2pos before it used run_pattern.
+    '''
+    offsetx, offsety = 245.8*pscale, -88.0*pscale
+    for sign in [+1, -1]:
+        telescope.mxy(sign*offsetx, sign*offsety)
+        if wide is True:
+            telescope.take_exposure()
+        telescope.sltmov(-7)
+        telescope.take_exposure()
+        telescope.sltmov(14)
+        telescope.take_exposure()
+        telescope.gotobase()
+
+
+@pytest.mark.parametrize('name, wide', [('long2pos', False),
+                                        ('long2pos_specphot', True)])
+def test_run_long2pos_matches_replaced_script(monkeypatch, name, wide):
+    expected = Telescope()
+    replaced_long2pos(expected, wide=wide)
+
+    telescope = Telescope()
+    monkeypatch.setattr(patterns, 'mxy', telescope.mxy)
+    monkeypatch.setattr(patterns, 'gotobase', telescope.gotobase)
+    for function in ['markbase', 'start_scriptrun', 'stop_scriptrun']:
+        monkeypatch.setattr(patterns, function, lambda: None)
+    monkeypatch.setattr(patterns.ktl, 'cache', lambda *args, **kwargs: Keyword(''))
+    class Sequence(object):
+        def __init__(self, frames):
+            self.frames = frames
+        def run(self):
+            for frame in self.frames:
+                if frame['before'] is not None:
+                    frame['before']()
+                telescope.take_exposure()
+            return []
+    monkeypatch.setattr(patterns, 'ExposureSequence', Sequence)
+
+    patterns.run_pattern(name, pscale=pscale)
+    assert np.allclose(telescope.frames, expected.frames)
+    assert np.allclose(telescope.position, (0, 0))
@@ -0,0 +1,33 @@
+import itertools
+
+import mosfire
+from mosfire import calibration, planner
+
+
+def block_order_cost(order, cfg, state):
+    cost = 0
+    for block in order:
+        duration, state = planner.block_mechanism_time(block, state, cfg)
+        cost += duration
+    return cost
+
+
+def test_plan_interleaves_filters_within_a_mask():
+    cfg = calibration.read_calibration_config(None)
+    cfg['H'].ne_arc_count = 1
+    cfg['H'].ar_arc_count = 1
+    mask = mosfire.Mask('LONGSLIT-3x0.7')
+    plan, predicted_time = planner.plan_calibrations(
+                               [(mask, ['K', 'H'])], cfg, current_mask=mask,
+                               hatch='Closed')
+    start = ('Closed', None, None)
+    grouped = [(mask, 'K', 'arcs'), (mask, 'H', 'arcs'),
+               (mask, 'K', 'flats'), (mask, 'H', 'flats')]
+    assert predicted_time == block_order_cost(plan, cfg, start)
+    assert predicted_time < block_order_cost(grouped, cfg, start)
+    assert predicted_time == min(block_order_cost(order, cfg, start)
+                                 for order in itertools.permutations(grouped))
+    # The obsmode is kept across the hatch move
+    caltypes = [caltype for mask, filt, caltype in plan]
+    hatch_move = caltypes.index('flats')
+    assert plan[hatch_move-1][1] == plan[hatch_move][1]
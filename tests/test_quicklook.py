@@ -0,0 +1,51 @@
+import pytest
+
+import numpy as np
+
+from conftest import write_frame
+from mosfire import quicklook
+
+
+def noisy_frame(fitsfile, sampmode, numreads, coadds, noise, level=1000.0):
+    rng = np.random.default_rng(42)
+    data = level*coadds + rng.normal(0, noise, size=(256, 256))
+    return write_frame(fitsfile, data=data.astype(np.float32),
+                       SAMPMODE=sampmode, NUMREADS=numreads, COADDS=coadds)
+
+
+@pytest.mark.parametrize('sampmode, numreads, coadds', [(2, 1, 1),
+                                                        (3, 16, 1),
+                                                        (3, 4, 4)])
+def test_stats_noise_ratio(tmp_path, sampmode, numreads, coadds):
+    expected = quicklook.cds_read_noise/np.sqrt(numreads if sampmode == 3 else 1)
+    noise = expected*np.sqrt(coadds)
+    frame = quicklook.QuickLookFrame(noisy_frame(tmp_path / 'm1.fits', sampmode,
+                                                 numreads, coadds, noise))
+    stats = frame.stats()
+    frame.close()
+    assert frame.sampmode == ('CDS' if sampmode == 2 else f'MCDS{numreads}')
+    assert stats['median_per_coadd'] == pytest.approx(1000, abs=1)
+    assert stats['std'] == pytest.approx(noise, rel=0.05)
+    assert stats['noise_ratio'] == pytest.approx(1, rel=0.05)
+
+
+def test_read_noise_scales_with_mcds_reads():
+    assert quicklook.read_noise('CDS') == quicklook.cds_read_noise
+    assert quicklook.read_noise('MCDS16') == pytest.approx(quicklook.cds_read_noise/4)
+
+
+def test_frame_cache_closes_evicted_frames(tmp_path, monkeypatch):
+    quicklook.clear_quicklook_cache()
+    monkeypatch.setattr(quicklook, 'frame_cache_size', 2)
+    closed = []
+    close = quicklook.QuickLookFrame.close
+    def record_close(frame):
+        closed.append(frame.file.name)
+        close(frame)
+    monkeypatch.setattr(quicklook.QuickLookFrame, 'close', record_close)
+    files = [noisy_frame(tmp_path / f'm{i}.fits', 2, 1, 1, 5) for i in range(3)]
+    frames = [quicklook.quicklook_frame(imagefile) for imagefile in files]
+    assert closed == ['m0.fits']
+    assert quicklook.quicklook_frame(files[2]) is frames[2]
+    quicklook.clear_quicklook_cache()
+    assert sorted(closed) == ['m0.fits', 'm1.fits', 'm2.fits']
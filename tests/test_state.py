@@ -0,0 +1,76 @@
+import pytest
+
+from conftest import Keyword
+from mosfire import state as state_module
+from mosfire.state import InstrumentState
+
+
+@pytest.fixture
+def server(monkeypatch):
+    '''Keyword values on the server, and the list of commands issued.
+    '''
+    values = {('mosfire', 'FILTER'): 'K',
+              ('mosfire', 'OBSMODE'): 'K-spectroscopy',
+              ('mmdcs', 'POSNAME'): 'Open',
+              ('mp1s', 'PWSTAT7'): '0',
+              ('mp1s', 'PWSTAT8'): '0',
+              ('dcs', 'FLAMP1'): 'off',
+              ('dcs', 'FLAMP2'): 'off',
+              ('dcs', 'FPOWER'): '0'}
+    keywords = {key: Keyword(value) for key, value in values.items()}
+    monkeypatch.setattr(state_module.ktl, 'cache',
+                        lambda service=None, keyword=None: keywords[(service, keyword)])
+    issued = []
+    # Each command records itself and moves the mechanism on the server
+    effects = {'go_dark': lambda: {('mosfire', 'FILTER'): 'Dark'},
+               'set_obsmode': lambda mode: {('mosfire', 'OBSMODE'): mode,
+                                            ('mosfire', 'FILTER'): mode.split('-')[0]},
+               'open_hatch': lambda: {('mmdcs', 'POSNAME'): 'Open'},
+               'close_hatch': lambda: {('mmdcs', 'POSNAME'): 'Closed'}}
+    def command(name):
+        def issue(*args):
+            issued.append((name,) + args)
+            for key, value in effects[name](*args).items():
+                keywords[key].value = value
+        return issue
+    for name in effects.keys():
+        monkeypatch.setattr(state_module, name, command(name))
+    return keywords, issued
+
+
+def test_redundant_commands_are_elided(server):
+    keywords, issued = server
+    state = InstrumentState(monitor=False)
+    state.set_obsmode('K-spectroscopy')
+    state.open_hatch()
+    assert issued == []
+    state.go_dark()
+    state.go_dark()
+    state.close_hatch()
+    state.close_hatch()
+    assert issued == [('go_dark',), ('close_hatch',)]
+    assert state.report() == (2, 4, 0)
+
+
+def test_stale_value_is_read_before_skipping(server):
+    keywords, issued = server
+    state = InstrumentState(monitor=False)
+    # The hatch was closed and the filter moved without the model seeing it
+    keywords[('mmdcs', 'POSNAME')].value = 'Closed'
+    keywords[('mosfire', 'FILTER')].value = 'Dark'
+    state.open_hatch()
+    state.set_obsmode('K-spectroscopy')
+    assert issued == [('open_hatch',), ('set_obsmode', 'K-spectroscopy')]
+
+
+def test_monitored_values_are_not_read_before_skipping(server):
+    keywords, issued = server
+    state = InstrumentState()
+    reads = {key: kw.reads for key, kw in keywords.items()}
+    state.set_obsmode('K-spectroscopy')
+    state.open_hatch()
+    state.Ne_lamp('off')
+    state.dome_flat_lamps('off')
+    assert issued == []
+    assert state.report() == (0, 4, 0)
+    assert {key: kw.reads for key, kw in keywords.items()} == reads
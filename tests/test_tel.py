@@ -0,0 +1,14 @@
+import pytest
+
+from mosfire.tel import OffsetJournal
+
+
+def test_offset_journal_writes_records_in_order_on_flush(tmp_path):
+    journal = OffsetJournal()
+    logfile = tmp_path / 'instrumentOffsets'
+    messages = [f'2026/10/19,03:00:{i:02d}        offset {i}' for i in range(20)]
+    for message in messages:
+        journal.log(logfile, message)
+    journal.flush()
+    assert logfile.read_text().splitlines() == messages
+    journal.close()